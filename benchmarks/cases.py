@@ -0,0 +1,169 @@
+"""
+Benchmark cases for trampoline.
+
+Django must be set up before this module is imported.
+"""
+from timeit import default_timer
+
+import django
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+
+from elasticsearch_dsl import Index
+
+from tests.doc_types import TokenDoc
+from tests.models import Person
+from tests.models import Token
+from trampoline.management.base import ESBaseCommand
+from trampoline.paginator import ESSearchPaginator
+from trampoline.tasks import es_index_object
+
+INDEX_NAME = 'foobar'
+# Minimum number of chunks per thread in bench_create_documents.
+CHUNKS_PER_THREAD = 8
+
+
+def summarize(samples):
+    """
+    Summarize durations in seconds as milliseconds.
+    """
+    samples = sorted(samples)
+    count = len(samples)
+    return {
+        'count': count,
+        'mean_ms': sum(samples) / count * 1000,
+        'median_ms': samples[count // 2] * 1000,
+        'p95_ms': samples[min(int(count * 0.95), count - 1)] * 1000,
+        'min_ms': samples[0] * 1000,
+    }
+
+
+def timed(func, *args, **kwargs):
+    start = default_timer()
+    func(*args, **kwargs)
+    return default_timer() - start
+
+
+def setup_database(count):
+    if django.VERSION >= (1, 9):
+        call_command('migrate', run_syncdb=True, verbosity=0)
+    else:  # pragma: no cover
+        call_command('syncdb', interactive=False, verbosity=0)
+    # bulk_create doesn't send post_save, nothing is indexed yet.
+    Token.objects.all().delete()
+    Person.objects.all().delete()
+    Token.objects.bulk_create(
+        Token(name=u"token {0}".format(i)) for i in range(count)
+    )
+    Person.objects.bulk_create(
+        Person(first_name=u"first {0}".format(i), last_name=u"last")
+        for i in range(count)
+    )
+
+
+def setup_index():
+    Index(INDEX_NAME).delete(ignore=404)
+    call_command(
+        'es_create_index',
+        index_name=INDEX_NAME,
+        target_name=INDEX_NAME,
+        verbosity=0
+    )
+
+
+def get_chunk_size(count, threads):
+    """
+    Chunk size giving every thread several chunks of a model, chunks are
+    what es_create_documents parallelizes.
+    """
+    chunk_size = count // (threads * CHUNKS_PER_THREAD)
+    return max(min(chunk_size, ESBaseCommand.CHUNK_SIZE_DEFAULT), 1)
+
+
+def bench_create_documents(thread_counts):
+    """
+    Documents per second indexed by es_create_documents.
+    """
+    token_count = Token.objects.count()
+    person_count = Person.objects.count()
+    count = token_count + person_count
+    # The same for every thread count so that they are comparable.
+    chunk_size = get_chunk_size(
+        min(token_count, person_count),
+        max(thread_counts)
+    )
+    results = {'chunk_size': chunk_size}
+    for threads in thread_counts:
+        for bulk in (False, True):
+            setup_index()
+            duration = timed(
+                call_command,
+                'es_create_documents',
+                index_name=INDEX_NAME,
+                max_threads=threads,
+                chunk_size=chunk_size,
+                bulk=bulk,
+                verbosity=0
+            )
+            key = u"threads_{0}{1}".format(threads, '_bulk' if bulk else '')
+            results[key] = {
+                'seconds': duration,
+                'docs_per_second': count / duration,
+            }
+    return results
+
+
+def bench_index_object(repeat):
+    """
+    Latency of the task es_index_object for a single object.
+    """
+    content_type_id = ContentType.objects.get_for_model(Token).pk
+    object_ids = Token.objects.values_list('pk', flat=True)[:repeat]
+    samples = [
+        timed(es_index_object.run, INDEX_NAME, content_type_id, object_id)
+        for object_id in object_ids
+    ]
+    return summarize(samples)
+
+
+def bench_auto_doc_mapping(repeat, rounds=5):
+    """
+    Cost per object of get_es_auto_doc_mapping, best of several rounds.
+    """
+    persons = list(Person.objects.all()[:repeat])
+    # The mapping plan is compiled on the first call.
+    persons[0].get_es_auto_doc_mapping()
+    best = None
+    for _ in range(rounds):
+        duration = timed(
+            lambda: [person.get_es_auto_doc_mapping() for person in persons]
+        )
+        best = duration if best is None else min(best, duration)
+    return {
+        'count': len(persons),
+        'per_object_us': best / len(persons) * 1000000,
+    }
+
+
+def bench_paginator(pages, page_size=20):
+    """
+    Latency of ESSearchPaginator.page compared to executing the same slice
+    of the search directly.
+    """
+    search = TokenDoc.search().index(INDEX_NAME)
+    paginator = ESSearchPaginator(search, page_size, cache_timeout=0)
+    page_samples = []
+    search_samples = []
+    for page_number in range(1, pages + 1):
+        page_samples.append(timed(lambda: paginator.page(page_number).hits))
+        offset = (page_number - 1) * page_size
+        search_samples.append(
+            timed(search[offset:offset + page_size].execute)
+        )
+    page = summarize(page_samples)
+    raw = summarize(search_samples)
+    return {
+        'page': page,
+        'search': raw,
+        'overhead_ms': page['median_ms'] - raw['median_ms'],
+    }
@@ -0,0 +1,153 @@
+"""
+Run the trampoline benchmarks and store the results as JSON.
+
+    python -m benchmarks.run --output results.json --compare previous.json
+
+ElasticSearch is replaced by an in-memory stand-in server unless --es-host
+is given, or by an in-memory connection without any HTTP with --in-memory.
+"""
+from __future__ import print_function
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+
+import django
+
+from benchmarks.server import StandInServer
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        '--objects',
+        type=int,
+        default=2000,
+        help="Number of objects created per model."
+    )
+    parser.add_argument(
+        '--threads',
+        default='1,2,4',
+        help="Comma separated thread counts used by es_create_documents."
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=200,
+        help="Number of samples of the latency benchmarks."
+    )
+    parser.add_argument(
+        '--es-host',
+        default=None,
+        help="Run against an actual ElasticSearch host."
+    )
+    parser.add_argument(
+        '--in-memory',
+        action='store_true',
+        help="Use the in-memory connection instead of the stand-in server."
+    )
+    parser.add_argument(
+        '--database',
+        default=None,
+        help=(
+            "Path of the sqlite database, trampoline-benchmarks.db in the "
+            "temporary directory by default."
+        )
+    )
+    parser.add_argument(
+        '--output',
+        default=None,
+        help="Path of the JSON file the results are written to."
+    )
+    parser.add_argument(
+        '--compare',
+        default=None,
+        help="Path of previous results to compare with."
+    )
+    return parser.parse_args(argv)
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        key = u"{0}{1}".format(prefix, key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, key + '.'))
+        else:
+            flat[key] = value
+    return flat
+
+
+def compare(previous, current):
+    previous = flatten(previous['results'])
+    current = flatten(current['results'])
+    for key in sorted(current):
+        if key not in previous or not previous[key]:
+            continue
+        change = (current[key] - previous[key]) / float(previous[key]) * 100
+        print(u"{0}: {1:.3f} -> {2:.3f} ({3:+.1f}%)".format(
+            key, previous[key], current[key], change))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    server = None
+    host = backend = args.es_host
+    if args.in_memory:
+        os.environ['TRAMPOLINE_IN_MEMORY'] = '1'
+        backend = 'in-memory'
+    elif host is None:
+        server = StandInServer()
+        server.start()
+        host = server.host
+        backend = 'stand-in'
+    if host is not None:
+        os.environ['TRAMPOLINE_BENCHMARK_HOST'] = host
+    if args.database is not None:
+        os.environ['TRAMPOLINE_BENCHMARK_DB'] = args.database
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    if hasattr(django, 'setup'):
+        django.setup()
+
+    from benchmarks import cases
+    from trampoline import __version__
+
+    thread_counts = [int(threads) for threads in args.threads.split(',')]
+    try:
+        cases.setup_database(args.objects)
+        results = {
+            'create_documents': cases.bench_create_documents(thread_counts),
+            'index_object': cases.bench_index_object(args.repeat),
+            'auto_doc_mapping': cases.bench_auto_doc_mapping(args.repeat),
+            'paginator': cases.bench_paginator(args.repeat // 10 or 1),
+        }
+    finally:
+        if server is not None:
+            server.stop()
+
+    report = {
+        'trampoline': __version__,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'elasticsearch': backend,
+        'date': datetime.datetime.utcnow().isoformat(),
+        'objects': args.objects,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            compare(json.load(previous_file), report)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Stand-in ElasticSearch HTTP server for the trampoline benchmarks.
+
+It serves the in-memory store of trampoline.testing over HTTP, so that the
+numbers measure trampoline and its transport rather than a cluster.
+"""
+import json
+import socket
+import threading
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib.parse import parse_qs
+from six.moves.urllib.parse import urlparse
+
+from trampoline.testing import InMemoryStore
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep connections alive like a real node.
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        # Without it every response of a kept alive connection waits for the
+        # delayed ACK of the client, about 40ms.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        params = dict(
+            (key, values[0]) for key, values in parse_qs(url.query).items()
+        )
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, data = self.server.store.handle(
+            method,
+            url.path,
+            params,
+            body
+        )
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if method != 'HEAD':
+            self.wfile.write(payload)
+
+    def do_HEAD(self):
+        self.dispatch('HEAD')
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+
+class StandInServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0)):
+        BaseHTTPServer.HTTPServer.__init__(self, address, RequestHandler)
+        self.store = InMemoryStore()
+        self.thread = None
+
+    @property
+    def host(self):
+        return u"{0}:{1}".format(*self.server_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
@@ -0,0 +1,29 @@
+"""
+Benchmark settings for trampoline.
+"""
+import os
+import tempfile
+
+from tests.settings import *  # noqa
+
+DATABASES = {
+    'default': {
+        'NAME': os.environ.get(
+            'TRAMPOLINE_BENCHMARK_DB',
+            os.path.join(tempfile.gettempdir(), 'trampoline-benchmarks.db')
+        ),
+        'ENGINE': 'django.db.backends.sqlite3',
+    }
+}
+
+if not TRAMPOLINE_IN_MEMORY:  # noqa
+    TRAMPOLINE['CONNECTIONS'] = {  # noqa
+        'default': {
+            'hosts': os.environ.get('TRAMPOLINE_BENCHMARK_HOST', 'localhost'),
+        },
+    }
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+}
@@ -1,15 +1,49 @@
 """
 Base test case for trampoline.
 """
+from contextlib import contextmanager
+from copy import deepcopy
+
+from django.conf import settings
 from django.test import TransactionTestCase
 
+from elasticsearch_dsl.connections import connections
+
 from trampoline import get_trampoline_config
+from trampoline.testing import get_store
 
 trampoline_config = get_trampoline_config()
 
 
 class BaseTestCase(TransactionTestCase):
 
+    @contextmanager
+    def trampoline_options(self, **options):
+        TRAMPOLINE = deepcopy(settings.TRAMPOLINE)
+        TRAMPOLINE['OPTIONS'].update(options)
+        with self.settings(TRAMPOLINE=TRAMPOLINE):
+            yield
+
+    @contextmanager
+    def write_to(self, *aliases):
+        """
+        Write the documents of foobar to the given connections, among which
+        'mirror' is an in-memory connection.
+        """
+        TRAMPOLINE = deepcopy(settings.TRAMPOLINE)
+        TRAMPOLINE.setdefault('CONNECTIONS', {})['mirror'] = {
+            'hosts': 'mirror',
+            'connection_class': 'trampoline.testing.InMemoryConnection',
+        }
+        TRAMPOLINE['INDICES']['foobar']['write_to'] = aliases
+        try:
+            with self.settings(TRAMPOLINE=TRAMPOLINE):
+                trampoline_config.configure_connections()
+                yield
+        finally:
+            connections.remove_connection('mirror')
+            get_store('mirror').clear()
+
     def refresh(self):
         trampoline_config.connection.indices.refresh('_all')
 
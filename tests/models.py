@@ -9,11 +9,13 @@ from trampoline.mixins import ESIndexableMixin
 
 class Token(ESIndexableMixin, models.Model):
     name = models.CharField(max_length=200)
+    modified = models.DateTimeField(auto_now=True)
 
     def __unicode__(self):
         return self.name
 
     es_doc_type = TokenDoc
+    es_modified_field = 'modified'
 
     def is_indexable(self):
         if self.name == 'not_indexable':
@@ -29,6 +31,8 @@ class Token(ESIndexableMixin, models.Model):
         doc.name = self.name
         if doc.name == 'raise_exception':
             raise RuntimeError
+        if doc.name == 'interrupt':
+            raise KeyboardInterrupt
         return doc
 
 
@@ -1,6 +1,7 @@
 """
 Test settings for trampoline.
 """
+import os
 
 DATABASES = {
     'default': {
@@ -13,6 +14,12 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
 INSTALLED_APPS = (
     'django.contrib.contenttypes',
     'trampoline',
@@ -57,6 +64,16 @@ TRAMPOLINE = {
     },
 }
 
+# Run the tests against the in-memory stand-in instead of a cluster.
+TRAMPOLINE_IN_MEMORY = bool(os.environ.get('TRAMPOLINE_IN_MEMORY'))
+if TRAMPOLINE_IN_MEMORY:
+    TRAMPOLINE['CONNECTIONS'] = {
+        'default': {
+            'hosts': 'localhost',
+            'connection_class': 'trampoline.testing.InMemoryConnection',
+        },
+    }
+
 ##################################################
 #                     Celery                     #
 ##################################################
@@ -0,0 +1,88 @@
+"""
+Test asyncio paginator for trampoline.
+"""
+from unittest import skipIf
+
+from elasticsearch_dsl import Index
+from elasticsearch_dsl import Search
+
+from tests.base import BaseTestCase
+from tests.models import Token
+from tests.views import PaginatedContentView
+
+try:
+    import asyncio
+    from trampoline.aio import AsyncESPaginationMixin
+    from trampoline.aio import AsyncESSearchPaginator
+except ImportError:
+    asyncio = None
+
+
+@skipIf(asyncio is None, "Requires asyncio.")
+class TestAsyncPaginator(BaseTestCase):
+
+    def setUp(self):
+        super(TestAsyncPaginator, self).setUp()
+        self.doc_type = Token.get_es_doc_type()
+        self.index = Index(self.doc_type._doc_type.index)
+        self.index.doc_type(self.doc_type)
+        self.index.create()
+        self.refresh()
+
+        for i in range(3):
+            Token.objects.create(name='token {0}'.format(i))
+        self.refresh()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        super(TestAsyncPaginator, self).tearDown()
+        self.index.delete()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_paginator(self):
+        search = Search(
+            index=Token.es_doc_type._doc_type.index,
+            doc_type=Token.es_doc_type._doc_type.name
+        )
+        search = search.sort('name')
+        paginator = AsyncESSearchPaginator(search, 2)
+
+        page, other_page, cursor_page = self.loop.run_until_complete(
+            asyncio.gather(
+                paginator.page(1),
+                paginator.page(2),
+                paginator.cursor_page(),
+            )
+        )
+        self.assertIn('response', page.__dict__)
+        self.assertEqual(page.total_count, 3)
+        self.assertTrue(page.has_other_pages)
+        self.assertEqual(page.hits[0]['name'], 'token 0')
+        self.assertEqual(other_page.hits[0]['name'], 'token 2')
+        self.assertEqual(cursor_page.hits[1]['name'], 'token 1')
+        self.assertIsNotNone(cursor_page.next_cursor)
+
+    def test_pagination_mixin(self):
+        class Request(object):
+            GET = {'page': 2}
+
+        class AsyncPaginatedContentView(
+                AsyncESPaginationMixin,
+                PaginatedContentView):
+            pass
+
+        view = AsyncPaginatedContentView()
+        view.request = Request()
+        page = self.loop.run_until_complete(view.apage())
+        self.assertIs(view.page, page)
+        self.assertIn('response', page.__dict__)
+        self.assertEqual(page.number, 2)
+        self.assertEqual(len(page.hits), 1)
+        self.assertEqual(view.get_context_data()['page'], page)
+
+        # The page is still available without awaiting apage.
+        view = AsyncPaginatedContentView()
+        view.request = Request()
+        self.assertEqual(len(view.page.hits), 1)
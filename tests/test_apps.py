@@ -0,0 +1,87 @@
+"""
+Test app config for trampoline.
+"""
+from copy import deepcopy
+
+from django.conf import settings
+from elasticsearch_dsl import Index
+
+from tests.base import BaseTestCase
+from tests.doc_types import TokenDoc
+from tests.models import Person
+from tests.models import Token
+from trampoline import get_trampoline_config
+
+trampoline_config = get_trampoline_config()
+
+
+class TestApps(BaseTestCase):
+
+    def test_settings_cache(self):
+        self.assertIs(trampoline_config.settings, trampoline_config.settings)
+
+        with self.trampoline_options(celery_queue='foobar'):
+            self.assertEqual(trampoline_config.celery_queue, 'foobar')
+        self.assertIsNone(trampoline_config.celery_queue)
+
+    def test_registry(self):
+        self.assertEqual(
+            trampoline_config.model_paths,
+            frozenset(['tests.models.Token', 'tests.models.Person'])
+        )
+        self.assertEqual(
+            trampoline_config.get_index_models('foobar'),
+            [Token, Person]
+        )
+        self.assertEqual(trampoline_config.get_index_models('barfoo'), [])
+        self.assertEqual(
+            trampoline_config.get_model_indices(Token),
+            [('foobar', TokenDoc)]
+        )
+        self.assertEqual(trampoline_config.get_model_indices(object), [])
+
+    def test_registry_settings_changed(self):
+        TRAMPOLINE = deepcopy(settings.TRAMPOLINE)
+        TRAMPOLINE['INDICES'] = {
+            'other': {'models': ('tests.models.Token',)},
+        }
+        with self.settings(TRAMPOLINE=TRAMPOLINE):
+            self.assertEqual(
+                trampoline_config.model_paths,
+                frozenset(['tests.models.Token'])
+            )
+            self.assertEqual(
+                trampoline_config.get_index_models('other'),
+                [Token]
+            )
+            self.assertEqual(trampoline_config.get_index_models('foobar'), [])
+            self.assertEqual(
+                trampoline_config.get_model_indices(Token),
+                [('other', TokenDoc)]
+            )
+        self.assertEqual(
+            trampoline_config.get_index_models('foobar'),
+            [Token, Person]
+        )
+
+    def test_signals_settings_changed(self):
+        index = Index('foobar')
+        index.doc_type(TokenDoc)
+        index.create()
+        try:
+            token = Token.objects.create(name='token')
+            self.assertDocExists(token)
+
+            # Models removed from INDICES aren't indexed anymore.
+            TRAMPOLINE = deepcopy(settings.TRAMPOLINE)
+            TRAMPOLINE['INDICES'] = {
+                'foobar': {'models': ('tests.models.Person',)},
+            }
+            with self.settings(TRAMPOLINE=TRAMPOLINE):
+                other_token = Token.objects.create(name='other token')
+                token_id = token.pk
+                token.delete()
+            self.assertDocDoesntExist(other_token)
+            self.assertDocExists(Token, token_id)
+        finally:
+            index.delete()
@@ -0,0 +1,183 @@
+"""
+Test the background indexer for trampoline.
+"""
+import threading
+import time
+
+from elasticsearch_dsl import Index
+
+from trampoline import get_trampoline_config
+from trampoline.background import _running_indexers
+from trampoline.background import BackgroundIndexer
+from trampoline.background import stop_running_indexers
+
+from tests.base import BaseTestCase
+from tests.models import Token
+
+trampoline_config = get_trampoline_config()
+
+
+class RecordTask(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = []
+        self.called = threading.Event()
+
+    def run(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+        self.called.set()
+
+
+class TestBackgroundIndexer(BaseTestCase):
+
+    def test_merge(self):
+        index_task = RecordTask('index')
+        delete_task = RecordTask('delete')
+        indexer = BackgroundIndexer(flush_interval=60)
+        try:
+            indexer.add(index_task, ('foobar', 1), [1])
+            indexer.add(index_task, ('foobar', 1), [2, 3])
+            indexer.add(index_task, ('foobar', 2), [1])
+            indexer.add(index_task, ('other', 1), [4])
+            indexer.add(delete_task, ('foobar', 'token'), [1], using='a')
+            indexer.add(index_task, ('foobar', 2), [5])
+            indexer.add(index_task, ('other', 1), [6])
+            self.assertEqual(index_task.calls, [])
+            indexer.flush()
+        finally:
+            indexer.stop()
+
+        self.assertEqual(index_task.calls, [
+            (('foobar', 1, [1, 2, 3]), {'fail_silently': True}),
+            (('foobar', 2, [1]), {'fail_silently': True}),
+            (('other', 1, [4, 6]), {'fail_silently': True}),
+            (('foobar', 2, [5]), {'fail_silently': True}),
+        ])
+        self.assertEqual(delete_task.calls, [
+            (('foobar', 'token', [1]), {'fail_silently': True, 'using': 'a'}),
+        ])
+
+    def test_batch_size_and_interval(self):
+        task = RecordTask('index')
+        indexer = BackgroundIndexer(batch_size=2, flush_interval=60)
+        try:
+            indexer.add(task, ('foobar', 1), [1])
+            indexer.add(task, ('foobar', 1), [2])
+            indexer.add(task, ('foobar', 1), [3])
+            self.assertTrue(task.called.wait(5))
+            self.assertEqual(task.calls[0][0], ('foobar', 1, [1, 2]))
+        finally:
+            # Pending calls are processed on stop.
+            indexer.stop()
+        self.assertEqual(task.calls[1][0], ('foobar', 1, [3]))
+
+        task = RecordTask('index')
+        indexer = BackgroundIndexer(flush_interval=0.01)
+        try:
+            start = time.time()
+            indexer.add(task, ('foobar', 1), [1])
+            self.assertTrue(task.called.wait(5))
+            self.assertLess(time.time() - start, 5)
+        finally:
+            indexer.stop()
+
+    def test_errors(self):
+        class FailingTask(RecordTask):
+            def run(self, *args, **kwargs):
+                super(FailingTask, self).run(*args, **kwargs)
+                raise RuntimeError
+
+        task = FailingTask('index')
+        indexer = BackgroundIndexer(flush_interval=60)
+        try:
+            indexer.add(task, ('foobar', 1), [1])
+            indexer.flush()
+            # The thread is still running.
+            indexer.add(task, ('foobar', 1), [2])
+            indexer.flush()
+        finally:
+            indexer.stop()
+        self.assertEqual(len(task.calls), 2)
+
+    def test_stop_running_indexers(self):
+        task = RecordTask('index')
+        indexer = BackgroundIndexer(flush_interval=60)
+        other_indexer = BackgroundIndexer(flush_interval=60)
+        try:
+            # Only started indexers are stopped on exit.
+            self.assertNotIn(indexer, _running_indexers)
+            indexer.add(task, ('foobar', 1), [1])
+            self.assertIn(indexer, _running_indexers)
+            self.assertNotIn(other_indexer, _running_indexers)
+
+            stop_running_indexers()
+            self.assertEqual(indexer.threads, [])
+            self.assertNotIn(indexer, _running_indexers)
+            self.assertEqual(task.calls[0][0], ('foobar', 1, [1]))
+        finally:
+            indexer.stop()
+
+
+class TestBackgroundBackend(BaseTestCase):
+
+    def setUp(self):
+        super(TestBackgroundBackend, self).setUp()
+        self.doc_type = Token.get_es_doc_type()
+        self.index = Index(self.doc_type._doc_type.index)
+        self.index.doc_type(self.doc_type)
+        self.index.create()
+        self.refresh()
+
+    def tearDown(self):
+        super(TestBackgroundBackend, self).tearDown()
+        self.index.delete()
+
+    def test_backend(self):
+        with self.trampoline_options(
+                backend='thread',
+                background_flush_interval=60):
+            indexer = trampoline_config.background_indexer
+            token = Token.objects.create(name='token')
+            other_token = Token.objects.create(name='other token')
+            self.assertDocDoesntExist(token)
+            indexer.flush()
+            self.assertDocExists(token)
+            self.assertDocExists(other_token)
+
+            token_id = token.pk
+            token.delete()
+            self.assertDocExists(Token, token_id)
+            indexer.flush()
+            self.assertDocDoesntExist(Token, token_id)
+
+            Token.es_delete_many([other_token.pk])
+            indexer.flush()
+            self.assertDocDoesntExist(other_token)
+            Token.es_index_many([other_token.pk])
+            indexer.flush()
+            self.assertDocExists(other_token)
+
+            # An index followed by a delete of the same object.
+            token = Token.objects.create(name='token')
+            token_id = token.pk
+            token.delete()
+            indexer.flush()
+            self.assertDocDoesntExist(Token, token_id)
+
+            # Synchronous calls don't go through the indexer.
+            token = Token.objects.create(name='token')
+            token.es_index(async=False)
+            self.assertDocExists(token)
+
+            Token.es_inline_doc = True
+            try:
+                token.name = 'kento'
+                token.save()
+                indexer.flush()
+                self.assertEqual(token.get_es_doc().name, 'kento')
+            finally:
+                Token.es_inline_doc = False
+
+        # Changing the settings stops the indexer.
+        self.assertEqual(indexer.threads, [])
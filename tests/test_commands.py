@@ -1,18 +1,55 @@
 """
 Test management commands for trampoline.
 """
+import datetime
+import multiprocessing
+import os
+import shutil
+import tempfile
+from unittest import skipIf
+
+from django.apps import apps
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.management import call_command
+from django.utils import timezone
 
 from elasticsearch_dsl import Index
+from elasticsearch_dsl.connections import connections
 
 from tests.base import BaseTestCase
 from tests.models import Token
 from trampoline import get_trampoline_config
+from trampoline.cache import GENERATION_KEY
+from trampoline.management.commands.es_create_documents import (
+    ChunkTracker
+)
+from trampoline.management.commands.es_create_documents import (
+    Command as CreateDocumentsCommand
+)
+from trampoline.management.commands.es_create_documents import (
+    index_pk_range
+)
+from trampoline.management.commands.es_create_documents import (
+    iter_pk_ranges
+)
+from trampoline.management.commands.es_create_documents import (
+    parse_since
+)
+from trampoline.management.state import IndexationState
+from trampoline.management.workers import init_worker_process
+from trampoline.management.commands.es_create_documents import (
+    iter_queryset_chunks
+)
 
 trampoline_config = get_trampoline_config()
 
 
+def is_worker_ready():
+    return apps.ready and trampoline_config.connection is not None
+
+
 class TestCommands(BaseTestCase):
 
     def tearDown(self):
@@ -20,6 +57,8 @@ class TestCommands(BaseTestCase):
         # Delete remnants of previous tests.
         Index('foobar').delete(ignore=404)
         Index('foobar_target').delete(ignore=404)
+        Index('foobar_target_new').delete(ignore=404)
+        Index('foobar_copy').delete(ignore=404)
 
     def test_es_create_index(self):
         # Index name required.
@@ -211,11 +250,12 @@ class TestCommands(BaseTestCase):
         self.refresh()
 
         # Disable auto indexing while creating objects.
-        settings.TRAMPOLINE['OPTIONS']['disabled'] = True
-        token = Token.objects.create(name='token')
-        token_not_indexable = Token.objects.create(name='not_indexable')
-        token_raise_exception = Token.objects.create(name='raise_exception')
-        settings.TRAMPOLINE['OPTIONS']['disabled'] = False
+        with self.trampoline_options(disabled=True):
+            token = Token.objects.create(name='token')
+            token_not_indexable = Token.objects.create(name='not_indexable')
+            token_raise_exception = Token.objects.create(
+                name='raise_exception'
+            )
 
         # Dry run.
         call_command(
@@ -230,9 +270,8 @@ class TestCommands(BaseTestCase):
         # Cleanup stale documents.
         token_stale = Token.objects.create(name='stale')
         token_stale_pk = token_stale.pk
-        settings.TRAMPOLINE['OPTIONS']['disabled'] = True
-        token_stale.delete()
-        settings.TRAMPOLINE['OPTIONS']['disabled'] = False
+        with self.trampoline_options(disabled=True):
+            token_stale.delete()
         self.refresh()
 
         self.assertTrue(self.docExists(token_stale, token_stale_pk))
@@ -260,3 +299,826 @@ class TestCommands(BaseTestCase):
             dry_run=True,
             max_threads=-42
         )
+
+    def test_es_create_documents_cleanup_target(self):
+        doc_type = Token.get_es_doc_type()
+        target = Index('foobar_target')
+        target.doc_type(doc_type)
+        target.create()
+
+        with self.trampoline_options(disabled=True):
+            token = Token.objects.create(name='token')
+            token_stale = Token.objects.create(name='stale')
+            token_stale_pk = token_stale.pk
+            token_stale.delete()
+        connection = trampoline_config.connection
+        connection.index(
+            index='foobar_target',
+            doc_type='token',
+            id=token_stale_pk,
+            body={'name': 'stale'}
+        )
+        self.refresh()
+
+        # Only the target is scanned, the live index doesn't exist.
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            target_name='foobar_target',
+            cleanup=True
+        )
+        self.assertFalse(connection.exists(
+            index='foobar_target',
+            doc_type='token',
+            id=token_stale_pk
+        ))
+        self.assertTrue(connection.exists(
+            index='foobar_target',
+            doc_type='token',
+            id=token.pk
+        ))
+
+        # Documents of the live index are left alone.
+        live = Index('foobar')
+        live.doc_type(doc_type)
+        live.create()
+        connection.index(
+            index='foobar',
+            doc_type='token',
+            id=token_stale_pk,
+            body={'name': 'stale'}
+        )
+        self.refresh()
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            target_name='foobar_target',
+            cleanup=True
+        )
+        self.assertTrue(connection.exists(
+            index='foobar',
+            doc_type='token',
+            id=token_stale_pk
+        ))
+
+    def test_es_create_documents_bulk(self):
+        index = Index('foobar')
+        doc_type = Token.get_es_doc_type()
+        index.doc_type(doc_type)
+        index.create()
+        self.refresh()
+
+        with self.trampoline_options(disabled=True):
+            token = Token.objects.create(name='token')
+            token_not_indexable = Token.objects.create(name='not_indexable')
+            token_raise_exception = Token.objects.create(
+                name='raise_exception'
+            )
+
+        # Dry run.
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            bulk=True,
+            dry_run=True
+        )
+        self.assertDocDoesntExist(token)
+
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            bulk=True,
+            chunk_size=2
+        )
+        self.assertDocExists(token)
+        self.assertDocDoesntExist(token_not_indexable)
+        self.assertDocDoesntExist(token_raise_exception)
+
+        # Handle bad chunk size value.
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            bulk=True,
+            dry_run=True,
+            chunk_size='foobar'
+        )
+
+    @skipIf(
+        getattr(settings, 'TRAMPOLINE_IN_MEMORY', False),
+        "Worker processes don't share the in-memory store."
+    )
+    def test_es_create_documents_processes(self):
+        index = Index('foobar')
+        doc_type = Token.get_es_doc_type()
+        index.doc_type(doc_type)
+        index.create()
+        self.refresh()
+
+        with self.trampoline_options(disabled=True):
+            tokens = [Token.objects.create(name='token') for _ in range(5)]
+            token_not_indexable = Token.objects.create(name='not_indexable')
+
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            processes=2,
+            chunk_size=2
+        )
+        for token in tokens:
+            self.assertDocExists(token)
+        self.assertDocDoesntExist(token_not_indexable)
+
+    def test_index_pk_range(self):
+        index = Index('foobar')
+        doc_type = Token.get_es_doc_type()
+        index.doc_type(doc_type)
+        index.create()
+        self.refresh()
+
+        with self.trampoline_options(disabled=True):
+            tokens = [Token.objects.create(name='token') for _ in range(4)]
+            token_not_indexable = Token.objects.create(name='not_indexable')
+
+        # Run the worker's code in this process, it shares the store.
+        init_worker_process()
+        options = {
+            'target_name': 'foobar',
+            'using': 'default',
+            'write_to': ['default'],
+            'dry_run': False,
+            'bulk': True,
+            'content_type_id': ContentType.objects.get_for_model(Token).pk,
+            'since': None,
+            'first_pk': tokens[0].pk,
+            'last_pk': tokens[1].pk,
+        }
+        calls = []
+        index_objects = CreateDocumentsCommand.index_objects
+        index_objects_one_by_one = (
+            CreateDocumentsCommand.index_objects_one_by_one
+        )
+
+        def record(name, method):
+            def wrapper(*args, **kwargs):
+                calls.append(name)
+                return method(*args, **kwargs)
+            return wrapper
+
+        CreateDocumentsCommand.index_objects = record('bulk', index_objects)
+        CreateDocumentsCommand.index_objects_one_by_one = record(
+            'one_by_one',
+            index_objects_one_by_one
+        )
+        try:
+            last_pk, results = index_pk_range(options)
+            self.assertEqual(last_pk, tokens[1].pk)
+            self.assertEqual(
+                [result['object_id'] for result in results],
+                [tokens[0].pk, tokens[1].pk]
+            )
+
+            # Workers honour --bulk.
+            options.update(
+                bulk=False,
+                first_pk=tokens[2].pk,
+                last_pk=token_not_indexable.pk
+            )
+            index_pk_range(options)
+        finally:
+            CreateDocumentsCommand.index_objects = index_objects
+            CreateDocumentsCommand.index_objects_one_by_one = (
+                index_objects_one_by_one
+            )
+        self.assertEqual(calls, ['bulk', 'one_by_one'])
+        for token in tokens:
+            self.assertDocExists(token)
+        self.assertDocDoesntExist(token_not_indexable)
+
+    def test_get_processes(self):
+        command = CreateDocumentsCommand()
+        for processes, expected in ((None, 0), ('0', 0), ('1', 1), (4, 4)):
+            command.processes = processes
+            self.assertEqual(command.get_processes(), expected)
+
+    @skipIf(
+        not hasattr(multiprocessing, 'get_context'),
+        "Requires multiprocessing start methods."
+    )
+    def test_init_worker_process_spawn(self):
+        # Spawned workers import the initializer before Django is set up.
+        pool = multiprocessing.get_context('spawn').Pool(
+            processes=1,
+            initializer=init_worker_process
+        )
+        try:
+            result = pool.apply_async(is_worker_ready)
+            self.assertTrue(result.get(timeout=30))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def test_es_create_documents_using(self):
+        index = Index('foobar')
+        doc_type = Token.get_es_doc_type()
+        index.doc_type(doc_type)
+        index.create()
+        self.refresh()
+
+        with self.trampoline_options(disabled=True):
+            token = Token.objects.create(name='token')
+
+        # Unknown connection.
+        with self.assertRaises(SystemExit):
+            call_command(
+                'es_create_documents',
+                index_name='foobar',
+                using='doesntexist'
+            )
+
+        with self.trampoline_options(ingest_connection='ingest'):
+            trampoline_config.configure_connections()
+            transport = trampoline_config.get_connection('ingest').transport
+            self.assertTrue(transport.retry_on_timeout)
+            self.assertEqual(transport.kwargs['timeout'], 120)
+            self.assertEqual(transport.kwargs['maxsize'], 25)
+
+            call_command('es_create_documents', index_name='foobar')
+            self.assertDocExists(token)
+            token.es_delete()
+            self.assertDocDoesntExist(token)
+
+            call_command(
+                'es_create_documents',
+                index_name='foobar',
+                bulk=True
+            )
+            self.assertDocExists(token)
+        connections.remove_connection('ingest')
+
+    def test_es_create_documents_search_cache(self):
+        target = Index('foobar_target')
+        target.doc_type(Token.get_es_doc_type())
+        target.create()
+
+        # The searches cached for the alias are invalidated as well.
+        with self.trampoline_options(search_cache='default'):
+            generations = {}
+            for index_name in ('foobar', 'foobar_target'):
+                generation_key = GENERATION_KEY.format(index_name)
+                generations[generation_key] = cache.get(generation_key, 0)
+            call_command(
+                'es_create_documents',
+                index_name='foobar',
+                target_name='foobar_target'
+            )
+            for generation_key, generation in generations.items():
+                self.assertGreater(cache.get(generation_key, 0), generation)
+
+    def test_es_create_documents_write_to(self):
+        index = Index('foobar')
+        doc_type = Token.get_es_doc_type()
+        index.doc_type(doc_type)
+        index.create()
+
+        with self.trampoline_options(disabled=True):
+            token = Token.objects.create(name='token')
+
+        with self.write_to('default', 'mirror'):
+            mirror = trampoline_config.get_connection('mirror')
+
+            # The index must exist on every connection.
+            with self.assertRaises(SystemExit):
+                call_command('es_create_documents', index_name='foobar')
+
+            Index('foobar', using='mirror').create()
+            for bulk in (False, True):
+                call_command(
+                    'es_create_documents',
+                    index_name='foobar',
+                    bulk=bulk
+                )
+                self.assertDocExists(token)
+                self.assertTrue(mirror.exists(
+                    index='foobar',
+                    doc_type='token',
+                    id=token.pk
+                ))
+                mirror.delete(index='foobar', doc_type='token', id=token.pk)
+
+            # Only write to the given connection.
+            call_command(
+                'es_create_documents',
+                index_name='foobar',
+                using='default'
+            )
+            self.assertFalse(mirror.exists(
+                index='foobar',
+                doc_type='token',
+                id=token.pk
+            ))
+
+            # Stale documents are deleted from every connection.
+            token_pk = token.pk
+            with self.trampoline_options(disabled=True):
+                token.delete()
+            mirror.index(
+                index='foobar',
+                doc_type='token',
+                id=token_pk,
+                body={}
+            )
+            self.refresh()
+            call_command(
+                'es_create_documents',
+                index_name='foobar',
+                cleanup=True
+            )
+            self.assertDocDoesntExist(Token, token_pk)
+            self.assertFalse(mirror.exists(
+                index='foobar',
+                doc_type='token',
+                id=token_pk
+            ))
+
+            # Even those only left on a mirror.
+            mirror.index(
+                index='foobar',
+                doc_type='token',
+                id=token_pk,
+                body={}
+            )
+            self.refresh()
+            call_command(
+                'es_create_documents',
+                index_name='foobar',
+                cleanup=True
+            )
+            self.assertFalse(mirror.exists(
+                index='foobar',
+                doc_type='token',
+                id=token_pk
+            ))
+
+    def test_es_create_documents_from_index(self):
+        doc_type = Token.get_es_doc_type()
+        for index_name in ('foobar', 'foobar_target'):
+            index = Index(index_name)
+            index.doc_type(doc_type)
+            index.create()
+
+        token = Token.objects.create(name='token')
+        self.refresh()
+        self.assertDocExists(token)
+
+        # Source index doesn't exist or is the target.
+        for from_index in ('doesntexist', 'foobar_target'):
+            with self.assertRaises(SystemExit):
+                call_command(
+                    'es_create_documents',
+                    index_name='foobar',
+                    target_name='foobar_target',
+                    from_index=from_index
+                )
+
+        # Dry run.
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            target_name='foobar_target',
+            from_index='foobar',
+            dry_run=True
+        )
+        self.refresh()
+        self.assertFalse(trampoline_config.connection.exists(
+            index='foobar_target',
+            doc_type=doc_type._doc_type.name,
+            id=token.pk
+        ))
+
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            target_name='foobar_target',
+            from_index='foobar'
+        )
+        self.refresh()
+        self.assertTrue(trampoline_config.connection.exists(
+            index='foobar_target',
+            doc_type=doc_type._doc_type.name,
+            id=token.pk
+        ))
+
+        # The task fails as a whole, an alias can't point to several
+        # indices.
+        Index('foobar_target_new').create()
+        trampoline_config.connection.indices.put_alias(
+            index='foobar_target,foobar_target_new',
+            name='foobar_multi'
+        )
+        with self.assertRaises(SystemExit):
+            call_command(
+                'es_create_documents',
+                index_name='foobar',
+                target_name='foobar_multi',
+                from_index='foobar'
+            )
+
+    def test_es_create_documents_delta(self):
+        index = Index('foobar')
+        doc_type = Token.get_es_doc_type()
+        index.doc_type(doc_type)
+        index.create()
+        self.refresh()
+
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        state_file = os.path.join(state_dir, 'state.json')
+
+        now = timezone.now()
+        with self.trampoline_options(disabled=True):
+            token_old = Token.objects.create(name='token')
+            token_new = Token.objects.create(name='token')
+        Token.objects.filter(pk=token_old.pk).update(
+            modified=now - datetime.timedelta(days=2)
+        )
+
+        # Invalid date.
+        with self.assertRaises(SystemExit):
+            call_command(
+                'es_create_documents',
+                index_name='foobar',
+                since='foobar',
+                state_file=state_file
+            )
+
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            since=(now - datetime.timedelta(days=1)).isoformat(),
+            state_file=state_file
+        )
+        self.assertDocExists(token_new)
+        self.assertDocDoesntExist(token_old)
+        # Runs with --since don't store a delta checkpoint.
+        self.assertIsNone(
+            IndexationState(state_file).get('foobar', Token, 'modified_since')
+        )
+
+        # Without checkpoint every object is processed.
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            delta=True,
+            state_file=state_file
+        )
+        self.assertDocExists(token_old)
+        modified_since = IndexationState(state_file).get(
+            'foobar',
+            Token,
+            'modified_since'
+        )
+        self.assertIsNotNone(modified_since)
+
+        # Start from the checkpoint of the previous run.
+        Token.es_delete_many([token_old.pk], async=False)
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            delta=True,
+            state_file=state_file
+        )
+        self.assertDocDoesntExist(token_old)
+        modified_since = IndexationState(state_file).get(
+            'foobar',
+            Token,
+            'modified_since'
+        )
+
+        # A later --since doesn't move the checkpoint forward.
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            since=(now + datetime.timedelta(days=1)).isoformat(),
+            state_file=state_file
+        )
+        self.assertEqual(
+            IndexationState(state_file).get(
+                'foobar',
+                Token,
+                'modified_since'
+            ),
+            modified_since
+        )
+
+    def test_es_create_documents_state_file(self):
+        index = Index('foobar')
+        index.doc_type(Token.get_es_doc_type())
+        index.create()
+
+        state_file = CreateDocumentsCommand.STATE_FILE_DEFAULT
+        if os.path.exists(state_file):
+            os.remove(state_file)
+        self.addCleanup(os.remove, state_file)
+
+        with self.trampoline_options(disabled=True):
+            token = Token.objects.create(name='token')
+
+        # Full runs don't store checkpoints.
+        call_command('es_create_documents', index_name='foobar')
+        self.assertDocExists(token)
+        self.assertFalse(os.path.exists(state_file))
+
+        call_command('es_create_documents', index_name='foobar', delta=True)
+        self.assertTrue(os.path.exists(state_file))
+
+    def test_es_create_documents_resume(self):
+        index = Index('foobar')
+        doc_type = Token.get_es_doc_type()
+        index.doc_type(doc_type)
+        index.create()
+        self.refresh()
+
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        state_file = os.path.join(state_dir, 'state.json')
+
+        with self.trampoline_options(disabled=True):
+            tokens = [Token.objects.create(name='token') for _ in range(5)]
+
+        state = IndexationState(state_file)
+        state.set('foobar', Token, 'resume', {
+            'last_pk': tokens[2].pk,
+            'started_at': timezone.now().isoformat(),
+        })
+
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            chunk_size=2,
+            resume=True,
+            state_file=state_file
+        )
+        for token in tokens[:3]:
+            self.assertDocDoesntExist(token)
+        for token in tokens[3:]:
+            self.assertDocExists(token)
+
+        # The checkpoint is removed once the model is completed.
+        state = IndexationState(state_file)
+        self.assertIsNone(state.get('foobar', Token, 'resume'))
+
+        # Start over without checkpoint.
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            resume=True,
+            state_file=state_file
+        )
+        for token in tokens:
+            self.assertDocExists(token)
+
+        # The checkpoint stays before chunks with failures and keeps their
+        # count.
+        with self.trampoline_options(disabled=True):
+            Token.objects.all().delete()
+            tokens = [
+                Token.objects.create(name=name)
+                for name in ('token', 'raise_exception', 'token', 'interrupt')
+            ]
+        modified_since = IndexationState(state_file).get(
+            'foobar',
+            Token,
+            'modified_since'
+        )
+        self.assertIsNotNone(modified_since)
+        with self.assertRaises(KeyboardInterrupt):
+            call_command(
+                'es_create_documents',
+                index_name='foobar',
+                chunk_size=1,
+                max_threads=1,
+                state_file=state_file
+            )
+        state = IndexationState(state_file)
+        resume = state.get('foobar', Token, 'resume')
+        self.assertEqual(resume['last_pk'], tokens[0].pk)
+        self.assertEqual(resume['failed'], 1)
+
+        with self.trampoline_options(disabled=True):
+            Token.objects.update(name='token')
+        call_command(
+            'es_create_documents',
+            index_name='foobar',
+            resume=True,
+            state_file=state_file
+        )
+        for token in tokens:
+            self.assertDocExists(token)
+        # The delta checkpoint is kept since the interrupted run had
+        # failures.
+        state = IndexationState(state_file)
+        self.assertEqual(
+            state.get('foobar', Token, 'modified_since'),
+            modified_since
+        )
+
+    def test_parse_since(self):
+        since = parse_since('2017-01-02')
+        self.assertEqual(
+            (since.year, since.month, since.day, since.hour),
+            (2017, 1, 2, 0)
+        )
+        since = parse_since('2017-01-02T03:04:05')
+        self.assertEqual(since.hour, 3)
+        with self.assertRaises(ValueError):
+            parse_since('foobar')
+
+    def test_es_reindex(self):
+        # Index name required.
+        with self.assertRaises(SystemExit):
+            call_command('es_reindex')
+
+        with self.trampoline_options(disabled=True):
+            token = Token.objects.create(name='token')
+
+        # Dry run.
+        call_command(
+            'es_reindex',
+            index_name='foobar',
+            target_name='foobar_target',
+            dry_run=True
+        )
+        self.assertIndexDoesntExist('foobar_target')
+        self.assertAliasDoesntExist(index='foobar_target', name='foobar')
+
+        call_command(
+            'es_reindex',
+            index_name='foobar',
+            target_name='foobar_target'
+        )
+        self.assertAliasExists(index='foobar_target', name='foobar')
+        self.assertDocExists(token)
+        index_settings = trampoline_config.connection.indices.get_settings(
+            index='foobar_target'
+        )['foobar_target']['settings']['index']
+        self.assertNotEqual(index_settings.get('refresh_interval'), '-1')
+
+        # The alias is moved away from the previous index and the searches
+        # cached for the alias are invalidated.
+        with self.trampoline_options(search_cache='default'):
+            generation_key = GENERATION_KEY.format('foobar')
+            generation = cache.get(generation_key, 0)
+            call_command(
+                'es_reindex',
+                index_name='foobar',
+                target_name='foobar_target_new',
+                force_merge=True
+            )
+            self.assertGreater(cache.get(generation_key, 0), generation)
+        self.assertAliasExists(index='foobar_target_new', name='foobar')
+        self.assertAliasDoesntExist(index='foobar_target', name='foobar')
+        self.assertDocExists(token)
+
+        # The alias isn't moved when documents failed.
+        Index('foobar_target').delete()
+        with self.trampoline_options(disabled=True):
+            token_raise_exception = Token.objects.create(
+                name='raise_exception'
+            )
+        with self.assertRaises(SystemExit):
+            call_command(
+                'es_reindex',
+                index_name='foobar',
+                target_name='foobar_target'
+            )
+        self.assertAliasExists(index='foobar_target_new', name='foobar')
+        self.assertAliasDoesntExist(index='foobar_target', name='foobar')
+        index_settings = trampoline_config.connection.indices.get_settings(
+            index='foobar_target'
+        )['foobar_target']['settings']['index']
+        self.assertNotEqual(index_settings.get('refresh_interval'), '-1')
+        with self.trampoline_options(disabled=True):
+            token_raise_exception.delete()
+
+        # An index can't be replaced by an alias.
+        Index('foobar_target_new').delete()
+        Index('foobar').create()
+        with self.assertRaises(SystemExit):
+            call_command(
+                'es_reindex',
+                index_name='foobar',
+                target_name='foobar_target_new'
+            )
+        self.assertIndexDoesntExist('foobar_target_new')
+
+    def test_es_reindex_write_to(self):
+        with self.trampoline_options(disabled=True):
+            token = Token.objects.create(name='token')
+
+        with self.write_to('default', 'mirror'):
+            mirror = trampoline_config.get_connection('mirror')
+            call_command(
+                'es_reindex',
+                index_name='foobar',
+                target_name='foobar_target'
+            )
+            self.assertAliasExists(index='foobar_target', name='foobar')
+            self.assertTrue(mirror.indices.exists_alias(
+                index='foobar_target',
+                name='foobar'
+            ))
+            self.assertTrue(mirror.exists(
+                index='foobar',
+                doc_type='token',
+                id=token.pk
+            ))
+
+            # Only rebuild the index on the given connection.
+            call_command(
+                'es_reindex',
+                index_name='foobar',
+                target_name='foobar_target_new',
+                using='mirror'
+            )
+            self.assertIndexDoesntExist('foobar_target_new')
+            self.assertAliasExists(index='foobar_target', name='foobar')
+            self.assertTrue(mirror.indices.exists_alias(
+                index='foobar_target_new',
+                name='foobar'
+            ))
+
+            # Documents are copied on every connection.
+            call_command(
+                'es_reindex',
+                index_name='foobar',
+                target_name='foobar_copy',
+                from_index='foobar'
+            )
+            for connection in (trampoline_config.connection, mirror):
+                self.assertTrue(connection.indices.exists_alias(
+                    index='foobar_copy',
+                    name='foobar'
+                ))
+                self.assertTrue(connection.exists(
+                    index='foobar',
+                    doc_type='token',
+                    id=token.pk
+                ))
+
+    def test_iter_pk_ranges(self):
+        with self.trampoline_options(disabled=True):
+            tokens = [Token.objects.create(name='token') for _ in range(5)]
+
+        pk_ranges = list(iter_pk_ranges(Token.objects.all(), 2))
+        self.assertEqual(pk_ranges, [
+            (tokens[0].pk, tokens[1].pk),
+            (tokens[2].pk, tokens[3].pk),
+            (tokens[4].pk, tokens[4].pk),
+        ])
+        pk_ranges = list(iter_pk_ranges(Token.objects.all(), 2, tokens[2].pk))
+        self.assertEqual(pk_ranges, [
+            (tokens[3].pk, tokens[4].pk),
+        ])
+
+    def test_iter_queryset_chunks(self):
+        with self.trampoline_options(disabled=True):
+            tokens = [Token.objects.create(name='token') for _ in range(5)]
+
+        chunks = list(iter_queryset_chunks(Token.objects.all(), 2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(
+            [obj.pk for chunk in chunks for obj in chunk],
+            [token.pk for token in tokens]
+        )
+        chunks = list(iter_queryset_chunks(Token.objects.none(), 2))
+        self.assertEqual(chunks, [])
+        chunks = list(iter_queryset_chunks(
+            Token.objects.all(),
+            2,
+            tokens[2].pk
+        ))
+        self.assertEqual(
+            [obj.pk for chunk in chunks for obj in chunk],
+            [token.pk for token in tokens[3:]]
+        )
+
+    def test_chunk_tracker(self):
+        tracker = ChunkTracker()
+        for last_pk in (2, 4, 6):
+            tracker.add(last_pk)
+        tracker.complete(4)
+        self.assertIsNone(tracker.last_pk)
+        tracker.complete(2)
+        self.assertEqual(tracker.last_pk, 4)
+        tracker.complete(6)
+        self.assertEqual(tracker.last_pk, 6)
+
+        # Chunks with failures block the chunks after them.
+        tracker = ChunkTracker(failed=1)
+        for last_pk in (2, 4, 6):
+            tracker.add(last_pk)
+        tracker.complete(2)
+        tracker.complete(4, failed=2)
+        tracker.complete(6)
+        self.assertEqual(tracker.last_pk, 2)
+        self.assertEqual(tracker.failed, 3)
@@ -0,0 +1,138 @@
+"""
+Test metrics for trampoline.
+"""
+from elasticsearch_dsl import Index
+
+from tests.base import BaseTestCase
+from tests.models import Token
+from trampoline import get_trampoline_config
+from trampoline.metrics import CallbackMetrics
+from trampoline.metrics import get_model_tags
+from trampoline.metrics import InMemoryMetrics
+from trampoline.metrics import load_metrics
+from trampoline.metrics import NULL_METRICS
+
+trampoline_config = get_trampoline_config()
+
+recorded_metrics = []
+
+
+def record_metric(metric_type, name, value, tags):
+    recorded_metrics.append((metric_type, name, value, tags))
+
+
+class TestMetrics(BaseTestCase):
+
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        self.doc_type = Token.get_es_doc_type()
+        self.index = Index(self.doc_type._doc_type.index)
+        self.index.doc_type(self.doc_type)
+        self.index.create()
+        self.refresh()
+
+    def tearDown(self):
+        super(TestMetrics, self).tearDown()
+        self.index.delete()
+
+    def test_load_metrics(self):
+        self.assertIs(load_metrics(None), NULL_METRICS)
+        self.assertIsInstance(
+            load_metrics('trampoline.metrics.InMemoryMetrics'),
+            InMemoryMetrics
+        )
+        metrics = load_metrics('tests.test_metrics.record_metric')
+        self.assertIsInstance(metrics, CallbackMetrics)
+
+        del recorded_metrics[:]
+        metrics.incr('foo', tags={'model': 'bar'})
+        with metrics.timer('foo'):
+            pass
+        self.assertEqual(recorded_metrics[0], ('incr', 'foo', 1, {
+            'model': 'bar'
+        }))
+        self.assertEqual(recorded_metrics[1][:2], ('timing', 'foo'))
+
+    def test_null_metrics(self):
+        self.assertIs(trampoline_config.metrics, NULL_METRICS)
+        self.assertFalse(NULL_METRICS.enabled)
+        with NULL_METRICS.timer('foo'):
+            NULL_METRICS.incr('foo')
+
+    def test_tasks_metrics(self):
+        with self.trampoline_options(
+                metrics='trampoline.metrics.InMemoryMetrics'):
+            metrics = trampoline_config.metrics
+            model_tags = {'model': 'tests.token'}
+            tags = {'model': 'tests.token', 'index': 'foobar'}
+
+            token = Token.objects.create(name='token')
+            self.assertEqual(
+                metrics.get_counter(
+                    'trampoline.signal.post_save',
+                    **model_tags
+                ),
+                1
+            )
+            self.assertEqual(
+                metrics.get_counter('trampoline.indexed', **tags),
+                1
+            )
+            for stage in ('fetch', 'mapping', 'write'):
+                timings = metrics.get_timings('trampoline.' + stage, **tags)
+                self.assertEqual(len(timings), 1)
+            payload_sizes = metrics.get_histogram(
+                'trampoline.payload_size',
+                **tags
+            )
+            self.assertGreater(payload_sizes[0], 0)
+
+            Token.objects.create(name='raise_exception')
+            self.assertEqual(
+                metrics.get_counter('trampoline.failed', **tags),
+                1
+            )
+
+            token_not_indexable = Token.objects.create(name='not_indexable')
+            Token.es_index_many([token.pk, token_not_indexable.pk])
+            self.assertEqual(
+                metrics.get_counter('trampoline.indexed', **tags),
+                2
+            )
+            self.assertEqual(
+                metrics.get_counter('trampoline.ignored', **tags),
+                1
+            )
+
+            token.delete()
+            self.assertEqual(
+                metrics.get_counter(
+                    'trampoline.signal.post_delete',
+                    **model_tags
+                ),
+                1
+            )
+            self.assertEqual(
+                metrics.get_counter(
+                    'trampoline.deleted',
+                    index='foobar',
+                    doc_type='token'
+                ),
+                1
+            )
+
+    def test_get_model_tags(self):
+        self.assertEqual(
+            get_model_tags(Token, 'foobar'),
+            {'model': 'tests.token', 'index': 'foobar'}
+        )
+
+        # Options of Django < 1.6 have no model_name.
+        class Options(object):
+            app_label = 'tests'
+            module_name = 'token'
+
+        class Model(object):
+            _meta = Options()
+
+        self.assertEqual(get_model_tags(Model), {'model': 'tests.token'})
@@ -1,13 +1,26 @@
 """
 Test mixins for trampoline.
 """
-from django.conf import settings
+from unittest import skipIf
 
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from elasticsearch.helpers import BulkIndexError
 from elasticsearch_dsl import Index
 
+from trampoline import get_trampoline_config
+from trampoline.cache import add_debounced_ids
+from trampoline.cache import get_debounce_cache
+from trampoline.cache import get_debounce_keys
+from trampoline.mixins import _auto_doc_mapping_plans
 from trampoline.mixins import ESIndexableMixin
+from trampoline.tasks import STATUS_INDEXED
+from trampoline.tasks import WriteToError
+from trampoline.tasks import es_index_docs
+from trampoline.tasks import get_es_inline_docs
 
 from tests.base import BaseTestCase
+from tests.doc_types import PersonDoc
 from tests.models import Person
 from tests.models import Token
 
@@ -35,6 +48,12 @@ class TestMixins(BaseTestCase):
             str(Token.objects.all().query)
         )
 
+    def test_get_es_bulk_queryset(self):
+        self.assertEqual(
+            str(Token.get_es_bulk_queryset().query),
+            str(Token.get_indexable_queryset().query)
+        )
+
     def test_get_es_doc(self):
         token = Token(name="token")
         self.assertIsNone(token.get_es_doc())
@@ -52,10 +71,35 @@ class TestMixins(BaseTestCase):
             u"{0} {1}".format(person.first_name, person.last_name)
         )
 
+    def test_auto_doc_type_mapping_plan(self):
+        person = Person(first_name="Simion", last_name="Baws")
+        person.get_es_doc_mapping()
+        plan = _auto_doc_mapping_plans[(Person, PersonDoc)]
+        self.assertEqual(
+            sorted(field for field, getter in plan),
+            ['first_name', 'full_name', 'last_name']
+        )
+
+        # The plan is reused for other objects.
+        person = Person(first_name="Baws", last_name="Simion")
+        doc_type = person.get_es_doc_mapping()
+        self.assertEqual(doc_type.full_name, u"Baws Simion")
+        self.assertIs(_auto_doc_mapping_plans[(Person, PersonDoc)], plan)
+
+        class NotMappable(ESIndexableMixin):
+            es_doc_type = PersonDoc
+            es_auto_doc_type_mapping = True
+
+        with self.assertRaises(NotImplementedError):
+            NotMappable().get_es_doc_mapping()
+        self.assertNotIn(
+            (NotMappable, PersonDoc),
+            _auto_doc_mapping_plans
+        )
+
     def test_es_index(self):
-        settings.TRAMPOLINE['OPTIONS']['disabled'] = True
-        token = Token.objects.create(name='token')
-        settings.TRAMPOLINE['OPTIONS']['disabled'] = False
+        with self.trampoline_options(disabled=True):
+            token = Token.objects.create(name='token')
         self.assertDocDoesntExist(token)
 
         # Async
@@ -72,23 +116,21 @@ class TestMixins(BaseTestCase):
         token = Token.objects.create(name='not_indexable')
         self.assertDocDoesntExist(token)
 
-        settings.TRAMPOLINE['OPTIONS']['disabled'] = True
-        token = Token.objects.create(name='raise_exception')
-        settings.TRAMPOLINE['OPTIONS']['disabled'] = False
+        with self.trampoline_options(disabled=True):
+            token = Token.objects.create(name='raise_exception')
         # Async silent fail.
         token.es_index()
         # Sync silent fail.
         token.es_index(async=False)
         self.assertDocDoesntExist(token)
 
-        settings.TRAMPOLINE['OPTIONS']['fail_silently'] = False
-        # Async hard fail.
-        with self.assertRaises(RuntimeError):
-            token.es_index()
-        # Sync hard fail.
-        with self.assertRaises(RuntimeError):
-            token.es_index(async=False)
-        settings.TRAMPOLINE['OPTIONS']['fail_silently'] = True
+        with self.trampoline_options(fail_silently=False):
+            # Async hard fail.
+            with self.assertRaises(RuntimeError):
+                token.es_index()
+            # Sync hard fail.
+            with self.assertRaises(RuntimeError):
+                token.es_index(async=False)
 
     def test_es_delete(self):
         # Asynchronous call.
@@ -120,19 +162,125 @@ class TestMixins(BaseTestCase):
         token.es_delete()
 
         # Hard fail.
-        settings.TRAMPOLINE['OPTIONS']['fail_silently'] = False
-        with self.assertRaises(RuntimeError):
-            token.es_delete()
-        settings.TRAMPOLINE['OPTIONS']['fail_silently'] = True
+        with self.trampoline_options(fail_silently=False):
+            with self.assertRaises(RuntimeError):
+                token.es_delete()
 
         trampoline_config.connection.delete = backup_delete
 
+    def test_es_index_many(self):
+        with self.trampoline_options(disabled=True):
+            token = Token.objects.create(name='token')
+            other_token = Token.objects.create(name='other token')
+            token_not_indexable = Token.objects.create(name='not_indexable')
+            token_raise_exception = Token.objects.create(
+                name='raise_exception'
+            )
+        object_ids = [
+            token.pk,
+            other_token.pk,
+            token_not_indexable.pk,
+            token_raise_exception.pk,
+        ]
+
+        # Async with a silent fail.
+        Token.es_index_many(object_ids)
+        self.assertDocExists(token)
+        self.assertDocExists(other_token)
+        self.assertDocDoesntExist(token_not_indexable)
+        self.assertDocDoesntExist(token_raise_exception)
+
+        Token.es_delete_many(object_ids)
+        self.assertDocDoesntExist(Token, token.pk)
+        self.assertDocDoesntExist(Token, other_token.pk)
+
+        # Sync.
+        Token.es_index_many([token.pk, other_token.pk], async=False)
+        self.assertDocExists(token)
+        Token.es_delete_many([token.pk, other_token.pk], async=False)
+        self.assertDocDoesntExist(Token, token.pk)
+
+        # Hard fail.
+        with self.trampoline_options(fail_silently=False):
+            with self.assertRaises(BulkIndexError):
+                Token.es_index_many(object_ids, async=False)
+
+    def test_write_to(self):
+        trampoline_config = get_trampoline_config()
+        with self.write_to('default', 'mirror'):
+            mirror = trampoline_config.get_connection('mirror')
+            Index('foobar', using='mirror').create()
+
+            def mirror_exists(token):
+                return mirror.exists(
+                    index='foobar',
+                    doc_type='token',
+                    id=token.pk
+                )
+
+            token = Token.objects.create(name='token')
+            self.assertDocExists(token)
+            self.assertTrue(mirror_exists(token))
+            token.es_delete()
+            self.assertDocDoesntExist(token)
+            self.assertFalse(mirror_exists(token))
+
+            other_token = Token.objects.create(name='other token')
+            Token.es_delete_many([token.pk, other_token.pk])
+            self.assertFalse(mirror_exists(other_token))
+            Token.es_index_many([token.pk, other_token.pk])
+            self.assertDocExists(token)
+            self.assertTrue(mirror_exists(token))
+            self.assertTrue(mirror_exists(other_token))
+
+            # Writes to the mirror fail, an alias can't point to several
+            # indices.
+            Index('foobar', using='mirror').delete()
+            for index_name in ('foobar_1', 'foobar_2'):
+                Index(index_name, using='mirror').create()
+                mirror.indices.put_alias(index=index_name, name='foobar')
+            with self.trampoline_options(
+                    metrics='trampoline.metrics.InMemoryMetrics'):
+                metrics = trampoline_config.metrics
+                tags = {'model': 'tests.token', 'index': 'foobar'}
+                token.es_index()
+                self.assertEqual(
+                    metrics.get_counter(
+                        'trampoline.write_to.indexed',
+                        connection='default',
+                        **tags
+                    ),
+                    1
+                )
+                self.assertEqual(
+                    metrics.get_counter(
+                        'trampoline.write_to.failed',
+                        connection='mirror',
+                        **tags
+                    ),
+                    1
+                )
+                self.assertEqual(
+                    metrics.get_counter('trampoline.failed', **tags),
+                    1
+                )
+
+                with self.trampoline_options(fail_silently=False):
+                    with self.assertRaises(WriteToError) as context:
+                        token.es_index()
+                    self.assertEqual(list(context.exception.errors), [
+                        'mirror'
+                    ])
+                    with self.assertRaises(BulkIndexError) as context:
+                        Token.es_index_many([token.pk], async=False)
+                    object_id, errors = context.exception.errors[0]
+                    self.assertEqual(list(errors), ['mirror'])
+
     def test_save(self):
         token = Token(name='token')
 
-        settings.TRAMPOLINE['OPTIONS']['disabled'] = True
-        token.save()
-        settings.TRAMPOLINE['OPTIONS']['disabled'] = False
+        with self.trampoline_options(disabled=True):
+            token.save()
         self.assertDocDoesntExist(token)
 
         token.save()
@@ -150,14 +298,197 @@ class TestMixins(BaseTestCase):
         token = Token.objects.create(name='not_indexable')
         self.assertDocDoesntExist(token)
 
+    @skipIf(not hasattr(transaction, 'on_commit'), "Requires on_commit.")
+    def test_save_in_transaction(self):
+        with transaction.atomic():
+            token = Token.objects.create(name='token')
+            token.name = 'kento'
+            token.save()
+            other_token = Token.objects.create(name='other token')
+            token_not_indexable = Token.objects.create(name='not_indexable')
+            self.assertDocDoesntExist(token)
+        self.assertEqual(token.get_es_doc().name, 'kento')
+        self.assertDocExists(other_token)
+        self.assertDocDoesntExist(token_not_indexable)
+
+        # Nothing is indexed when the transaction is rolled back.
+        try:
+            with transaction.atomic():
+                token.name = 'rolled back'
+                token.save()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(token.get_es_doc().name, 'kento')
+
+        with transaction.atomic():
+            token.name = 'token'
+            token.save()
+        self.assertEqual(token.get_es_doc().name, 'token')
+
+        # The flush registered in a rolled back savepoint is scheduled again.
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    token.name = 'rolled back'
+                    token.save()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            other_token.name = 'kento'
+            other_token.save()
+        self.assertEqual(token.get_es_doc().name, 'token')
+        self.assertEqual(other_token.get_es_doc().name, 'kento')
+
+    @skipIf(not hasattr(transaction, 'on_commit'), "Requires on_commit.")
+    def test_es_inline_doc(self):
+        Token.es_inline_doc = True
+        try:
+            with self.trampoline_options(disabled=True):
+                token = Token.objects.create(name='token')
+                token_raise_exception = Token.objects.create(
+                    name='raise_exception'
+                )
+
+            # The worker doesn't query the database.
+            with self.assertNumQueries(0):
+                token.es_index()
+            self.assertDocExists(token)
+            token.es_delete()
+
+            # Saves inside a transaction are indexed in bulk once commited.
+            with transaction.atomic():
+                token.name = 'kento'
+                token.save()
+                other_token = Token.objects.create(name='other token')
+                token_not_indexable = Token.objects.create(
+                    name='not_indexable'
+                )
+                self.assertDocDoesntExist(token)
+            self.assertEqual(token.get_es_doc().name, 'kento')
+            self.assertDocExists(other_token)
+            self.assertDocDoesntExist(token_not_indexable)
+
+            # Objects saved in a rolled back savepoint are fetched again.
+            with transaction.atomic():
+                other_token.save()
+                try:
+                    with transaction.atomic():
+                        token.name = 'rolled back'
+                        token.save()
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+            self.assertEqual(token.get_es_doc().name, 'kento')
+
+            # Objects deleted in the transaction aren't indexed.
+            with transaction.atomic():
+                Token.objects.create(name='deleted').delete()
+            self.refresh()
+            search = Token.get_es_doc_type().search()
+            self.assertEqual(search.query('term', name='deleted').count(), 0)
+
+            # Documents are built when es_index is called.
+            token_raise_exception.es_index()
+            self.assertDocDoesntExist(token_raise_exception)
+            with self.trampoline_options(fail_silently=False):
+                with self.assertRaises(RuntimeError):
+                    token_raise_exception.es_index()
+                Token.es_index_instances([token, other_token], async=False)
+        finally:
+            Token.es_inline_doc = False
+
+    def test_es_inline_doc_order(self):
+        with self.trampoline_options(disabled=True):
+            token = Token.objects.create(name='token')
+        index_name = self.doc_type._doc_type.index
+        doc_type_name = self.doc_type._doc_type.name
+        old_docs = get_es_inline_docs(index_name, [token])
+        token.name = 'kento'
+        token.save()
+        new_docs = get_es_inline_docs(index_name, [token])
+        self.assertGreater(new_docs[0][2], old_docs[0][2])
+
+        # A task with an older body running last doesn't overwrite the
+        # document.
+        es_index_docs.run(index_name, doc_type_name, new_docs)
+        results = es_index_docs.run(index_name, doc_type_name, old_docs)
+        self.assertEqual(results, [(str(token.pk), STATUS_INDEXED)])
+        self.assertEqual(token.get_es_doc().name, 'kento')
+
+        # The same body can be sent again.
+        es_index_docs.run(index_name, doc_type_name, new_docs)
+        self.assertEqual(token.get_es_doc().name, 'kento')
+
+        # Without es_modified_field the time the body is built is used.
+        Token.es_modified_field = None
+        try:
+            self.assertGreater(
+                get_es_inline_docs(index_name, [token])[0][2],
+                new_docs[0][2]
+            )
+        finally:
+            Token.es_modified_field = 'modified'
+
+    def test_es_debounce(self):
+        content_type_id = ContentType.objects.get_for_model(Token).pk
+        cache = get_debounce_cache()
+        trampoline_config = get_trampoline_config()
+        Token.es_debounce = 10
+        try:
+            with self.trampoline_options(
+                    metrics='trampoline.metrics.InMemoryMetrics'):
+                metrics = trampoline_config.metrics
+                # Tasks run eagerly in tests, the key is cleared right away.
+                token = Token.objects.create(name='token')
+                self.assertDocExists(token)
+                key, = get_debounce_keys('foobar', content_type_id, [token.pk])
+                self.assertIsNone(cache.get(key))
+
+                # An indexation is already pending.
+                self.assertEqual(
+                    add_debounced_ids(
+                        'foobar',
+                        content_type_id,
+                        [token.pk],
+                        Token.es_debounce
+                    ),
+                    [token.pk]
+                )
+                token.name = 'kento'
+                token.save()
+                Token.es_index_many([token.pk])
+                self.assertEqual(token.get_es_doc().name, 'token')
+                self.assertEqual(
+                    metrics.get_counter(
+                        'trampoline.debounced',
+                        model='tests.token',
+                        index='foobar'
+                    ),
+                    2
+                )
+
+                # Synchronous calls aren't debounced.
+                token.es_index(async=False)
+                self.assertEqual(token.get_es_doc().name, 'kento')
+
+                cache.delete(key)
+                with transaction.atomic():
+                    token.name = 'token'
+                    token.save()
+                self.assertEqual(token.get_es_doc().name, 'token')
+                self.assertIsNone(cache.get(key))
+        finally:
+            Token.es_debounce = None
+            cache.clear()
+
     def test_delete(self):
         token = Token.objects.create(name='token')
         token_id = token.pk
         self.assertDocExists(token)
 
-        settings.TRAMPOLINE['OPTIONS']['disabled'] = True
-        token.delete()
-        settings.TRAMPOLINE['OPTIONS']['disabled'] = False
+        with self.trampoline_options(disabled=True):
+            token.delete()
         self.assertDocExists(Token, token_id)
 
         token.save()
@@ -1,15 +1,22 @@
 """
 Test paginator for trampoline.
 """
+from concurrent.futures import ThreadPoolExecutor
+
 from elasticsearch_dsl import Index
 from elasticsearch_dsl import Search
 
+from trampoline import get_trampoline_config
+from trampoline.paginator import ESSearchBatch
 from trampoline.paginator import ESSearchPaginator
+from trampoline.paginator import reverse_sort
 
 from tests.base import BaseTestCase
 from tests.models import Token
 from tests.views import PaginatedContentView
 
+trampoline_config = get_trampoline_config()
+
 
 class TestPaginator(BaseTestCase):
 
@@ -59,6 +66,234 @@ class TestPaginator(BaseTestCase):
 
         self.assertEqual(page.hits[0]['name'], 'token 2')
 
+    def test_cursor_page(self):
+        search = Search(
+            index=Token.es_doc_type._doc_type.index,
+            doc_type=Token.es_doc_type._doc_type.name
+        )
+        search = search.sort('name')
+        paginator = ESSearchPaginator(search, 2)
+
+        page = paginator.cursor_page()
+        self.assertEqual([hit['name'] for hit in page.hits], [
+            'token 0',
+            'token 1',
+        ])
+        self.assertEqual(page.total_count, 3)
+        self.assertTrue(page.has_next)
+        self.assertFalse(page.has_previous)
+        self.assertIsNone(page.previous_cursor)
+
+        page = paginator.cursor_page(page.next_cursor)
+        self.assertEqual([hit['name'] for hit in page.hits], ['token 2'])
+        self.assertFalse(page.has_next)
+        self.assertTrue(page.has_previous)
+        self.assertIsNone(page.next_cursor)
+
+        page = paginator.cursor_page(page.previous_cursor)
+        self.assertEqual([hit['name'] for hit in page.hits], [
+            'token 0',
+            'token 1',
+        ])
+        self.assertFalse(page.has_previous)
+        self.assertTrue(page.has_next)
+
+        # Invalid cursors fall back to the first page.
+        page = paginator.cursor_page('foobar')
+        self.assertEqual(page.hits[0]['name'], 'token 0')
+
+    def test_cursor_sort(self):
+        search = Search(
+            index=Token.es_doc_type._doc_type.index,
+            doc_type=Token.es_doc_type._doc_type.name
+        )
+        # Relevance comes before the tiebreaker without an explicit sort.
+        paginator = ESSearchPaginator(search, 2)
+        self.assertEqual(
+            paginator.get_cursor_search().to_dict()['sort'],
+            ['_score', '_uid']
+        )
+        paginator = ESSearchPaginator(search.sort('name'), 2)
+        self.assertEqual(
+            paginator.get_cursor_search().to_dict()['sort'],
+            ['name', '_uid']
+        )
+
+    def test_page_next_cursor(self):
+        search = Search(
+            index=Token.es_doc_type._doc_type.index,
+            doc_type=Token.es_doc_type._doc_type.name
+        )
+        search = search.sort('name')
+        paginator = ESSearchPaginator(search, 2)
+
+        # Numbered pages keep the sort of the search.
+        page = paginator.page(1)
+        self.assertEqual(page.search.to_dict()['sort'], ['name'])
+        self.assertIsNone(page.next_cursor)
+
+        # Numbered pages lead to cursor pages.
+        paginator = ESSearchPaginator(search, 2, cursor_handoff=True)
+        page = paginator.page(1)
+        self.assertEqual(page.search.to_dict()['sort'], ['name', '_uid'])
+        cursor_page = paginator.cursor_page(page.next_cursor)
+        self.assertEqual(
+            [hit['name'] for hit in cursor_page.hits],
+            ['token 2']
+        )
+        self.assertTrue(cursor_page.has_previous)
+        self.assertIsNone(paginator.page(2).next_cursor)
+
+    def test_reverse_sort(self):
+        self.assertEqual(
+            reverse_sort([
+                'name',
+                '_score',
+                {'age': {'order': 'desc', 'missing': '_last'}},
+                {'rank': 'asc'},
+            ]),
+            [
+                {'name': {'order': 'desc'}},
+                {'_score': {'order': 'asc'}},
+                {'age': {'order': 'asc', 'missing': '_first'}},
+                {'rank': {'order': 'desc'}},
+            ]
+        )
+
+    def test_search_cache(self):
+        search = Search(
+            index=Token.es_doc_type._doc_type.index,
+            doc_type=Token.es_doc_type._doc_type.name
+        )
+        search = search.sort('name')
+
+        with self.trampoline_options(search_cache='default'):
+            paginator = ESSearchPaginator(search, 2)
+            page = paginator.page(1)
+            self.assertEqual(page.total_count, 3)
+            self.assertEqual(page.hits[0]['name'], 'token 0')
+
+            # Documents indexed outside of trampoline aren't seen.
+            trampoline_config.connection.index(
+                index=Token.es_doc_type._doc_type.index,
+                doc_type=Token.es_doc_type._doc_type.name,
+                body={'name': 'token'},
+            )
+            self.refresh()
+            page = paginator.page(1)
+            self.assertEqual(page.total_count, 3)
+
+            # Caching can be disabled on a paginator.
+            page = ESSearchPaginator(search, 2, cache_timeout=0).page(1)
+            self.assertEqual(page.total_count, 4)
+
+            # Writes made by trampoline invalidate the cache.
+            Token.objects.create(name='token 4')
+            self.refresh()
+            page = paginator.page(1)
+            self.assertEqual(page.total_count, 5)
+            self.assertEqual(page.hits[0]['name'], 'token')
+
+            # Responses aren't cached until the write is visible, within the
+            # refresh interval.
+            trampoline_config.connection.index(
+                index=Token.es_doc_type._doc_type.index,
+                doc_type=Token.es_doc_type._doc_type.name,
+                body={'name': 'token 5'},
+            )
+            self.refresh()
+            page = paginator.page(1)
+            self.assertEqual(page.total_count, 6)
+
+            with self.trampoline_options(search_cache_refresh_interval=0):
+                page = paginator.page(1)
+                self.assertEqual(page.total_count, 6)
+                trampoline_config.connection.index(
+                    index=Token.es_doc_type._doc_type.index,
+                    doc_type=Token.es_doc_type._doc_type.name,
+                    body={'name': 'token 6'},
+                )
+                self.refresh()
+                page = paginator.page(1)
+                self.assertEqual(page.total_count, 6)
+
+    def test_search_batch(self):
+        search = Search(
+            index=Token.es_doc_type._doc_type.index,
+            doc_type=Token.es_doc_type._doc_type.name
+        )
+        search = search.sort('name')
+
+        batch = ESSearchBatch()
+        page = ESSearchPaginator(search, 2, batch=batch).page(1)
+        other_page = ESSearchPaginator(search, 1, batch=batch).page(3)
+        count_search = search.extra(size=0)
+        batch.add(count_search)
+
+        # Nothing is executed until a page is evaluated.
+        self.assertEqual(len(batch.pending), 3)
+        self.assertEqual(page.hits[0]['name'], 'token 0')
+        self.assertEqual(batch.pending, [])
+
+        self.assertEqual(other_page.hits[0]['name'], 'token 2')
+        self.assertFalse(other_page.has_other_pages)
+        self.assertEqual(batch.get_response(count_search).hits.total, 3)
+
+        # Searches added after the batch was executed.
+        page = ESSearchPaginator(search, 2, batch=batch).cursor_page()
+        self.assertEqual(len(page.hits), 2)
+        self.assertTrue(page.has_next)
+
+    def test_search_batch_connections(self):
+        search = Search(
+            index=Token.es_doc_type._doc_type.index,
+            doc_type=Token.es_doc_type._doc_type.name
+        )
+        search = search.sort('name')
+
+        with self.write_to('default', 'mirror'):
+            mirror = trampoline_config.get_connection('mirror')
+            mirror.index(
+                index='foobar',
+                doc_type='token',
+                id=1,
+                body={'name': 'mirror token'}
+            )
+            mirror_search = search.using('mirror')
+
+            # Each search is sent to its own connection.
+            batch = ESSearchBatch()
+            page = ESSearchPaginator(search, 2, batch=batch).page(1)
+            mirror_page = ESSearchPaginator(
+                mirror_search,
+                2,
+                batch=batch
+            ).page(1)
+            count_search = mirror_search.extra(size=0)
+            batch.add(count_search)
+            self.assertEqual(page.total_count, 3)
+            self.assertEqual(mirror_page.total_count, 1)
+            self.assertEqual(mirror_page.hits[0]['name'], 'mirror token')
+            self.assertEqual(batch.get_response(count_search).hits.total, 1)
+
+    def test_search_batch_threads(self):
+        search = Search(
+            index=Token.es_doc_type._doc_type.index,
+            doc_type=Token.es_doc_type._doc_type.name
+        )
+        batch = ESSearchBatch()
+        pages = [
+            ESSearchPaginator(search, 1, batch=batch).page(number)
+            for number in range(1, 4)
+        ]
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            totals = list(executor.map(
+                lambda page: (page.total_count, len(page.hits)),
+                pages
+            ))
+        self.assertEqual(totals, [(3, 1)] * 3)
+        self.assertEqual(batch.pending, [])
+
     def test_pagination_mixin(self):
         class Request(object):
             GET = {}
@@ -82,3 +317,18 @@ class TestPaginator(BaseTestCase):
         self.assertIsNotNone(view.page)
 
         self.assertEqual(view.get_context_data()['page'], view.page)
+
+        view = PaginatedContentView()
+        view.request = Request()
+        view.request.GET = {'cursor': 'foobar'}
+        self.assertEqual(view.get_cursor(), 'foobar')
+        page = view.paginate_search()
+        self.assertIsNotNone(page.next_cursor)
+
+        # Numbered pages of the view hand over to cursors on demand.
+        view = PaginatedContentView()
+        view.request = Request()
+        view.cursor_handoff = True
+        page = view.paginate_search()
+        self.assertTrue(page.paginator.cursor_handoff)
+        self.assertIsNotNone(page.next_cursor)
@@ -0,0 +1,218 @@
+"""
+Test the in-memory ElasticSearch stand-in for trampoline.
+"""
+from copy import deepcopy
+
+from django.conf import settings
+
+from elasticsearch import Elasticsearch
+from elasticsearch import NotFoundError
+from elasticsearch import RequestError
+from elasticsearch.helpers import bulk
+from elasticsearch.helpers import scan
+from elasticsearch_dsl.connections import connections
+
+from tests.base import BaseTestCase
+from trampoline import get_trampoline_config
+from trampoline.management.commands.es_create_documents import (
+    get_task_status
+)
+from trampoline.testing import clear_stores
+from trampoline.testing import get_store
+from trampoline.testing import InMemoryConnection
+
+trampoline_config = get_trampoline_config()
+
+
+class TestInMemoryConnection(BaseTestCase):
+
+    def setUp(self):
+        super(TestInMemoryConnection, self).setUp()
+        self.client = Elasticsearch(
+            hosts='memory',
+            connection_class=InMemoryConnection
+        )
+        self.client.indices.create(index='foo', body={
+            'settings': {'number_of_shards': 1},
+            'mappings': {'bar': {'properties': {}}},
+        })
+
+    def tearDown(self):
+        super(TestInMemoryConnection, self).tearDown()
+        clear_stores()
+
+    def test_documents(self):
+        self.client.index(index='foo', doc_type='bar', id=1, body={'a': 1})
+        self.assertTrue(self.client.exists(index='foo', doc_type='bar', id=1))
+        doc = self.client.get(index='foo', doc_type='bar', id=1)
+        self.assertEqual(doc['_source'], {'a': 1})
+
+        response = self.client.index(
+            index='foo',
+            doc_type='bar',
+            id=1,
+            body={'a': 2}
+        )
+        self.assertFalse(response['created'])
+        self.assertEqual(response['_version'], 2)
+
+        self.client.delete(index='foo', doc_type='bar', id=1)
+        self.assertFalse(
+            self.client.exists(index='foo', doc_type='bar', id=1)
+        )
+        with self.assertRaises(NotFoundError):
+            self.client.delete(index='foo', doc_type='bar', id=1)
+        with self.assertRaises(NotFoundError):
+            self.client.get(index='doesntexist', doc_type='bar', id=1)
+
+        # Connections to the same host share their documents.
+        self.client.index(index='foo', doc_type='bar', id=2, body={})
+        other_client = Elasticsearch(
+            hosts='memory',
+            connection_class=InMemoryConnection
+        )
+        self.assertTrue(other_client.exists(index='foo', doc_type='bar', id=2))
+        self.assertIsNot(get_store('memory'), get_store('localhost'))
+
+    def test_bulk_and_search(self):
+        actions = [
+            {'_index': 'foo', '_type': 'bar', '_id': i, 'name': 'doc', 'i': i}
+            for i in range(25)
+        ]
+        actions.append({
+            '_op_type': 'delete',
+            '_index': 'foo',
+            '_type': 'bar',
+            '_id': 0,
+        })
+        success, errors = bulk(self.client, actions)
+        self.assertEqual(success, 26)
+        self.assertEqual(errors, [])
+        self.client.indices.refresh(index='foo')
+
+        response = self.client.search(index='foo', body={
+            'query': {'bool': {'filter': [{'terms': {'i': [1, 2, 3]}}]}},
+            'sort': [{'i': 'desc'}],
+        })
+        self.assertEqual(response['hits']['total'], 3)
+        self.assertEqual(
+            [hit['_id'] for hit in response['hits']['hits']],
+            ['3', '2', '1']
+        )
+
+        response = self.client.search(index='foo', doc_type='bar', body={
+            'sort': ['i'],
+            'search_after': [20],
+            'size': 2,
+        })
+        self.assertEqual(response['hits']['hits'][0]['sort'], [21])
+        self.assertEqual(len(response['hits']['hits']), 2)
+
+        self.assertEqual(self.client.count(index='foo')['count'], 24)
+        hits = list(scan(self.client, index='foo', size=5))
+        self.assertEqual(len(hits), 24)
+
+        response = self.client.msearch(body=[
+            {'index': 'foo'},
+            {'query': {'ids': {'values': ['1']}}},
+            {'index': 'doesntexist'},
+            {'query': {'match_all': {}}},
+        ])
+        responses = response['responses']
+        self.assertEqual(responses[0]['hits']['total'], 1)
+        self.assertEqual(responses[1]['status'], 404)
+
+    def test_aliases(self):
+        self.client.indices.create(index='foo_new')
+        self.client.indices.put_alias(index='foo', name='foo_alias')
+        self.assertTrue(self.client.indices.exists_alias(name='foo_alias'))
+        self.assertEqual(
+            self.client.indices.get_alias(name='foo_alias'),
+            {'foo': {'aliases': {'foo_alias': {}}}}
+        )
+        self.client.index(index='foo_alias', doc_type='bar', id=1, body={})
+        self.assertTrue(self.client.exists(index='foo', doc_type='bar', id=1))
+
+        # Updates are atomic.
+        with self.assertRaises(NotFoundError):
+            self.client.indices.update_aliases(body={'actions': [
+                {'remove': {'index': 'foo', 'alias': 'foo_alias'}},
+                {'add': {'index': 'doesntexist', 'alias': 'foo_alias'}},
+            ]})
+        self.assertTrue(
+            self.client.indices.exists_alias(index='foo', name='foo_alias')
+        )
+
+        self.client.indices.update_aliases(body={'actions': [
+            {'remove': {'index': 'foo', 'alias': 'foo_alias'}},
+            {'add': {'index': 'foo_new', 'alias': 'foo_alias'}},
+        ]})
+        self.assertFalse(
+            self.client.indices.exists_alias(index='foo', name='foo_alias')
+        )
+        self.assertTrue(
+            self.client.indices.exists_alias(index='foo_new', name='foo_alias')
+        )
+
+        with self.assertRaises(RequestError):
+            self.client.indices.create(index='foo_alias')
+        self.client.indices.delete(index='foo_new')
+        self.assertFalse(self.client.indices.exists_alias(name='foo_alias'))
+
+    def test_index_management(self):
+        self.assertTrue(self.client.indices.exists(index='foo'))
+        self.assertTrue(
+            self.client.indices.exists_type(index='foo', doc_type='bar')
+        )
+        self.assertFalse(
+            self.client.indices.exists_type(index='foo', doc_type='baz')
+        )
+        with self.assertRaises(RequestError):
+            self.client.indices.create(index='foo')
+
+        self.client.indices.put_settings(
+            index='foo',
+            body={'index': {'refresh_interval': '-1'}}
+        )
+        index_settings = self.client.indices.get_settings(index='foo')
+        self.assertEqual(
+            index_settings['foo']['settings']['index']['refresh_interval'],
+            '-1'
+        )
+        self.assertEqual(
+            index_settings['foo']['settings']['index']['number_of_shards'],
+            '1'
+        )
+
+        self.client.index(index='foo', doc_type='bar', id=1, body={'a': 1})
+        self.client.indices.create(index='foo_copy')
+        task = self.client.reindex(
+            body={'source': {'index': 'foo'}, 'dest': {'index': 'foo_copy'}},
+            params={'wait_for_completion': 'false'}
+        )
+        completed, status, response = get_task_status(
+            self.client,
+            task['task']
+        )
+        self.assertTrue(completed)
+        self.assertEqual(response['created'], 1)
+        self.assertTrue(
+            self.client.exists(index='foo_copy', doc_type='bar', id=1)
+        )
+
+        self.client.indices.delete(index='foo')
+        self.assertFalse(self.client.indices.exists(index='foo'))
+        with self.assertRaises(NotFoundError):
+            self.client.indices.delete(index='foo')
+
+    def test_configure_connections(self):
+        TRAMPOLINE = deepcopy(settings.TRAMPOLINE)
+        TRAMPOLINE.setdefault('CONNECTIONS', {})['memory'] = {
+            'hosts': 'memory',
+            'connection_class': 'trampoline.testing.InMemoryConnection',
+        }
+        with self.settings(TRAMPOLINE=TRAMPOLINE):
+            trampoline_config.configure_connections()
+            client = trampoline_config.get_connection('memory')
+            self.assertTrue(client.indices.exists(index='foo'))
+        connections.remove_connection('memory')
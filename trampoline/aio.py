@@ -0,0 +1,57 @@
+"""
+Asyncio paginator and view mixin for trampoline (Python 3.4+).
+
+Searches run through the synchronous client on an executor of the event
+loop, the supported elasticsearch-py releases have no async transport.
+"""
+import asyncio
+
+from trampoline.paginator import ESSearchPaginator
+from trampoline.views import ESPaginationMixin
+
+
+def fetch_page(page):
+    """
+    Execute the search of a page, unless its response is cached.
+    """
+    page.response
+    return page
+
+
+class AsyncESSearchPaginator(ESSearchPaginator):
+    """
+    Paginator whose pages are futures, several of them can be awaited
+    concurrently with asyncio.gather. Responses are cached like those of
+    ESSearchPaginator.
+    """
+    # None is the default executor of the event loop.
+    executor = None
+
+    def run(self, page):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, fetch_page, page)
+
+    def page(self, page_number):
+        page = super(AsyncESSearchPaginator, self).page(page_number)
+        return self.run(page)
+
+    def cursor_page(self, cursor=None):
+        page = super(AsyncESSearchPaginator, self).cursor_page(cursor)
+        return self.run(page)
+
+
+class AsyncESPaginationMixin(ESPaginationMixin):
+    # None is the default executor of the event loop.
+    executor = None
+
+    def apage(self):
+        """
+        Return a future of the page, whose search doesn't block the event
+        loop. The page is then available to get_context_data through the
+        attribute page.
+        """
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, self.fetch_page)
+
+    def fetch_page(self):
+        return fetch_page(self.page)
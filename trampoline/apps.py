@@ -11,9 +11,16 @@ from django.db import transaction
 from django.db.models.signals import class_prepared
 from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
+from django.test.signals import setting_changed
 
 from elasticsearch_dsl.connections import connections
 
+from trampoline.background import BackgroundIndexer
+from trampoline.buffer import get_index_buffer
+from trampoline.metrics import get_model_tags
+from trampoline.metrics import load_metrics
+from trampoline.utils import import_path
+
 try:
     from django.apps import AppConfig
 except ImportError:
@@ -28,10 +35,30 @@ DEFAULT_TRAMPOLINE = {
     'OPTIONS': {
         'fail_silently': True,
         'disabled': False,
-        'celery_queue': None
+        'celery_queue': None,
+        'search_cache': None,
+        'search_cache_timeout': 60,
+        'search_cache_refresh_interval': 1,
+        'metrics': None,
+        'ingest_connection': None,
+        'backend': 'celery',
+        'background_queue_size': 10000,
+        'background_batch_size': 500,
+        'background_flush_interval': 1,
+        'background_threads': 1,
+        'debounce_cache': 'default',
     },
 }
 
+# Options of the ingest connection which aren't set in CONNECTIONS, suited
+# to long bulk requests.
+INGEST_CONNECTION_DEFAULTS = {
+    'timeout': 120,
+    'http_compress': True,
+    'maxsize': 25,
+    'retry_on_timeout': True,
+}
+
 
 def recursive_update(d, u):
     for k, v in six.iteritems(u):
@@ -43,8 +70,21 @@ def recursive_update(d, u):
     return d
 
 
-def post_save_es_index(sender, instance, **kwargs):
+def post_save_es_index(sender, instance, using=None, **kwargs):
+    trampoline_config = get_trampoline_config()
+    # Signals stay connected when the settings change, only the models
+    # still listed in INDICES are indexed.
+    if not trampoline_config.get_model_indices(sender):
+        return
+    metrics = trampoline_config.metrics
+    metrics.incr('trampoline.signal.post_save', tags=get_model_tags(sender))
     if instance.is_indexable():
+        # Saves made inside a transaction are coalesced and indexed in bulk
+        # once it is commited.
+        index_buffer = get_index_buffer(using)
+        if index_buffer is not None:
+            index_buffer.add(instance)
+            return
         try:
             # post_save fires after the save occurs but before the transaction
             # is commited.
@@ -54,10 +94,24 @@ def post_save_es_index(sender, instance, **kwargs):
             instance.es_index(countdown=1)
 
 
-def post_delete_es_delete(sender, instance, **kwargs):
+def post_delete_es_delete(sender, instance, using=None, **kwargs):
+    trampoline_config = get_trampoline_config()
+    if not trampoline_config.get_model_indices(sender):
+        return
+    metrics = trampoline_config.metrics
+    metrics.incr('trampoline.signal.post_delete', tags=get_model_tags(sender))
+    # Don't index the object once the transaction is commited.
+    index_buffer = get_index_buffer(using, create=False)
+    if index_buffer is not None:
+        index_buffer.discard(instance)
     instance.es_delete()
 
 
+def setting_changed_clear_cache(sender, setting, **kwargs):
+    if setting == 'TRAMPOLINE':
+        get_trampoline_config().clear_cache()
+
+
 def class_prepared_check_indexable(sender, **kwargs):
     trampoline_config = get_trampoline_config()
 
@@ -88,48 +142,116 @@ class TrampolineConfig(AppConfig):
     verbose_name = "Trampoline"
 
     def __init__(self, *args, **kwargs):
+        self._settings = None
+        self._model_paths = None
+        self._registry = None
+        self._metrics = None
+        self._background_indexer = None
         class_prepared.connect(class_prepared_check_indexable)
+        setting_changed.connect(setting_changed_clear_cache)
         super(TrampolineConfig, self).__init__(*args, **kwargs)
 
     def ready(self):
+        self.configure_connections()
+        self.build_registry()
+
+    def configure_connections(self):
         if 'HOST' in self.settings:
             raise NotImplementedError('"HOST" key replaced by "CONNECTIONS"')
         options = {}
         for alias, details in self.settings['CONNECTIONS'].items():
+            details = dict(details)
+            # Allow dotted paths, e.g. trampoline.testing.InMemoryConnection.
+            connection_class = details.get('connection_class')
+            if isinstance(connection_class, six.string_types):
+                details['connection_class'] = import_path(connection_class)
             options[alias] = details
 
+        ingest_connection = self.ingest_connection
+        if ingest_connection:
+            if ingest_connection in options:
+                details = dict(INGEST_CONNECTION_DEFAULTS)
+                details.update(options[ingest_connection])
+            else:
+                # Same hosts as the default connection.
+                details = dict(options['default'])
+                details.update(INGEST_CONNECTION_DEFAULTS)
+            options[ingest_connection] = details
+
         connections.configure(**options)
 
+    def build_registry(self):
+        """
+        Resolve the models of every index once.
+
+        The registry maps each index name to its models and each model to
+        the list of (index_name, doc_type) it is indexed into.
+        """
+        resolved = {}
+        index_models = {}
+        model_indices = {}
+        for index_name in self.indices:
+            models = []
+            for model_path in self.indices[index_name].get('models', ()):
+                if model_path not in resolved:
+                    resolved[model_path] = import_path(model_path)
+                model = resolved[model_path]
+                if model not in models:
+                    models.append(model)
+                    model_indices.setdefault(model, []).append(
+                        (index_name, model.get_es_doc_type())
+                    )
+            index_models[index_name] = models
+        self._registry = {
+            'index_models': index_models,
+            'model_indices': model_indices,
+        }
+        return self._registry
+
+    @property
+    def registry(self):
+        if self._registry is None:
+            self.build_registry()
+        return self._registry
+
     def get_index_models(self, index_name):
-        try:
-            model_paths = self.indices[index_name]['models']
-        except KeyError:
-            return []
+        return list(self.registry['index_models'].get(index_name, []))
 
-        models = []
-        for model_path in model_paths:
-            module_path, model_name = model_path.rsplit('.', 1)
-            module = __import__(module_path, fromlist=[''])
-            model = getattr(module, model_name)
-            if model not in models:
-                models.append(model)
-        return models
+    def get_model_indices(self, model):
+        """
+        Return the list of (index_name, doc_type) a model is indexed into.
+        """
+        return list(self.registry['model_indices'].get(model, []))
 
     @property
     def model_paths(self):
-        model_paths = []
-        for index_name in self.indices:
-            try:
-                model_paths += self.indices[index_name]['models']
-            except KeyError:
-                pass
-        return model_paths
+        if self._model_paths is None:
+            model_paths = []
+            for index_name in self.indices:
+                model_paths += self.indices[index_name].get('models', [])
+            self._model_paths = frozenset(model_paths)
+        return self._model_paths
 
     @property
     def settings(self):
-        USER_TRAMPOLINE = getattr(settings, 'TRAMPOLINE', {})
-        TRAMPOLINE = deepcopy(DEFAULT_TRAMPOLINE)
-        return recursive_update(TRAMPOLINE, USER_TRAMPOLINE)
+        if self._settings is None:
+            USER_TRAMPOLINE = getattr(settings, 'TRAMPOLINE', {})
+            TRAMPOLINE = deepcopy(DEFAULT_TRAMPOLINE)
+            self._settings = recursive_update(TRAMPOLINE, USER_TRAMPOLINE)
+        return self._settings
+
+    def clear_cache(self):
+        """
+        Drop the merged settings, the registry, the metrics backend and the
+        background indexer so they are computed again on next access.
+        """
+        self._settings = None
+        self._model_paths = None
+        self._registry = None
+        self._metrics = None
+        if self._background_indexer is not None:
+            self._background_indexer.stop()
+            self._background_indexer = None
 
     def get_connection(self, alias='default'):
         if not alias:
@@ -145,6 +267,14 @@ class TrampolineConfig(AppConfig):
     def indices(self):
         return self.settings['INDICES']
 
+    def get_write_to(self, index_name):
+        """
+        Return the connection aliases the documents of an index are written
+        to, None if the index doesn't define write_to.
+        """
+        write_to = self.indices.get(index_name, {}).get('write_to')
+        return list(write_to) if write_to else None
+
     @property
     def should_fail_silently(self):
         return self.settings['OPTIONS']['fail_silently']
@@ -157,6 +287,48 @@ class TrampolineConfig(AppConfig):
     def celery_queue(self):
         return self.settings['OPTIONS']['celery_queue']
 
+    @property
+    def search_cache(self):
+        return self.settings['OPTIONS']['search_cache']
+
+    @property
+    def search_cache_timeout(self):
+        return self.settings['OPTIONS']['search_cache_timeout']
+
+    @property
+    def search_cache_refresh_interval(self):
+        return self.settings['OPTIONS']['search_cache_refresh_interval']
+
+    @property
+    def ingest_connection(self):
+        return self.settings['OPTIONS']['ingest_connection']
+
+    @property
+    def debounce_cache(self):
+        return self.settings['OPTIONS']['debounce_cache']
+
+    @property
+    def backend(self):
+        return self.settings['OPTIONS']['backend']
+
+    @property
+    def background_indexer(self):
+        if self._background_indexer is None:
+            options = self.settings['OPTIONS']
+            self._background_indexer = BackgroundIndexer(
+                queue_size=options['background_queue_size'],
+                batch_size=options['background_batch_size'],
+                flush_interval=options['background_flush_interval'],
+                threads=options['background_threads'],
+            )
+        return self._background_indexer
+
+    @property
+    def metrics(self):
+        if self._metrics is None:
+            self._metrics = load_metrics(self.settings['OPTIONS']['metrics'])
+        return self._metrics
+
 
 try:
     # Try to import AppConfig to check if this feature is available.
@@ -167,7 +339,8 @@ try:
         return apps.get_app_config('trampoline')
 except ImportError:
     app_config = TrampolineConfig()
-    app_config.ready()
+    # Models aren't loaded yet, the registry is built on first access.
+    app_config.configure_connections()
 
     def get_trampoline_config():
         return app_config
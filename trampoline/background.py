@@ -0,0 +1,169 @@
+"""
+Background indexer for trampoline.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+import weakref
+
+from six.moves import queue
+
+try:
+    from django.db import close_old_connections
+except ImportError:  # pragma: no cover
+    from django.db import close_connection as close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# Markers put on the queue to process the pending calls right away.
+FLUSH = object()
+STOP = object()
+
+# Indexers whose threads are running, stopped by a single exit hook.
+_running_indexers = weakref.WeakSet()
+
+
+@atexit.register
+def stop_running_indexers():
+    for indexer in list(_running_indexers):
+        indexer.stop()
+
+
+class BackgroundIndexer(object):
+    """
+    Bounded in-process queue of bulk tasks drained by background threads,
+    used instead of Celery when the option backend is 'thread'.
+
+    Consecutive calls of a task with the same arguments are merged into a
+    single bulk request, sent once ``batch_size`` calls are pending or
+    ``flush_interval`` seconds after the first of them. Pending calls are
+    processed when the interpreter exits.
+    """
+
+    def __init__(
+            self,
+            queue_size=10000,
+            batch_size=500,
+            flush_interval=1,
+            threads=1):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.thread_count = threads
+        self.threads = []
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            # Threads don't survive a fork.
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.threads = []
+            for i in range(self.thread_count):
+                thread = threading.Thread(
+                    target=self.run,
+                    name='trampoline-indexer-{0}'.format(i)
+                )
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+            _running_indexers.add(self)
+
+    def add(self, task, args, values, **kwargs):
+        """
+        Queue the call ``task(*args, values, **kwargs)`` where ``values`` is
+        the list of ids or documents merged with other calls. Block while the
+        queue is full.
+        """
+        self.start()
+        self.queue.put((task, tuple(args), list(values), kwargs))
+
+    def flush(self):
+        """
+        Block until every queued call has been processed.
+        """
+        if self.pid != os.getpid():
+            return
+        for _ in self.threads:
+            self.queue.put(FLUSH)
+        self.queue.join()
+
+    def stop(self, timeout=10):
+        """
+        Process the queued calls and stop the threads.
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            threads, self.threads = self.threads, []
+            self.pid = None
+            _running_indexers.discard(self)
+        for _ in threads:
+            self.queue.put(STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+    def run(self):
+        while True:
+            batch, marker = self.get_batch()
+            try:
+                self.process(batch)
+            finally:
+                for _ in range(len(batch) + (marker is not None)):
+                    self.queue.task_done()
+            if marker is STOP:
+                return
+
+    def get_batch(self):
+        """
+        Return the calls of the next batch along with the marker which ended
+        it, if any.
+        """
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            try:
+                if deadline is None:
+                    item = self.queue.get()
+                else:
+                    timeout = max(deadline - time.time(), 0)
+                    item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is FLUSH or item is STOP:
+                return batch, item
+            batch.append(item)
+            if deadline is None:
+                deadline = time.time() + self.flush_interval
+        return batch, None
+
+    def process(self, batch):
+        if not batch:
+            return
+        groups = []
+        # Last group of each index, calls on the same index are merged only
+        # while they are consecutive so that an index followed by a delete
+        # of the same object stays in order.
+        last_groups = {}
+        for task, args, values, kwargs in batch:
+            key = (task, args, tuple(sorted(kwargs.items())))
+            group = last_groups.get(args[0])
+            if group is None or group[0] != key:
+                group = (key, task, args, [], kwargs)
+                groups.append(group)
+                last_groups[args[0]] = group
+            group[3].extend(values)
+
+        for key, task, args, values, kwargs in groups:
+            try:
+                task.run(*(args + (values,)), fail_silently=True, **kwargs)
+            except Exception:
+                logger.exception(
+                    "Exception occured in the background indexer.",
+                    extra={'task': getattr(task, 'name', task)}
+                )
+        close_old_connections()
@@ -0,0 +1,122 @@
+"""
+Transaction buffer for trampoline.
+"""
+from collections import OrderedDict
+import threading
+import weakref
+
+from django.db import connections as db_connections
+from django.db import DEFAULT_DB_ALIAS
+from django.db import transaction
+
+_local = threading.local()
+
+
+class FlushCallback(object):
+    """
+    Callback of a buffer registered with on_commit. Django drops it when the
+    transaction, or the savepoint it was registered in, is rolled back.
+    """
+
+    def __init__(self, index_buffer):
+        self.index_buffer = index_buffer
+
+    def __call__(self):
+        self.index_buffer.flush()
+
+
+class IndexBuffer(object):
+    """
+    Collect the objects saved during a transaction and index them once it is
+    commited, with a single task per model and index.
+
+    Only the model and the pk of each object are kept so that large
+    transactions don't hold references to model instances, except for the
+    models with es_inline_doc whose documents are built from the instances.
+    Instances saved inside a savepoint may hold values which are rolled back,
+    they are fetched again once the transaction is commited.
+    """
+
+    def __init__(self, using):
+        self.using = using
+        self.pending = OrderedDict()
+        self.registered = False
+        self.callback_ref = None
+
+    def add(self, instance):
+        model = instance.__class__
+        index_name = model.get_es_doc_type()._doc_type.index
+        key = (model, index_name)
+        objects = self.pending.setdefault(key, OrderedDict())
+        inline = (
+            model.es_inline_doc and
+            not model.es_debounce and
+            not any(db_connections[self.using].savepoint_ids)
+        )
+        objects[instance.pk] = instance if inline else None
+
+    def discard(self, instance):
+        """
+        Forget an object deleted during the transaction.
+        """
+        model = instance.__class__
+        index_name = model.get_es_doc_type()._doc_type.index
+        objects = self.pending.get((model, index_name))
+        if objects is not None:
+            objects.pop(instance.pk, None)
+
+    def is_registered(self):
+        """
+        Whether the flush is still scheduled, it is discarded by django if
+        the transaction is rolled back.
+        """
+        return self.registered
+
+    def register(self):
+        callback = FlushCallback(self)
+        self.registered = True
+        # Only django holds the callback, the weak reference is called once
+        # it is run or discarded by a rollback.
+        self.callback_ref = weakref.ref(callback, self.unregister)
+        transaction.on_commit(callback, using=self.using)
+
+    def unregister(self, callback_ref=None):
+        self.registered = False
+
+    def flush(self):
+        self.registered = False
+        pending, self.pending = self.pending, OrderedDict()
+        for (model, index_name), objects in pending.items():
+            instances = []
+            object_ids = []
+            for object_id, instance in objects.items():
+                if instance is None:
+                    object_ids.append(object_id)
+                elif instance.pk is not None:
+                    instances.append(instance)
+            if instances:
+                model.es_index_instances(instances, index_name=index_name)
+            model.es_index_many(object_ids, index_name=index_name)
+
+
+def get_index_buffer(using=None, create=True):
+    """
+    Return the buffer of the transaction currently open on the connection
+    ``using``, or None when no transaction is open. Unless ``create``, None
+    is also returned when nothing was buffered yet.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    connection = db_connections[using]
+    if not getattr(connection, 'in_atomic_block', False):
+        return None
+
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    index_buffer = buffers.get(using)
+    if index_buffer is None or not index_buffer.is_registered():
+        if not create:
+            return None
+        index_buffer = buffers[using] = IndexBuffer(using)
+        index_buffer.register()
+    return index_buffer
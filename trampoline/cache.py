@@ -0,0 +1,141 @@
+"""
+Search cache for trampoline.
+"""
+import hashlib
+import json
+import math
+import time
+
+try:
+    from django.core.cache import caches
+except ImportError:  # pragma: no cover
+    from django.core.cache import get_cache
+    caches = None
+
+from trampoline import get_trampoline_config
+
+trampoline_config = get_trampoline_config()
+
+ALL_INDICES = '_all'
+GENERATION_KEY = 'trampoline:generation:{0}'
+SEARCH_KEY = 'trampoline:search:{0}:{1}'
+BUMPED_AT_KEY = 'trampoline:bumped_at:{0}'
+DEBOUNCE_KEY = 'trampoline:debounce:{0}:{1}:{2}'
+
+
+def get_cache_by_alias(alias):
+    if caches is None:  # pragma: no cover
+        return get_cache(alias)
+    return caches[alias]
+
+
+def get_search_cache():
+    alias = trampoline_config.search_cache
+    if alias is None:
+        return None
+    return get_cache_by_alias(alias)
+
+
+def get_debounce_cache():
+    return get_cache_by_alias(trampoline_config.debounce_cache)
+
+
+def get_index_generation_keys(index_names):
+    if not index_names:
+        index_names = [ALL_INDICES]
+    return [GENERATION_KEY.format(index_name) for index_name in index_names]
+
+
+def get_bumped_at_keys(index_names):
+    if not index_names:
+        index_names = [ALL_INDICES]
+    return [BUMPED_AT_KEY.format(index_name) for index_name in index_names]
+
+
+def get_search_cache_key(cache, search):
+    """
+    Build the key of a search, it changes whenever one of the searched
+    indices is written to. Return None while the last write to one of them
+    may not be visible yet, the response mustn't be cached then.
+    """
+    keys = get_index_generation_keys(search._index)
+    bumped_at_keys = get_bumped_at_keys(search._index)
+    generations = cache.get_many(keys + bumped_at_keys)
+    refresh_interval = trampoline_config.search_cache_refresh_interval
+    now = time.time()
+    for key in bumped_at_keys:
+        if now - generations.get(key, 0) < refresh_interval:
+            return None
+    generation = u'-'.join(str(generations.get(key, 0)) for key in keys)
+    data = json.dumps(
+        {
+            'index': search._index,
+            'doc_type': search._doc_type,
+            'params': search._params,
+            'body': search.to_dict(),
+        },
+        sort_keys=True,
+        default=str
+    )
+    digest = hashlib.sha1(data.encode('utf-8')).hexdigest()
+    return SEARCH_KEY.format(generation, digest)
+
+
+def bump_index_generation(index_name):
+    """
+    Invalidate the cached searches made on an index.
+    """
+    cache = get_search_cache()
+    if cache is None:
+        return
+    for key in get_index_generation_keys([index_name, ALL_INDICES]):
+        try:
+            cache.incr(key)
+        except ValueError:
+            if not cache.add(key, 1, None):
+                cache.incr(key)
+    # ElasticSearch only exposes the write once the index is refreshed,
+    # searches made until then aren't cached under the new generation.
+    refresh_interval = trampoline_config.search_cache_refresh_interval
+    if refresh_interval:
+        now = time.time()
+        cache.set_many(
+            {
+                key: now
+                for key in get_bumped_at_keys([index_name, ALL_INDICES])
+            },
+            int(math.ceil(refresh_interval))
+        )
+
+
+def get_debounce_keys(index_name, content_type_id, object_ids):
+    return [
+        DEBOUNCE_KEY.format(index_name, content_type_id, object_id)
+        for object_id in object_ids
+    ]
+
+
+def add_debounced_ids(index_name, content_type_id, object_ids, window):
+    """
+    Mark objects as pending indexation and return the ids which weren't
+    already pending, only those need a task.
+    """
+    cache = get_debounce_cache()
+    keys = get_debounce_keys(index_name, content_type_id, object_ids)
+    # Keys expire on their own should a task be lost.
+    return [
+        object_id
+        for object_id, key in zip(object_ids, keys)
+        if cache.add(key, 1, window * 2)
+    ]
+
+
+def clear_debounced_ids(index_name, content_type_id, object_ids):
+    """
+    Called by the task before fetching the objects so that saves made from
+    then on schedule another task.
+    """
+    cache = get_debounce_cache()
+    cache.delete_many(
+        get_debounce_keys(index_name, content_type_id, object_ids)
+    )
@@ -16,6 +16,9 @@ from trampoline import get_trampoline_config
 class ESBaseCommand(BaseCommand):
     required_options = []
 
+    MAX_THREADS_DEFAULT = 4
+    CHUNK_SIZE_DEFAULT = 500
+
     options = {
         'index_name': make_option(
             '--index',
@@ -38,6 +41,27 @@ class ESBaseCommand(BaseCommand):
             default='default',
             help="Connection name."
         ),
+        'max_threads': make_option(
+            '--threads',
+            dest='max_threads',
+            default=MAX_THREADS_DEFAULT,
+            help="Number of threads."
+        ),
+        'chunk_size': make_option(
+            '--chunk-size',
+            dest='chunk_size',
+            default=CHUNK_SIZE_DEFAULT,
+            help="Number of objects loaded and indexed per chunk."
+        ),
+        'processes': make_option(
+            '--processes',
+            dest='processes',
+            default=None,
+            help=(
+                "Number of worker processes, documents are then indexed "
+                "through the bulk API."
+            )
+        ),
     }
 
     option_list = BaseCommand.option_list + (
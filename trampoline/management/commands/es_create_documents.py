@@ -2,20 +2,41 @@
 Management command for trampoline.
 """
 from __future__ import print_function
-from concurrent.futures import as_completed
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
 from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from multiprocessing import Pool
 from optparse import make_option
+import datetime
 import logging
 import sys
+import threading
+import time
 
 from tqdm import tqdm
 
 from elasticsearch_dsl import Index
 
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db import connections as db_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_datetime
 
+from trampoline import get_trampoline_config
+
+from trampoline.cache import bump_index_generation
 from trampoline.management.base import ESBaseCommand
-from trampoline.tasks import es_index_object
+from trampoline.management.state import IndexationState
+from trampoline.management.workers import init_worker_process
+from trampoline.metrics import get_model_tags
+from trampoline.tasks import es_bulk_delete_docs
+from trampoline.tasks import es_bulk_index_objects
+from trampoline.tasks import es_index_instance
+from trampoline.tasks import incr_status
+from trampoline.tasks import STATUS_DELETED
 from trampoline.tasks import STATUS_FAILED
 from trampoline.tasks import STATUS_IGNORED
 from trampoline.tasks import STATUS_INDEXED
@@ -24,22 +45,211 @@ from trampoline.tasks import STATUS_INDEXED
 logger = logging.getLogger(__name__)
 
 
+def iter_queryset_chunks(queryset, chunk_size, last_pk=None):
+    """
+    Iterate over a queryset in chunks using keyset pagination on the pk,
+    starting after ``last_pk`` if given.
+    """
+    queryset = queryset.order_by('pk')
+    metrics = get_trampoline_config().metrics
+    tags = get_model_tags(queryset.model)
+    while True:
+        chunk_queryset = queryset
+        if last_pk is not None:
+            chunk_queryset = chunk_queryset.filter(pk__gt=last_pk)
+        with metrics.timer('trampoline.fetch', tags):
+            chunk = list(chunk_queryset[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+
+def iter_pk_ranges(queryset, chunk_size, last_pk=None):
+    """
+    Split the pks of a queryset in consecutive (first_pk, last_pk) ranges,
+    starting after ``last_pk`` if given.
+    """
+    queryset = queryset.order_by('pk').values_list('pk', flat=True)
+    while True:
+        chunk_queryset = queryset
+        if last_pk is not None:
+            chunk_queryset = chunk_queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk_queryset[:chunk_size])
+        if not chunk:
+            return
+        yield chunk[0], chunk[-1]
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1]
+
+
+def parse_since(value):
+    """
+    Parse an ISO 8601 date or datetime, naive values are in the default
+    timezone. Raise ValueError if the value is invalid.
+    """
+    since = parse_datetime(value)
+    if since is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(u"Invalid date: '{0}'.".format(value))
+        since = datetime.datetime.combine(date, datetime.time())
+    if settings.USE_TZ and timezone.is_naive(since):
+        since = timezone.make_aware(since, timezone.get_default_timezone())
+    return since
+
+
+def filter_modified_since(queryset, model, since):
+    """
+    Restrict a queryset to the objects modified since a datetime, according
+    to the es_modified_field of the model.
+    """
+    if since is None or model.es_modified_field is None:
+        return queryset
+    lookup = '{0}__gte'.format(model.es_modified_field)
+    return queryset.filter(**{lookup: since})
+
+
+def get_task_status(connection, task_id):
+    """
+    Return the (completed, status, response) tuple of a task. Finished tasks
+    which aren't stored anymore, as with ElasticSearch 2.x, are completed.
+    The error of a task which failed as a whole is the 'error' key of its
+    response.
+    """
+    if hasattr(connection.tasks, 'get'):
+        data = connection.tasks.get(task_id=task_id, ignore=404)
+    else:  # pragma: no cover
+        data = connection.tasks.list(task_id=task_id, ignore=404)
+
+    if 'completed' in data:
+        response = data.get('response', {})
+        if data.get('error'):
+            response = dict(response, error=data['error'])
+        return (
+            data['completed'],
+            data['task'].get('status', {}),
+            response,
+        )
+    for node in data.get('nodes', {}).values():
+        task = node.get('tasks', {}).get(task_id)
+        if task is not None:
+            return False, task.get('status', {}), {}
+    return True, {}, {}
+
+
+def index_pk_range(options):
+    """
+    Index the objects of a pk range inside a worker process.
+    """
+    command = Command()
+    command.target_name = options['target_name']
+    command.using = options['using']
+    command.write_to = options['write_to']
+    command.dry_run = options['dry_run']
+    command.bulk = options['bulk']
+
+    content_type_id = options['content_type_id']
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    queryset = filter_modified_since(
+        model.get_es_bulk_queryset(),
+        model,
+        options['since']
+    ).filter(
+        pk__gte=options['first_pk'],
+        pk__lte=options['last_pk']
+    ).order_by('pk')
+    metrics = get_trampoline_config().metrics
+    with metrics.timer('trampoline.fetch', get_model_tags(model)):
+        objects = list(queryset)
+    if command.bulk:
+        results = command.index_objects(model, content_type_id, objects)
+    else:
+        results = command.index_objects_one_by_one(
+            model,
+            content_type_id,
+            objects
+        )
+    # Exceptions aren't always picklable.
+    for result in results:
+        if result.get('exc') is not None:
+            result['exc'] = str(result['exc'])
+    return options['last_pk'], results
+
+
+def count_failed(results):
+    return sum(1 for result in results if result['status'] == STATUS_FAILED)
+
+
+class ChunkTracker(object):
+    """
+    Track the chunks of a model, which complete out of order, to know the
+    last pk up to which every object has been indexed, along with the number
+    of objects which failed.
+
+    Chunks with failures are never completed so that a resumed run processes
+    them again.
+    """
+
+    def __init__(self, last_pk=None, failed=0):
+        self.last_pk = last_pk
+        self.failed = failed
+        self.chunks = deque()
+        self.completed = set()
+        self.lock = threading.Lock()
+
+    def add(self, last_pk):
+        with self.lock:
+            self.chunks.append(last_pk)
+
+    def complete(self, last_pk, failed=0):
+        with self.lock:
+            self.failed += failed
+            if failed:
+                return
+            self.completed.add(last_pk)
+            while self.chunks and self.chunks[0] in self.completed:
+                self.last_pk = self.chunks.popleft()
+                self.completed.remove(self.last_pk)
+
+
 class Command(ESBaseCommand):
     help = (
         "Create documents on {0}{1}INDEX_NAME{2} based on the method "
         "{0}get_indexable_queryset{2} on the related models."
     ).format(ESBaseCommand.BOLD, ESBaseCommand.UNDERLINE, ESBaseCommand.RESET)
 
-    MAX_THREADS_DEFAULT = 4
+    MAX_THREADS_DEFAULT = ESBaseCommand.MAX_THREADS_DEFAULT
+    CHUNK_SIZE_DEFAULT = ESBaseCommand.CHUNK_SIZE_DEFAULT
+    # Seconds between two checks of a server side reindex task.
+    REINDEX_POLL_INTERVAL = 1
+    # Seconds substracted from the stored checkpoint in delta mode, so that
+    # objects saved by transactions commited after the checkpoint was taken
+    # aren't missed.
+    DELTA_OVERLAP = 60
+    # Minimum number of seconds between two writes of the resume checkpoint.
+    CHECKPOINT_INTERVAL = 10
+    STATE_FILE_DEFAULT = 'trampoline.state.json'
 
     option_list = ESBaseCommand.option_list + (
         ESBaseCommand.options['index_name'],
         ESBaseCommand.options['target_name'],
+        ESBaseCommand.options['max_threads'],
+        ESBaseCommand.options['chunk_size'],
+        ESBaseCommand.options['processes'],
         make_option(
-            '--threads',
-            dest='max_threads',
-            default=MAX_THREADS_DEFAULT,
-            help="Number of threads."
+            '--using',
+            '-u',
+            dest='using',
+            default=None,
+            help=(
+                "Connection name, the option ingest_connection or the "
+                "default connection otherwise. Documents are only written "
+                "to this connection even if the index defines write_to."
+            )
         ),
         make_option(
             '--cleanup',
@@ -48,95 +258,601 @@ class Command(ESBaseCommand):
             default=False,
             help="Delete stale documents."
         ),
+        make_option(
+            '--slices',
+            dest='slices',
+            default=1,
+            help=(
+                "Number of parallel slices used to find stale documents "
+                "or to reindex from an index (requires ElasticSearch 5.0)."
+            )
+        ),
+        make_option(
+            '--bulk',
+            dest='bulk',
+            action='store_true',
+            default=False,
+            help="Index documents through the bulk API."
+        ),
+        make_option(
+            '--from-index',
+            dest='from_index',
+            default=None,
+            help=(
+                "Copy the documents of an existing index with the reindex "
+                "API instead of building them from the database."
+            )
+        ),
+        make_option(
+            '--since',
+            dest='since',
+            default=None,
+            help=(
+                "Only process the objects modified since this ISO 8601 "
+                "date or datetime."
+            )
+        ),
+        make_option(
+            '--delta',
+            dest='delta',
+            action='store_true',
+            default=False,
+            help=(
+                "Only process the objects modified since the last "
+                "successful run."
+            )
+        ),
+        make_option(
+            '--state-file',
+            dest='state_file',
+            default=None,
+            help=(
+                "Path of the file storing the checkpoints, {0} with --delta "
+                "or --resume. Checkpoints aren't stored otherwise."
+                .format(STATE_FILE_DEFAULT)
+            )
+        ),
+        make_option(
+            '--resume',
+            dest='resume',
+            action='store_true',
+            default=False,
+            help="Resume an interrupted run from its last checkpoint."
+        ),
+        make_option(
+            '--fail-on-error',
+            dest='fail_on_error',
+            action='store_true',
+            default=False,
+            help="Exit with an error status if any document failed."
+        ),
     )
     required_options = ('index_name',)
 
     def run(self, *args, **options):
         self.target_name = self.target_name or self.index_name
+        # Documents are written to every connection of the option write_to
+        # of the index, unless a connection is given.
+        self.write_to = None
+        if self.using is None:
+            self.write_to = self.trampoline_config.get_write_to(
+                self.index_name
+            )
+        self.using = (
+            self.using or
+            self.trampoline_config.ingest_connection or
+            'default'
+        )
+        self.write_to = self.write_to or [self.using]
+        if self.since is not None:
+            try:
+                self.since = parse_since(self.since)
+            except ValueError as exc:
+                self.print_error(str(exc))
+                sys.exit(1)
+        state_file = self.state_file
+        if state_file is None and (self.delta or self.resume):
+            state_file = self.STATE_FILE_DEFAULT
+        self.state = IndexationState(state_file)
         self.log_file = open('trampoline.log', 'w')
+        self.failed = 0
 
-        index = Index(self.target_name)
-        if not index.exists():
+        for using in set([self.using] + self.write_to):
+            index = Index(self.target_name, using=using)
+            if not index.exists():
+                self.print_error(
+                    u"Index '{0}' does not exist on '{1}'."
+                    .format(self.target_name, using)
+                )
+                sys.exit(1)
+
+        models = self.trampoline_config.get_index_models(self.index_name)
+
+        if self.from_index:
+            self.reindex_from_index(models)
+        else:
+            self.print_info(
+                u"Indexing objects on '{0}'.".format(self.target_name)
+            )
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.get_max_threads()
+            )
+            try:
+                for model in models:
+                    self.index_model(model)
+            finally:
+                self.executor.shutdown()
+
+        if not self.dry_run:
+            bump_index_generation(self.target_name)
+            # Searches are cached under the name they were made on, usually
+            # the alias.
+            if self.index_name != self.target_name:
+                bump_index_generation(self.index_name)
+        self.log_file.close()
+        if self.failed and self.fail_on_error:
             self.print_error(
-                u"Index '{0}' does not exist."
-                .format(self.target_name)
+                u"{0} document(s) failed, see trampoline.log."
+                .format(self.failed)
             )
             sys.exit(1)
+        self.print_success("Indexation completed.")
 
-        self.print_info(u"Indexing objects on '{0}'.".format(self.target_name))
+    def index_model(self, model):
+        queryset = model.get_indexable_queryset()
+        content_type_id = ContentType.objects.get_for_model(model).pk
+        since = self.get_since(model)
+        started_at = timezone.now()
+        tracker = ChunkTracker()
 
-        models = self.trampoline_config.get_index_models(self.index_name)
+        model_name = model.__name__
+        self.print_info(u"Processing model: '{0}'.".format(model_name))
 
-        for model in models:
-            queryset = model.get_indexable_queryset()
-            object_ids = queryset.values_list('pk', flat=True)
-            content_type_id = ContentType.objects.get_for_model(model).pk
+        resume = None
+        if self.resume:
+            resume = self.state.get(self.target_name, model, 'resume')
+        if resume is not None:
+            started_at = parse_datetime(resume['started_at'])
+            tracker.last_pk = resume['last_pk']
+            # Failures of the previous runs, their chunks are processed
+            # again.
+            tracker.failed = resume.get('failed', 0)
+            self.print_info(u"Resuming after pk {0}.".format(tracker.last_pk))
 
-            model_name = model.__name__
-            self.print_info(u"Processing model: '{0}'.".format(model_name))
+        if self.cleanup:
+            self.delete_stale_documents(model, queryset)
 
-            if self.cleanup:
-                self.delete_stale_documents(model, object_ids)
+        progress_status = {
+            STATUS_INDEXED: 0,
+            STATUS_FAILED: 0,
+            STATUS_IGNORED: 0,
+        }
+        desc = self.get_progress_bar_desc(progress_status)
+        total_queryset = filter_modified_since(queryset, model, since)
+        if tracker.last_pk is not None:
+            total_queryset = total_queryset.filter(pk__gt=tracker.last_pk)
+        progress_bar = tqdm(
+            total=total_queryset.count(),
+            dynamic_ncols=True,
+            desc=desc
+        )
 
-            progress_status = {
-                STATUS_INDEXED: 0,
-                STATUS_FAILED: 0,
-                STATUS_IGNORED: 0,
+        self.checkpoint_saved_at = time.time()
+        processes = self.get_processes()
+        try:
+            if processes:
+                self.index_with_processes(
+                    model,
+                    content_type_id,
+                    since,
+                    tracker,
+                    started_at,
+                    processes,
+                    progress_status,
+                    progress_bar
+                )
+            else:
+                self.index_with_threads(
+                    model,
+                    content_type_id,
+                    since,
+                    tracker,
+                    started_at,
+                    progress_status,
+                    progress_bar
+                )
+        except BaseException:
+            self.save_resume_checkpoint(model, tracker, started_at, True)
+            raise
+        progress_bar.close()
+        self.failed += progress_status[STATUS_FAILED]
+        if not self.dry_run:
+            self.state.delete(self.target_name, model, 'resume')
+        self.save_checkpoint(model, started_at, tracker.failed)
+
+    def get_since(self, model):
+        """
+        Return the datetime since which the objects of the model must be
+        processed, or None to process all of them.
+        """
+        if not self.since and not self.delta:
+            return None
+        if model.es_modified_field is None:
+            self.print_warning(
+                u"'{0}' has no es_modified_field, all its objects are "
+                u"processed.".format(model.__name__)
+            )
+            return None
+        if self.since:
+            return self.since
+
+        checkpoint = self.state.get(
+            self.target_name,
+            model,
+            'modified_since'
+        )
+        if checkpoint is None:
+            return None
+        since = parse_datetime(checkpoint)
+        return since - datetime.timedelta(seconds=self.DELTA_OVERLAP)
+
+    def save_resume_checkpoint(self, model, tracker, started_at, force=False):
+        """
+        Store the last pk up to which every object of the model has been
+        indexed and the number of failures, at most every CHECKPOINT_INTERVAL
+        seconds.
+        """
+        if self.dry_run or (tracker.last_pk is None and not tracker.failed):
+            return
+        now = time.time()
+        elapsed = now - self.checkpoint_saved_at
+        if not force and elapsed < self.CHECKPOINT_INTERVAL:
+            return
+        self.checkpoint_saved_at = now
+        self.state.set(
+            self.target_name,
+            model,
+            'resume',
+            {
+                'last_pk': tracker.last_pk,
+                'started_at': started_at.isoformat(),
+                'failed': tracker.failed,
             }
-            desc = self.get_progress_bar_desc(progress_status)
-            progress_bar = tqdm(
-                total=len(object_ids),
-                dynamic_ncols=True,
-                desc=desc
-            )
-
-            max_threads = self.get_max_threads()
-            with ThreadPoolExecutor(max_workers=max_threads) as executor:
-                tasks = [
-                    executor.submit(
-                        self.index_object,
-                        content_type_id,
-                        object_id
+        )
+
+    def save_checkpoint(self, model, started_at, failed):
+        """
+        Store the time at which the model started being processed, the next
+        delta run starts from there unless some objects failed, during this
+        run or the interrupted runs it resumed.
+
+        Runs with --since leave the checkpoint alone, the objects modified
+        between the checkpoint and their date haven't been processed.
+        """
+        if self.dry_run or model.es_modified_field is None or self.since:
+            return
+        if failed:
+            self.print_warning(
+                u"Some objects failed, the checkpoint of '{0}' is kept."
+                .format(model.__name__)
+            )
+            return
+        self.state.set(
+            self.target_name,
+            model,
+            'modified_since',
+            started_at.isoformat()
+        )
+
+    def reindex_from_index(self, models):
+        """
+        Copy the documents of the index from_index into the target with the
+        reindex API on every connection of write_to, split in slices
+        processed in parallel by ElasticSearch.
+        """
+        source_name = self.from_index
+        for using in self.write_to:
+            source_index = Index(source_name, using=using)
+            if source_name == self.target_name or not source_index.exists():
+                self.print_error(
+                    u"Can't reindex from '{0}' on '{1}'."
+                    .format(source_name, using)
+                )
+                sys.exit(1)
+
+        doc_type_names = []
+        for model in models:
+            doc_type_name = model.get_es_doc_type()._doc_type.name
+            if doc_type_name not in doc_type_names:
+                doc_type_names.append(doc_type_name)
+
+        for using in self.write_to:
+            self.reindex_on_connection(using, doc_type_names)
+
+    def reindex_on_connection(self, using, doc_type_names):
+        source_name = self.from_index
+        self.print_info(u"Reindexing '{0}' on '{1}' ({2}).".format(
+            source_name, self.target_name, using))
+
+        connection = self.trampoline_config.get_connection(using)
+        total = connection.count(
+            index=source_name,
+            doc_type=','.join(doc_type_names)
+        )['count']
+        if self.dry_run:
+            self.print_success(u"{0} document(s) would be reindexed.".format(
+                total))
+            return
+
+        body = {
+            'source': {'index': source_name, 'type': doc_type_names},
+            'dest': {'index': self.target_name},
+        }
+        params = {'wait_for_completion': 'false'}
+        slices = self.get_slices()
+        if slices > 1:
+            params['slices'] = slices
+        task_id = connection.reindex(body=body, params=params)['task']
+
+        progress_status = {
+            STATUS_INDEXED: 0,
+            STATUS_FAILED: 0,
+            STATUS_IGNORED: 0,
+        }
+        desc = self.get_progress_bar_desc(progress_status)
+        progress_bar = tqdm(total=total, dynamic_ncols=True, desc=desc)
+        while True:
+            completed, status, response = get_task_status(connection, task_id)
+            if completed and response:
+                status = response
+            self.update_reindex_progress(status, progress_status, progress_bar)
+            if completed:
+                break
+            time.sleep(self.REINDEX_POLL_INTERVAL)
+        progress_bar.close()
+        self.failed += progress_status[STATUS_FAILED]
+
+        for failure in response.get('failures', []):
+            print(
+                "FAILED: document {0} (doc_type {1})"
+                .format(failure.get('id'), failure.get('type')),
+                str(failure.get('cause')),
+                file=self.log_file
+            )
+
+        error = response.get('error')
+        if error:
+            self.failed += 1
+            print(
+                "FAILED: reindex task {0}".format(task_id),
+                str(error),
+                file=self.log_file
+            )
+            self.log_file.close()
+            self.print_error(u"Reindex failed: {0}".format(error))
+            sys.exit(1)
+
+    def update_reindex_progress(self, status, progress_status, progress_bar):
+        processed = sum(progress_status.values())
+        progress_status[STATUS_INDEXED] = (
+            status.get('created', 0) + status.get('updated', 0)
+        )
+        progress_status[STATUS_FAILED] = len(status.get('failures', []))
+        progress_status[STATUS_IGNORED] = (
+            status.get('version_conflicts', 0) + status.get('noops', 0)
+        )
+        desc = self.get_progress_bar_desc(progress_status)
+        progress_bar.set_description(desc)
+        progress_bar.update(sum(progress_status.values()) - processed)
+
+    def index_with_threads(
+            self,
+            model,
+            content_type_id,
+            since,
+            tracker,
+            started_at,
+            progress_status,
+            progress_bar):
+        if self.bulk:
+            index_chunk = self.index_objects
+        else:
+            index_chunk = self.index_objects_one_by_one
+
+        max_threads = self.get_max_threads()
+        chunks = iter_queryset_chunks(
+            filter_modified_since(model.get_es_bulk_queryset(), model, since),
+            self.get_chunk_size(),
+            tracker.last_pk
+        )
+        # Last pk of the chunk indexed by each task.
+        tasks = {}
+        for chunk in chunks:
+            tracker.add(chunk[-1].pk)
+            task = self.executor.submit(
+                index_chunk,
+                model,
+                content_type_id,
+                chunk
+            )
+            tasks[task] = chunk[-1].pk
+            # Bound the number of chunks held in memory.
+            if len(tasks) >= max_threads * 2:
+                done, _ = wait(tasks, return_when=FIRST_COMPLETED)
+                self.handle_tasks(done, progress_status, progress_bar)
+                for task in done:
+                    tracker.complete(
+                        tasks.pop(task),
+                        count_failed(task.result())
                     )
-                    for object_id in object_ids
-                ]
-                for task in as_completed(tasks):
-                    result = task.result()
-
-                    status = result['status']
-                    if status in progress_status:
-                        progress_status[status] += 1
-
-                    exc = result.get('exc')
-                    if exc is not None:
-                        print(
-                            "FAILED: pk {0} (content_type {1})"
-                            .format(
-                                result['object_id'],
-                                result['content_type_id'],
-                            ),
-                            str(exc),
-                            file=self.log_file
-                        )
-
-                    desc = self.get_progress_bar_desc(progress_status)
-                    progress_bar.set_description(desc)
-                    progress_bar.update()
-            progress_bar.close()
+                self.save_resume_checkpoint(model, tracker, started_at)
+        done = wait(tasks).done
+        self.handle_tasks(done, progress_status, progress_bar)
+        for task in done:
+            tracker.complete(tasks.pop(task), count_failed(task.result()))
 
-        self.log_file.close()
-        self.print_success("Indexation completed.")
+    def index_with_processes(
+            self,
+            model,
+            content_type_id,
+            since,
+            tracker,
+            started_at,
+            processes,
+            progress_status,
+            progress_bar):
+        pk_ranges = iter_pk_ranges(
+            filter_modified_since(model.get_es_bulk_queryset(), model, since),
+            self.get_chunk_size(),
+            tracker.last_pk
+        )
 
-    def delete_stale_documents(self, model, object_ids):
+        def iter_tasks():
+            for first_pk, last_pk in pk_ranges:
+                tracker.add(last_pk)
+                yield {
+                    'target_name': self.target_name,
+                    'using': self.using,
+                    'write_to': self.write_to,
+                    'dry_run': self.dry_run,
+                    'bulk': self.bulk,
+                    'content_type_id': content_type_id,
+                    'since': since,
+                    'first_pk': first_pk,
+                    'last_pk': last_pk,
+                }
+
+        # Don't share the parent's database connections with the workers.
+        for db_connection in db_connections.all():
+            db_connection.close()
+        pool = Pool(processes=processes, initializer=init_worker_process)
+        try:
+            tasks = pool.imap_unordered(index_pk_range, iter_tasks())
+            for last_pk, results in tasks:
+                for result in results:
+                    self.handle_result(result, progress_status, progress_bar)
+                tracker.complete(last_pk, count_failed(results))
+                self.save_resume_checkpoint(model, tracker, started_at)
+        finally:
+            pool.close()
+            pool.join()
+
+    def handle_tasks(self, tasks, progress_status, progress_bar):
+        for task in tasks:
+            for result in task.result():
+                self.handle_result(result, progress_status, progress_bar)
+
+    def handle_result(self, result, progress_status, progress_bar):
+        status = result['status']
+        if status in progress_status:
+            progress_status[status] += 1
+        if not self.dry_run:
+            model = ContentType.objects.get_for_id(
+                result['content_type_id']
+            ).model_class()
+            incr_status(status, get_model_tags(model, self.target_name))
+
+        exc = result.get('exc')
+        if exc is not None:
+            print(
+                "FAILED: pk {0} (content_type {1})"
+                .format(
+                    result['object_id'],
+                    result['content_type_id'],
+                ),
+                str(exc),
+                file=self.log_file
+            )
+
+        desc = self.get_progress_bar_desc(progress_status)
+        progress_bar.set_description(desc)
+        progress_bar.update()
+
+    def delete_stale_documents(self, model, queryset):
         self.print_info("Deleting stale documents.")
+        slices = self.get_slices()
+        # Connections of write_to may have diverged, each one is scanned.
+        tasks = [
+            self.executor.submit(
+                self.delete_stale_documents_slice,
+                model,
+                queryset,
+                slice_id,
+                slices,
+                using
+            )
+            for using in self.write_to
+            for slice_id in range(slices)
+        ]
+        deleted = 0
+        for task in tasks:
+            deleted += task.result()
+        self.print_success(
+            u"Cleanup completed: {0} stale document(s) deleted."
+            .format(deleted)
+        )
+
+    def delete_stale_documents_slice(
+            self,
+            model,
+            queryset,
+            slice_id,
+            slices,
+            using):
+        """
+        Scroll over a slice of the documents of a connection and delete in
+        bulk those which don't match an object of the queryset anymore.
+        """
+        doc_type = model.get_es_doc_type()
+        search = doc_type.search(using=using, index=self.target_name)
+        search = search.fields([])
+        if slices > 1:
+            search = search.extra(slice={'id': slice_id, 'max': slices})
+
+        chunk_size = self.get_chunk_size()
+        deleted = 0
         es_ids = []
-        for item in model.es_doc_type.search().fields([]).scan():
+        for item in search.scan():
             es_ids.append(str(item.meta.id))
-        es_ids = set(es_ids)
-        stale_ids = es_ids - set(map(str, object_ids))
-        for stale_id in stale_ids:
-            model.es_doc_type.get(stale_id).delete(ignore=404)
-        self.print_success("Cleanup completed.")
+            if len(es_ids) >= chunk_size:
+                deleted += self.delete_stale_ids(
+                    model,
+                    queryset,
+                    es_ids,
+                    using
+                )
+                es_ids = []
+        if es_ids:
+            deleted += self.delete_stale_ids(model, queryset, es_ids, using)
+        return deleted
+
+    def delete_stale_ids(self, model, queryset, es_ids, using):
+        object_ids = queryset.filter(pk__in=es_ids).values_list('pk')
+        object_ids = set(str(object_id) for object_id, in object_ids)
+        stale_ids = [es_id for es_id in es_ids if es_id not in object_ids]
+        if not stale_ids or self.dry_run:
+            return len(stale_ids)
+
+        doc_type = model.get_es_doc_type()
+        results = es_bulk_delete_docs(
+            self.target_name,
+            doc_type._doc_type.name,
+            stale_ids,
+            using=using,
+            chunk_size=len(stale_ids)
+        )
+        deleted = 0
+        for doc_id, status, error in results:
+            if status == STATUS_DELETED:
+                deleted += 1
+            else:
+                print(
+                    "FAILED: stale document {0} (doc_type {1}) on {2}"
+                    .format(doc_id, doc_type._doc_type.name, using),
+                    str(error),
+                    file=self.log_file
+                )
+        return deleted
 
     def get_progress_bar_desc(self, progress_status):
         desc = (
@@ -163,21 +879,82 @@ class Command(ESBaseCommand):
                 max_threads = self.MAX_THREADS_DEFAULT
         return max_threads
 
-    def index_object(self, content_type_id, object_id):
-        result = {
-            'status': STATUS_INDEXED,
-            'object_id': object_id,
-            'content_type_id': content_type_id,
-        }
-        if not self.dry_run:
-            try:
-                result['status'] = es_index_object.run(
-                    self.target_name,
-                    content_type_id,
-                    object_id,
-                    fail_silently=False
-                )
-            except Exception as exc:
-                result['status'] = STATUS_FAILED
+    def get_slices(self):
+        try:
+            slices = int(self.slices)
+        except (TypeError, ValueError):
+            slices = 1
+        return max(slices, 1)
+
+    def get_processes(self):
+        try:
+            processes = int(self.processes)
+        except (TypeError, ValueError):
+            processes = 0
+        if processes < 1:
+            processes = 0
+        return processes
+
+    def get_chunk_size(self):
+        try:
+            chunk_size = int(self.chunk_size)
+        except:
+            chunk_size = self.CHUNK_SIZE_DEFAULT
+        else:
+            if chunk_size < 1:
+                chunk_size = self.CHUNK_SIZE_DEFAULT
+        return chunk_size
+
+    def index_objects_one_by_one(self, model, content_type_id, objects):
+        results = []
+        for obj in objects:
+            result = {
+                'status': STATUS_INDEXED,
+                'object_id': obj.pk,
+                'content_type_id': content_type_id,
+            }
+            if not self.dry_run:
+                try:
+                    result['status'] = es_index_instance(
+                        self.target_name,
+                        obj,
+                        using=self.write_to
+                    )
+                except Exception as exc:
+                    result['status'] = STATUS_FAILED
+                    result['exc'] = exc
+            results.append(result)
+        return results
+
+    def index_objects(self, model, content_type_id, objects):
+        if self.dry_run:
+            return [
+                {
+                    'status': STATUS_INDEXED,
+                    'object_id': obj.pk,
+                    'content_type_id': content_type_id,
+                }
+                for obj in objects
+            ]
+
+        try:
+            bulk_results = list(es_bulk_index_objects(
+                self.target_name,
+                objects,
+                using=self.write_to,
+                chunk_size=len(objects)
+            ))
+        except Exception as exc:
+            bulk_results = [(obj.pk, STATUS_FAILED, exc) for obj in objects]
+
+        results = []
+        for object_id, status, exc in bulk_results:
+            result = {
+                'status': status,
+                'object_id': object_id,
+                'content_type_id': content_type_id,
+            }
+            if exc is not None:
                 result['exc'] = exc
-        return result
+            results.append(result)
+        return results
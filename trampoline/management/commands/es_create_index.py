@@ -19,7 +19,8 @@ class Command(ESBaseCommand):
 
     option_list = ESBaseCommand.option_list + (
         ESBaseCommand.options['index_name'],
-        ESBaseCommand.options['target_name']
+        ESBaseCommand.options['target_name'],
+        ESBaseCommand.options['using']
     )
     required_options = ('index_name',)
 
@@ -30,7 +31,7 @@ class Command(ESBaseCommand):
             unix_time = calendar.timegm(time.gmtime())
             self.target_name = "{0}_{1}".format(self.index_name, unix_time)
 
-        index = Index(self.target_name)
+        index = Index(self.target_name, using=self.using)
         models = self.trampoline_config.get_index_models(self.index_name)
 
         if len(models) == 0:
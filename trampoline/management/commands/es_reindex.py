@@ -0,0 +1,199 @@
+"""
+Management command for trampoline.
+"""
+from optparse import make_option
+import calendar
+import sys
+import time
+
+from django.core.management import call_command
+
+from trampoline.cache import bump_index_generation
+from trampoline.management.base import ESBaseCommand
+
+
+class Command(ESBaseCommand):
+    help = (
+        "Rebuild {0}{1}INDEX_NAME{2} without downtime: create a new index, "
+        "fill it in bulk and atomically move the alias {0}{1}INDEX_NAME{2} "
+        "to it.\nIf {0}{1}TARGET_NAME{2} is not provided a unique name will "
+        "be generated by appending the current timestamp to "
+        "{0}{1}INDEX_NAME{2}."
+    ).format(ESBaseCommand.BOLD, ESBaseCommand.UNDERLINE, ESBaseCommand.RESET)
+
+    # Settings applied to the new index while documents are loaded.
+    BULK_LOAD_SETTINGS = {
+        'refresh_interval': '-1',
+        'number_of_replicas': 0,
+    }
+    DEFAULT_REFRESH_INTERVAL = '1s'
+
+    option_list = ESBaseCommand.option_list + (
+        ESBaseCommand.options['index_name'],
+        ESBaseCommand.options['target_name'],
+        ESBaseCommand.options['max_threads'],
+        ESBaseCommand.options['chunk_size'],
+        ESBaseCommand.options['processes'],
+        make_option(
+            '--using',
+            '-u',
+            dest='using',
+            default=None,
+            help=(
+                "Connection name, the option ingest_connection or the "
+                "default connection otherwise. The index is otherwise "
+                "rebuilt on every connection of its write_to."
+            )
+        ),
+        make_option(
+            '--force-merge',
+            dest='force_merge',
+            action='store_true',
+            default=False,
+            help="Force merge the new index down to one segment."
+        ),
+        make_option(
+            '--from-index',
+            dest='from_index',
+            default=None,
+            help=(
+                "Copy the documents of an existing index with the reindex "
+                "API instead of building them from the database."
+            )
+        ),
+    )
+    required_options = ('index_name',)
+
+    def run(self, *args, **options):
+        # es_create_documents resolves the connections the same way.
+        using = self.using
+        write_to = None
+        if using is None:
+            write_to = self.trampoline_config.get_write_to(self.index_name)
+        self.using = (
+            using or
+            self.trampoline_config.ingest_connection or
+            'default'
+        )
+        self.write_to = write_to or [self.using]
+        connections = [
+            (alias, self.trampoline_config.get_connection(alias))
+            for alias in self.write_to
+        ]
+
+        for alias, connection in connections:
+            if (connection.indices.exists(index=self.index_name) and
+                    not connection.indices.exists_alias(
+                        name=self.index_name)):
+                self.print_error(
+                    u"'{0}' is an index on '{1}' and can't be replaced by an "
+                    u"alias.".format(self.index_name, alias)
+                )
+                sys.exit(1)
+
+        if self.target_name is None:
+            unix_time = calendar.timegm(time.gmtime())
+            self.target_name = "{0}_{1}".format(self.index_name, unix_time)
+
+        for alias, connection in connections:
+            call_command(
+                'es_create_index',
+                index_name=self.index_name,
+                target_name=self.target_name,
+                using=alias,
+                dry_run=self.dry_run,
+                verbosity=self.verbosity
+            )
+        if self.dry_run:
+            self.print_success(
+                u"Alias '{0}' would be moved to '{1}'."
+                .format(self.index_name, self.target_name)
+            )
+            return
+
+        restore_settings = {}
+        for alias, connection in connections:
+            restore_settings[alias] = self.get_restore_settings(connection)
+            self.print_info(u"Tuning '{0}' on '{1}' for bulk loading.".format(
+                self.target_name, alias))
+            connection.indices.put_settings(
+                index=self.target_name,
+                body={'index': self.BULK_LOAD_SETTINGS}
+            )
+
+        try:
+            call_command(
+                'es_create_documents',
+                index_name=self.index_name,
+                target_name=self.target_name,
+                using=using,
+                bulk=True,
+                max_threads=self.max_threads,
+                chunk_size=self.chunk_size,
+                processes=self.processes,
+                from_index=self.from_index,
+                fail_on_error=True,
+                verbosity=self.verbosity
+            )
+        except SystemExit:
+            self.print_error(
+                u"Loading '{0}' failed, the alias '{1}' is left unchanged."
+                .format(self.target_name, self.index_name)
+            )
+            raise
+        finally:
+            for alias, connection in connections:
+                self.print_info(
+                    u"Restoring settings of '{0}' on '{1}'."
+                    .format(self.target_name, alias)
+                )
+                connection.indices.put_settings(
+                    index=self.target_name,
+                    body={'index': restore_settings[alias]}
+                )
+
+        if self.force_merge:
+            for alias, connection in connections:
+                self.print_info(u"Force merging '{0}' on '{1}'.".format(
+                    self.target_name, alias))
+                if hasattr(connection.indices, 'forcemerge'):
+                    forcemerge = connection.indices.forcemerge
+                else:  # pragma: no cover
+                    forcemerge = connection.indices.optimize
+                forcemerge(index=self.target_name, max_num_segments=1)
+
+        # es_create_documents loaded the target on every connection, or
+        # exited.
+        for alias, connection in connections:
+            self.switch_alias(connection)
+        # Searches cached while the alias pointed to the previous index.
+        bump_index_generation(self.index_name)
+
+    def get_restore_settings(self, connection):
+        index_settings = connection.indices.get_settings(
+            index=self.target_name
+        )[self.target_name]['settings']['index']
+        return {
+            'refresh_interval': index_settings.get(
+                'refresh_interval',
+                self.DEFAULT_REFRESH_INTERVAL
+            ),
+            'number_of_replicas': index_settings['number_of_replicas'],
+        }
+
+    def switch_alias(self, connection):
+        actions = []
+        if connection.indices.exists_alias(name=self.index_name):
+            old_indices = connection.indices.get_alias(name=self.index_name)
+            for old_index in old_indices:
+                actions.append({
+                    'remove': {'index': old_index, 'alias': self.index_name}
+                })
+        actions.append({
+            'add': {'index': self.target_name, 'alias': self.index_name}
+        })
+        connection.indices.update_aliases(body={'actions': actions})
+        self.print_success(
+            u"Alias '{0}' now points to '{1}'."
+            .format(self.index_name, self.target_name)
+        )
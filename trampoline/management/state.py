@@ -0,0 +1,75 @@
+"""
+Indexation state for trampoline.
+"""
+import json
+import os
+import tempfile
+import threading
+
+from trampoline.utils import get_model_name
+
+
+class IndexationState(object):
+    """
+    Checkpoints of es_create_documents stored per index and model inside a
+    local JSON file, or only kept in memory when the path is None.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = self.load()
+
+    def load(self):
+        if self.path is None:
+            return {}
+        try:
+            with open(self.path) as state_file:
+                return json.load(state_file)
+        except (IOError, OSError):
+            return {}
+
+    def save(self):
+        if self.path is None:
+            return
+        # Write a temporary file then rename it so that an interrupted
+        # command never leaves a truncated state behind.
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as temp_file:
+            json.dump(
+                self.data,
+                temp_file,
+                indent=2,
+                sort_keys=True,
+                default=str
+            )
+        if hasattr(os, 'replace'):
+            os.replace(temp_path, self.path)
+        else:  # pragma: no cover
+            os.rename(temp_path, self.path)
+
+    @staticmethod
+    def get_key(index_name, model):
+        return u"{0}:{1}.{2}".format(
+            index_name,
+            model._meta.app_label,
+            get_model_name(model)
+        )
+
+    def get(self, index_name, model, name, default=None):
+        key = self.get_key(index_name, model)
+        with self.lock:
+            return self.data.get(key, {}).get(name, default)
+
+    def set(self, index_name, model, name, value):
+        key = self.get_key(index_name, model)
+        with self.lock:
+            self.data.setdefault(key, {})[name] = value
+            self.save()
+
+    def delete(self, index_name, model, name):
+        key = self.get_key(index_name, model)
+        with self.lock:
+            if self.data.get(key, {}).pop(name, None) is not None:
+                self.save()
@@ -0,0 +1,32 @@
+"""
+Worker processes for trampoline.
+"""
+import django
+from django.db import connections as db_connections
+
+from elasticsearch_dsl.connections import connections
+
+from trampoline import get_trampoline_config
+
+
+def init_worker_process():
+    """
+    Give each worker process its own database and ElasticSearch connections.
+
+    With the spawn and forkserver start methods the worker imports this
+    module in a new interpreter, it must not import the modules which need
+    the application registry, such as trampoline.tasks, before Django is
+    set up. The tasks are unpickled, and their module imported, once the
+    initializer has run.
+    """
+    if hasattr(django, 'setup'):
+        django.setup()
+    for db_connection in db_connections.all():
+        db_connection.close()
+    trampoline_config = get_trampoline_config()
+    for alias in trampoline_config.settings['CONNECTIONS']:
+        try:
+            connections.remove_connection(alias)
+        except KeyError:
+            pass
+    trampoline_config.configure_connections()
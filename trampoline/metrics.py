@@ -0,0 +1,135 @@
+"""
+Metrics for trampoline.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+from trampoline.utils import get_model_name
+from trampoline.utils import import_path
+
+
+class NullMetrics(object):
+    """
+    Discard every metric, used when the option metrics isn't set.
+    """
+    enabled = False
+
+    def timing(self, name, value, tags=None):
+        """
+        Record a duration in milliseconds.
+        """
+
+    def incr(self, name, value=1, tags=None):
+        """
+        Increment a counter.
+        """
+
+    def histogram(self, name, value, tags=None):
+        """
+        Record a value such as a payload size in bytes.
+        """
+
+    @contextmanager
+    def timer(self, name, tags=None):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timing(name, (time.time() - start) * 1000, tags)
+
+
+class CallbackMetrics(NullMetrics):
+    """
+    Forward every metric to a statsd style callback called with
+    (metric_type, name, value, tags).
+    """
+    enabled = True
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def timing(self, name, value, tags=None):
+        self.callback('timing', name, value, tags or {})
+
+    def incr(self, name, value=1, tags=None):
+        self.callback('incr', name, value, tags or {})
+
+    def histogram(self, name, value, tags=None):
+        self.callback('histogram', name, value, tags or {})
+
+
+class InMemoryMetrics(NullMetrics):
+    """
+    Collect metrics in memory, meant to be used in tests.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.timings = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(list)
+
+    @staticmethod
+    def get_key(name, tags):
+        return name, tuple(sorted((tags or {}).items()))
+
+    def timing(self, name, value, tags=None):
+        with self.lock:
+            self.timings[self.get_key(name, tags)].append(value)
+
+    def incr(self, name, value=1, tags=None):
+        with self.lock:
+            self.counters[self.get_key(name, tags)] += value
+
+    def histogram(self, name, value, tags=None):
+        with self.lock:
+            self.histograms[self.get_key(name, tags)].append(value)
+
+    def get_timings(self, name, **tags):
+        return self.timings.get(self.get_key(name, tags), [])
+
+    def get_counter(self, name, **tags):
+        return self.counters.get(self.get_key(name, tags), 0)
+
+    def get_histogram(self, name, **tags):
+        return self.histograms.get(self.get_key(name, tags), [])
+
+
+NULL_METRICS = NullMetrics()
+
+
+def load_metrics(path):
+    """
+    Build the backend of the option metrics: the dotted path of either a
+    backend class, instantiated without arguments, or a statsd style
+    callback.
+    """
+    if path is None:
+        return NULL_METRICS
+    backend = import_path(path)
+    if isinstance(backend, type):
+        return backend()
+    return CallbackMetrics(backend)
+
+
+def get_model_tags(model, index_name=None):
+    tags = {
+        'model': u"{0}.{1}".format(
+            model._meta.app_label,
+            get_model_name(model)
+        ),
+    }
+    if index_name is not None:
+        tags['index'] = index_name
+    return tags
+
+
+def get_payload_size(body):
+    return len(json.dumps(body, default=str))
@@ -1,14 +1,80 @@
 """
 Mixins for trampoline.
 """
+from functools import partial
+import types
+
 from django.contrib.contenttypes.models import ContentType
 
 from trampoline import get_trampoline_config
+from trampoline.cache import add_debounced_ids
+from trampoline.metrics import get_model_tags
 from trampoline.tasks import es_delete_doc
+from trampoline.tasks import es_delete_docs
+from trampoline.tasks import es_index_docs
 from trampoline.tasks import es_index_object
+from trampoline.tasks import es_index_objects
+from trampoline.tasks import get_es_inline_docs
 
 trampoline_config = get_trampoline_config()
 
+# Auto mapping plans by (model, doc_type).
+_auto_doc_mapping_plans = {}
+
+
+def use_background_indexer(async):
+    return async and trampoline_config.backend == 'thread'
+
+
+def get_class_attribute(cls, name):
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass.__dict__[name]
+    return None
+
+
+def call_static_prepare(func, doc_type, obj):
+    return func(obj)
+
+
+def call_prepare(prep_name, doc_type, obj):
+    return getattr(doc_type, prep_name)(obj)
+
+
+def get_object_value(field, doc_type, obj):
+    return getattr(obj, field, None)
+
+
+def compile_auto_doc_mapping(obj, doc_type_cls):
+    """
+    Return a tuple of (field, getter) mapping the values of an object to a
+    doc_type. Each getter is called with the doc_type instance and the object.
+    """
+    doc_type = doc_type_cls()
+    plan = []
+    for field in doc_type._doc_type.mapping:
+        prep_name = 'prepare_{0}'.format(field)
+        prep_func = getattr(doc_type, prep_name, None)
+        if prep_func is not None and callable(prep_func):
+            attr = get_class_attribute(doc_type_cls, prep_name)
+            if isinstance(attr, staticmethod):
+                func = attr.__get__(None, doc_type_cls)
+                getter = partial(call_static_prepare, func)
+            elif isinstance(attr, types.FunctionType):
+                getter = attr
+            else:
+                getter = partial(call_prepare, prep_name)
+        elif hasattr(obj, field):
+            getter = partial(get_object_value, field)
+        else:
+            raise NotImplementedError(
+                u"Field {0} is not on {1} and {2} doesn't implement a "
+                "\"prepare_{3}\" method."
+                .format(field, obj.__class__, doc_type.__class__, field)
+            )
+        plan.append((field, getter))
+    return tuple(plan)
+
 
 class ESIndexableMixin(object):
     """
@@ -16,11 +82,30 @@ class ESIndexableMixin(object):
     """
     es_doc_type = None
     es_auto_doc_type_mapping = False
+    # Name of a datetime field updated on every save, used by the command
+    # es_create_documents to only process the objects modified recently.
+    es_modified_field = None
+    # Build documents in the process which saved the objects, once the
+    # transaction is commited, and send them with the task so that workers
+    # don't load the objects from the database.
+    es_inline_doc = False
+    # Number of seconds during which the asynchronous indexations of the same
+    # object are collapsed into one, sent at the end of the window. Takes
+    # precedence over es_inline_doc.
+    es_debounce = None
 
     @classmethod
     def get_indexable_queryset(cls):  # pragma: no cover
         return cls._default_manager.all()
 
+    @classmethod
+    def get_es_bulk_queryset(cls):
+        """
+        Queryset used to load objects in chunks when indexing in bulk.
+        Override it to declare select_related or prefetch_related.
+        """
+        return cls.get_indexable_queryset()
+
     @classmethod
     def get_es_doc_type(cls):  # pragma: no cover
         return cls.es_doc_type
@@ -38,21 +123,20 @@ class ESIndexableMixin(object):
         Automatically map values from the model to the doc_type.
         If a field is not present on the model, a method "prepare_{field}"
         must be implemented on the doc_type.
+
+        The way each field is resolved is compiled on the first call and
+        reused for every object of the model.
         """
-        doc_type = self.es_doc_type()
-        for field in doc_type._doc_type.mapping:
-            prep_func = getattr(doc_type, 'prepare_{0}'.format(field), None)
-            if prep_func is not None and callable(prep_func):
-                value = prep_func(self)
-            elif hasattr(self, field):
-                value = getattr(self, field, None)
-            else:
-                raise NotImplementedError(
-                    u"Field {0} is not on {1} and {2} doesn't implement a "
-                    "\"prepare_{3}\" method."
-                    .format(field, self.__class__, doc_type.__class__, field)
-                )
-            setattr(doc_type, field, value)
+        doc_type_cls = self.es_doc_type
+        key = (self.__class__, doc_type_cls)
+        plan = _auto_doc_mapping_plans.get(key)
+        if plan is None:
+            plan = compile_auto_doc_mapping(self, doc_type_cls)
+            _auto_doc_mapping_plans[key] = plan
+
+        doc_type = doc_type_cls()
+        for field, getter in plan:
+            setattr(doc_type, field, getter(doc_type, self))
         return doc_type
 
     def get_es_doc(self):
@@ -67,11 +151,35 @@ class ESIndexableMixin(object):
         if trampoline_config.is_disabled or not self.is_indexable():
             return
 
+        if async and self.es_debounce:
+            return self.es_index_many(
+                [self.pk],
+                countdown=countdown,
+                index_name=index_name,
+                queue=queue
+            )
+
+        if self.es_inline_doc:
+            return self.es_index_instances(
+                [self],
+                async=async,
+                countdown=countdown,
+                index_name=index_name,
+                queue=queue
+            )
+
         doc_type = self.get_es_doc_type()
         index_name = index_name or doc_type._doc_type.index
         queue = queue or trampoline_config.celery_queue
 
         content_type = ContentType.objects.get_for_model(self)
+        if use_background_indexer(async):
+            trampoline_config.background_indexer.add(
+                es_index_objects,
+                (index_name, content_type.pk),
+                [self.pk]
+            )
+            return
         if async:
             result = es_index_object.apply_async(
                 args=(index_name, content_type.pk, self.pk),
@@ -101,11 +209,163 @@ class ESIndexableMixin(object):
         queue = queue or trampoline_config.celery_queue
         using = doc_type._doc_type.using
 
-        if async:
-            es_delete_doc.delay(index_name, doc_type_name, self.pk, using)
+        if use_background_indexer(async):
+            trampoline_config.background_indexer.add(
+                es_delete_docs,
+                (index_name, doc_type_name),
+                [self.pk],
+                using=using
+            )
+        elif async:
             es_delete_doc.apply_async(
                 args=(index_name, doc_type_name, self.pk, using),
                 queue=queue
             )
         else:
             es_delete_doc.apply((index_name, doc_type_name, self.pk, using))
+
+    @classmethod
+    def es_index_many(
+            cls,
+            object_ids,
+            async=True,
+            countdown=0,
+            index_name=None,
+            queue=None):
+        """
+        Index several objects with a single task and bulk request.
+        """
+        if trampoline_config.is_disabled or not object_ids:
+            return
+
+        doc_type = cls.get_es_doc_type()
+        index_name = index_name or doc_type._doc_type.index
+        queue = queue or trampoline_config.celery_queue
+        object_ids = list(object_ids)
+
+        content_type = ContentType.objects.get_for_model(cls)
+        kwargs = {}
+        if async and cls.es_debounce and not use_background_indexer(async):
+            pending_ids = add_debounced_ids(
+                index_name,
+                content_type.pk,
+                object_ids,
+                cls.es_debounce
+            )
+            debounced = len(object_ids) - len(pending_ids)
+            if debounced:
+                trampoline_config.metrics.incr(
+                    'trampoline.debounced',
+                    debounced,
+                    get_model_tags(cls, index_name)
+                )
+            if not pending_ids:
+                return
+            object_ids = pending_ids
+            countdown = max(countdown, cls.es_debounce)
+            kwargs['debounced'] = True
+
+        args = (index_name, content_type.pk, object_ids)
+        if use_background_indexer(async):
+            trampoline_config.background_indexer.add(
+                es_index_objects,
+                args[:2],
+                object_ids
+            )
+            return
+        if async:
+            result = es_index_objects.apply_async(
+                args=args,
+                kwargs=kwargs,
+                countdown=countdown,
+                queue=queue
+            )
+        else:
+            if trampoline_config.should_fail_silently:
+                result = es_index_objects.apply(args=args)
+            else:
+                result = es_index_objects.run(*args)
+        return result
+
+    @classmethod
+    def es_index_instances(
+            cls,
+            objects,
+            async=True,
+            countdown=0,
+            index_name=None,
+            queue=None):
+        """
+        Build the documents of loaded objects now and index them with a
+        single task and bulk request, without querying the database.
+        """
+        if trampoline_config.is_disabled:
+            return
+
+        doc_type = cls.get_es_doc_type()
+        index_name = index_name or doc_type._doc_type.index
+        queue = queue or trampoline_config.celery_queue
+
+        objects = [obj for obj in objects if obj.is_indexable()]
+        docs = get_es_inline_docs(index_name, objects)
+        if not docs:
+            return
+
+        args = (
+            index_name,
+            doc_type._doc_type.name,
+            docs,
+            doc_type._doc_type.using,
+        )
+        if use_background_indexer(async):
+            trampoline_config.background_indexer.add(
+                es_index_docs,
+                args[:2],
+                docs,
+                using=args[3]
+            )
+            return
+        if async:
+            result = es_index_docs.apply_async(
+                args=args,
+                countdown=countdown,
+                queue=queue
+            )
+        else:
+            if trampoline_config.should_fail_silently:
+                result = es_index_docs.apply(args=args)
+            else:
+                result = es_index_docs.run(*args)
+        return result
+
+    @classmethod
+    def es_delete_many(
+            cls,
+            object_ids,
+            async=True,
+            index_name=None,
+            queue=None):
+        """
+        Delete several documents with a single task and bulk request.
+        """
+        if trampoline_config.is_disabled or not object_ids:
+            return
+
+        doc_type = cls.get_es_doc_type()
+        doc_type_name = doc_type._doc_type.name
+        index_name = index_name or doc_type._doc_type.index
+        queue = queue or trampoline_config.celery_queue
+        using = doc_type._doc_type.using
+
+        args = (index_name, doc_type_name, list(object_ids), using)
+        if use_background_indexer(async):
+            trampoline_config.background_indexer.add(
+                es_delete_docs,
+                args[:2],
+                args[2],
+                using=using
+            )
+        elif async:
+            es_delete_docs.apply_async(args=args, queue=queue)
+        else:
+            es_delete_docs.apply(args)
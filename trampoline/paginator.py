@@ -1,33 +1,448 @@
 """
 Paginator for trampoline.
 """
+from collections import OrderedDict
+import base64
+import json
+import threading
+
+import six
+
+from django.utils.functional import cached_property
+
+from elasticsearch import TransportError
+from elasticsearch_dsl.connections import connections
+
+from trampoline import get_trampoline_config
+from trampoline.cache import get_search_cache
+from trampoline.cache import get_search_cache_key
+
+trampoline_config = get_trampoline_config()
+
+
+def encode_cursor(sort_values, reverse=False):
+    """
+    Build an opaque cursor from the sort values of a hit.
+    """
+    data = json.dumps([list(sort_values), reverse], separators=(',', ':'))
+    cursor = base64.urlsafe_b64encode(data.encode('utf-8'))
+    return cursor.decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Return the (sort_values, reverse) tuple stored inside a cursor.
+    Raise ValueError if the cursor is invalid.
+    """
+    try:
+        cursor = cursor.encode('ascii')
+        cursor += b'=' * (-len(cursor) % 4)
+        sort_values, reverse = json.loads(
+            base64.urlsafe_b64decode(cursor).decode('utf-8')
+        )
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError(u"Invalid cursor.")
+    if not isinstance(sort_values, list):
+        raise ValueError(u"Invalid cursor.")
+    return sort_values, bool(reverse)
+
+
+def execute_raw(search):
+    """
+    Execute a search and return its raw response.
+    """
+    return connections.get_connection(search._using).search(
+        index=search._index,
+        doc_type=search._doc_type,
+        body=search.to_dict(),
+        **search._params
+    )
+
+
+def build_response(search, raw_response):
+    """
+    Wrap a raw search response like Search.execute does.
+    """
+    return search._response_class(
+        raw_response,
+        callbacks=search._doc_type_map
+    )
+
+
+def reverse_sort(sort):
+    """
+    Reverse the order of each field of a sort definition.
+    """
+    reversed_sort = []
+    for field in sort:
+        if isinstance(field, six.string_types):
+            field, options = field, {}
+        else:
+            field, options = list(field.items())[0]
+            if isinstance(options, six.string_types):
+                options = {'order': options}
+            options = dict(options)
+
+        default_order = 'desc' if field == '_score' else 'asc'
+        order = options.get('order', default_order)
+        options['order'] = 'asc' if order == 'desc' else 'desc'
+        missing = options.get('missing')
+        if missing in ('_first', '_last'):
+            options['missing'] = '_last' if missing == '_first' else '_first'
+        reversed_sort.append({field: options})
+    return reversed_sort
+
+
+class ESSearchBatch(object):
+    """
+    Collect pending searches and run them all with one msearch request per
+    connection as soon as the response of one of them is needed. A batch
+    may be shared by threads, such as those of the asyncio paginator.
+    """
+
+    def __init__(self, using='default'):
+        # Connection of the searches which don't define one.
+        self.using = using
+        self.pending = []
+        self.responses = {}
+        self.lock = threading.RLock()
+
+    def add(self, search, paginator=None):
+        """
+        Add a search to the next msearch request. When ``paginator`` is given
+        its cache is used for this search.
+        """
+        with self.lock:
+            self.pending.append((search, paginator))
+
+    def get_response(self, search):
+        with self.lock:
+            if id(search) not in self.responses:
+                if not any(pending is search for pending, _ in self.pending):
+                    self.add(search)
+                self.execute()
+            response = self.responses[id(search)][1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def execute(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            requests = OrderedDict()
+            for search, paginator in pending:
+                cache_key = None
+                if paginator is not None:
+                    cache_key = paginator.get_cache_key(search)
+                    raw_response = paginator.get_cached_response(cache_key)
+                    if raw_response is not None:
+                        self.responses[id(search)] = (
+                            search,
+                            build_response(search, raw_response),
+                        )
+                        continue
+                using = search._using or self.using
+                requests.setdefault(using, []).append(
+                    (search, paginator, cache_key)
+                )
+
+            for using, using_requests in requests.items():
+                try:
+                    self.execute_requests(using, using_requests)
+                except TransportError as exc:
+                    # Raised by get_response for each search of the
+                    # connection, the other connections are still queried.
+                    for search, paginator, cache_key in using_requests:
+                        self.responses[id(search)] = (search, exc)
+
+    def execute_requests(self, using, requests):
+        """
+        Run the searches of a connection, with msearch if there are several
+        of them.
+        """
+        if len(requests) == 1:
+            search, paginator, cache_key = requests[0]
+            raw_response = execute_raw(search)
+            if paginator is not None:
+                paginator.set_cached_response(cache_key, raw_response)
+            self.responses[id(search)] = (
+                search,
+                build_response(search, raw_response),
+            )
+            return
+
+        body = []
+        for search, paginator, cache_key in requests:
+            header = dict(search._params)
+            if search._index:
+                header['index'] = search._index
+            if search._doc_type:
+                header['type'] = search._doc_type
+            body.append(header)
+            body.append(search.to_dict())
+        raw_responses = connections.get_connection(using).msearch(
+            body=body
+        )['responses']
+
+        for (search, paginator, cache_key), raw_response in zip(
+                requests, raw_responses):
+            error = raw_response.get('error')
+            if error:
+                response = TransportError('N/A', error, raw_response)
+            else:
+                if paginator is not None:
+                    paginator.set_cached_response(cache_key, raw_response)
+                response = build_response(search, raw_response)
+            # Keep a reference to the search so that its id isn't reused.
+            self.responses[id(search)] = (search, response)
 
 
 class ESSearchPaginator(object):
+    # Unique field appended to the sort of cursor pages so that every hit has
+    # distinct sort values.
+    tiebreaker = '_uid'
+    # Sort numbered pages like cursor pages so that they provide a
+    # next_cursor. Sorting on the tiebreaker is costly on large indices.
+    cursor_handoff = False
 
-    def __init__(self, search, page_size):
+    def __init__(
+            self,
+            search,
+            page_size,
+            tiebreaker=None,
+            cache_timeout=None,
+            batch=None,
+            cursor_handoff=None):
         self.search = search
         self.page_size = page_size
+        if tiebreaker is not None:
+            self.tiebreaker = tiebreaker
+        if cursor_handoff is not None:
+            self.cursor_handoff = cursor_handoff
+        # None defaults to the search_cache_timeout option, 0 disables the
+        # cache for this paginator.
+        self.cache_timeout = cache_timeout
+        self.batch = batch
 
     def page(self, page_number):
         return Page(self, page_number)
 
+    def cursor_page(self, cursor=None):
+        return CursorPage(self, cursor)
+
+    def get_cache(self):
+        if self.cache_timeout == 0:
+            return None
+        return get_search_cache()
+
+    def get_cache_timeout(self):
+        if self.cache_timeout is None:
+            return trampoline_config.search_cache_timeout
+        return self.cache_timeout
+
+    def get_cache_key(self, search):
+        cache = self.get_cache()
+        if cache is None:
+            return None
+        return get_search_cache_key(cache, search)
+
+    def get_cached_response(self, cache_key):
+        if cache_key is None:
+            return None
+        return self.get_cache().get(cache_key)
+
+    def set_cached_response(self, cache_key, raw_response):
+        if cache_key is not None:
+            self.get_cache().set(
+                cache_key,
+                raw_response,
+                self.get_cache_timeout()
+            )
+
+    def prepare(self, search):
+        """
+        Register the search of a new page in the batch, if any.
+        """
+        if self.batch is not None:
+            self.batch.add(search, self)
+
+    def execute(self, search):
+        """
+        Execute a search, its raw response is cached when the option
+        search_cache is set.
+        """
+        if self.batch is not None:
+            return self.batch.get_response(search)
+
+        cache_key = self.get_cache_key(search)
+        if cache_key is None:
+            return search.execute()
+
+        raw_response = self.get_cached_response(cache_key)
+        if raw_response is None:
+            raw_response = execute_raw(search)
+            self.set_cached_response(cache_key, raw_response)
+        return build_response(search, raw_response)
+
+    def get_sort(self):
+        """
+        Sort of the search followed by the tiebreaker, searches without a
+        sort are ordered by relevance first.
+        """
+        sort = list(self.search._sort) or ['_score']
+        sort_fields = [
+            field if isinstance(field, six.string_types)
+            else list(field.keys())[0]
+            for field in sort
+        ]
+        if self.tiebreaker not in sort_fields:
+            sort.append(self.tiebreaker)
+        return sort
+
+    def get_page_search(self, page_number):
+        bottom_offset = self.page_size * (page_number - 1)
+        top_offset = bottom_offset + self.page_size
+        search = self.search
+        if self.cursor_handoff:
+            search = search.sort(*self.get_sort())
+        return search[bottom_offset:top_offset]
+
+    def get_cursor_search(self, search_after=None, reverse=False):
+        sort = self.get_sort()
+        if reverse:
+            sort = reverse_sort(sort)
+
+        # Fetch one more hit to know whether there are other pages.
+        search = self.search.sort(*sort)[0:self.page_size + 1]
+        if search_after is not None:
+            search = search.extra(search_after=search_after)
+        return search
+
 
 class Page(object):
+    """
+    Page of results, the search is executed when the results are first
+    accessed.
+    """
 
-    def __init__(self, paginator, page_number):
+    def __init__(self, paginator, page_number, response=None):
         self.paginator = paginator
         self.number = page_number
+        self.search = self.paginator.get_page_search(page_number)
+        self._response = response
+        if response is None:
+            self.paginator.prepare(self.search)
 
-        bottom_offset = self.paginator.page_size * (page_number - 1)
-        top_offset = bottom_offset + self.paginator.page_size
-        search = self.paginator.search[bottom_offset:top_offset]
-        response = search.execute()
-        self.hits = response.hits
-        self.response = response
+    @cached_property
+    def response(self):
+        if self._response is not None:
+            return self._response
+        return self.paginator.execute(self.search)
 
-        self.total_count = response.hits.total
-        if self.total_count > (self.paginator.page_size * page_number):
-            self.has_other_pages = True
-        else:
-            self.has_other_pages = False
+    @property
+    def hits(self):
+        return self.response.hits
+
+    @property
+    def total_count(self):
+        return self.response.hits.total
+
+    @property
+    def has_other_pages(self):
+        return self.total_count > (self.paginator.page_size * self.number)
+
+    @property
+    def next_cursor(self):
+        """
+        Cursor of the results following this page, to go on with cursor
+        pages. Only available when the paginator sorts numbered pages for
+        cursor_handoff.
+        """
+        if not self.paginator.cursor_handoff:
+            return None
+        if self.hits and self.has_other_pages:
+            return encode_cursor(self.hits[-1].meta.sort)
+        return None
+
+
+class CursorPage(object):
+    """
+    Page of results fetched with search_after, its cost doesn't depend on
+    how deep the page is. The search is executed when the results are first
+    accessed.
+    """
+
+    def __init__(self, paginator, cursor=None, response=None):
+        self.paginator = paginator
+        self.cursor = cursor
+
+        self.search_after, self.reverse = self.parse_cursor(cursor)
+        self.search = self.paginator.get_cursor_search(
+            self.search_after,
+            self.reverse
+        )
+        self._response = response
+        if response is None:
+            self.paginator.prepare(self.search)
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """
+        Return the (search_after, reverse) tuple of a cursor, invalid cursors
+        point to the first page.
+        """
+        if cursor:
+            try:
+                return decode_cursor(cursor)
+            except ValueError:
+                pass
+        return None, False
+
+    @cached_property
+    def response(self):
+        if self._response is not None:
+            return self._response
+        return self.paginator.execute(self.search)
+
+    @cached_property
+    def hits(self):
+        hits = list(self.response.hits)[:self.paginator.page_size]
+        if self.reverse:
+            hits.reverse()
+        return hits
+
+    @property
+    def total_count(self):
+        return self.response.hits.total
+
+    @property
+    def has_more(self):
+        return len(self.response.hits) > self.paginator.page_size
+
+    @property
+    def has_next(self):
+        if self.reverse:
+            return self.search_after is not None
+        return self.has_more
+
+    @property
+    def has_previous(self):
+        if self.reverse:
+            return self.has_more
+        return self.search_after is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    @property
+    def next_cursor(self):
+        if self.hits and self.has_next:
+            return encode_cursor(self.hits[-1].meta.sort)
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.hits and self.has_previous:
+            return encode_cursor(self.hits[0].meta.sort, reverse=True)
+        return None
@@ -1,13 +1,28 @@
 """
 Celery tasks for trampoline.
 """
+from concurrent.futures import ThreadPoolExecutor
+import calendar
+import datetime
 import logging
+import os
+import threading
+import time
 
 from django.contrib.contenttypes.models import ContentType
 
 from celery import shared_task
 
+from elasticsearch.helpers import BulkIndexError
+from elasticsearch.serializer import JSONSerializer
+from elasticsearch.helpers import streaming_bulk
+from elasticsearch_dsl.document import DOC_META_FIELDS
+
 from trampoline import get_trampoline_config
+from trampoline.cache import bump_index_generation
+from trampoline.cache import clear_debounced_ids
+from trampoline.metrics import get_model_tags
+from trampoline.metrics import get_payload_size
 
 
 logger = logging.getLogger(__name__)
@@ -18,6 +33,406 @@ STATUS_FAILED = 1
 STATUS_IGNORED = 2
 STATUS_DELETED = 3
 
+# Names of the status counters emitted to the metrics backend.
+STATUS_NAMES = {
+    STATUS_INDEXED: 'indexed',
+    STATUS_FAILED: 'failed',
+    STATUS_IGNORED: 'ignored',
+    STATUS_DELETED: 'deleted',
+}
+
+BULK_CHUNK_SIZE = 500
+
+# Maximum number of concurrent writes to the connections of write_to.
+WRITE_TO_MAX_THREADS = 8
+
+_write_executor = None
+_write_executor_pid = None
+_write_executor_lock = threading.Lock()
+
+
+class WriteToError(Exception):
+    """
+    Raised when writing to some of the connections of write_to failed.
+    ``errors`` maps each failed connection alias to its exception.
+    """
+
+    def __init__(self, message, errors):
+        super(WriteToError, self).__init__(message)
+        self.errors = errors
+
+
+def incr_status(status, tags):
+    trampoline_config.metrics.incr(
+        'trampoline.{0}'.format(STATUS_NAMES[status]),
+        tags=tags
+    )
+
+
+def incr_write_to_status(status, tags, alias):
+    """
+    Count a status per connection when writing to several of them.
+    """
+    tags = dict(tags, connection=alias)
+    trampoline_config.metrics.incr(
+        'trampoline.write_to.{0}'.format(STATUS_NAMES[status]),
+        tags=tags
+    )
+
+
+def get_aliases(using):
+    """
+    Return the list of connection aliases of ``using``, a single alias or a
+    list of them.
+    """
+    if isinstance(using, (list, tuple)):
+        return list(using)
+    return [using]
+
+
+def get_write_executor():
+    global _write_executor, _write_executor_pid
+    with _write_executor_lock:
+        # Threads don't survive a fork.
+        if _write_executor is None or _write_executor_pid != os.getpid():
+            _write_executor = ThreadPoolExecutor(
+                max_workers=WRITE_TO_MAX_THREADS
+            )
+            _write_executor_pid = os.getpid()
+        return _write_executor
+
+
+def write_to_all(aliases, func, *args):
+    """
+    Call ``func(alias, *args)`` for each connection alias, concurrently if
+    there are several of them.
+
+    Return a list of tuples (alias, result, exc).
+    """
+    if len(aliases) == 1:
+        try:
+            return [(aliases[0], func(aliases[0], *args), None)]
+        except Exception as exc:
+            return [(aliases[0], None, exc)]
+
+    executor = get_write_executor()
+    futures = [
+        (alias, executor.submit(func, alias, *args))
+        for alias in aliases
+    ]
+    results = []
+    for alias, future in futures:
+        try:
+            results.append((alias, future.result(), None))
+        except Exception as exc:
+            results.append((alias, None, exc))
+    return results
+
+
+def check_write_results(results, tags, status_ok):
+    """
+    Raise the exception of a single connection, or a WriteToError if any of
+    several connections failed after counting the status of each of them.
+    """
+    if len(results) == 1:
+        alias, result, exc = results[0]
+        if exc is not None:
+            raise exc
+        return
+    errors = {}
+    for alias, result, exc in results:
+        if exc is not None:
+            errors[alias] = exc
+        incr_write_to_status(
+            STATUS_FAILED if exc is not None else status_ok,
+            tags,
+            alias
+        )
+    if errors:
+        raise WriteToError(
+            u"Writing failed on {0} connection(s).".format(len(errors)),
+            errors
+        )
+
+
+def merge_bulk_results(results, tags, status_ok):
+    """
+    Merge the (item_id, ok, error) tuples returned by each connection into
+    one (item_id, status, error) tuple per item. When writing to several
+    connections an item fails if any of them failed, its error then maps
+    the failed aliases to their error.
+    """
+    if len(results) == 1:
+        alias, items, exc = results[0]
+        if exc is not None:
+            raise exc
+        for item_id, ok, error in items:
+            if ok:
+                yield item_id, status_ok, None
+            else:
+                yield item_id, STATUS_FAILED, error
+        return
+
+    failed = dict((alias, exc) for alias, _, exc in results if exc)
+    if len(failed) == len(results):
+        raise WriteToError(u"Writing failed on every connection.", failed)
+    item_ids = []
+    errors = {}
+    for alias, items, exc in results:
+        for item_id, ok, error in items or ():
+            if item_id not in errors:
+                item_ids.append(item_id)
+                errors[item_id] = dict(failed)
+            if not ok:
+                errors[item_id][alias] = error
+
+    for item_id in item_ids:
+        for alias, _, _ in results:
+            incr_write_to_status(
+                STATUS_FAILED if alias in errors[item_id] else status_ok,
+                tags,
+                alias
+            )
+        if errors[item_id]:
+            yield item_id, STATUS_FAILED, errors[item_id]
+        else:
+            yield item_id, status_ok, None
+
+
+def get_es_index_action(index_name, obj):
+    """
+    Build the bulk action indexing an object.
+    """
+    metrics = trampoline_config.metrics
+    tags = get_model_tags(obj.__class__, index_name)
+    with metrics.timer('trampoline.mapping', tags):
+        doc = obj.get_es_doc_mapping()
+        # Same validation as DocType.save.
+        doc.full_clean()
+        source = doc.to_dict()
+    if metrics.enabled:
+        metrics.histogram(
+            'trampoline.payload_size',
+            get_payload_size(source),
+            tags
+        )
+    return {
+        '_op_type': 'index',
+        '_index': index_name,
+        '_type': doc._doc_type.name,
+        '_id': obj.pk,
+        '_source': source,
+    }
+
+
+def es_index_instance(index_name, obj, using=None):
+    """
+    Index an object which is already loaded, through the connection of its
+    doc type unless ``using`` is given. ``using`` may be a list of aliases,
+    the document is then built once and written to all of them.
+    """
+    if not obj.is_indexable():
+        return STATUS_IGNORED
+    metrics = trampoline_config.metrics
+    tags = get_model_tags(obj.__class__, index_name)
+    with metrics.timer('trampoline.mapping', tags):
+        doc = obj.get_es_doc_mapping()
+        doc.meta.id = obj.pk
+        # Same validation and parameters as DocType.save.
+        doc.full_clean()
+        body = doc.to_dict()
+        doc_meta = dict(
+            (key, doc.meta[key])
+            for key in DOC_META_FIELDS
+            if key in doc.meta
+        )
+    if metrics.enabled:
+        metrics.histogram(
+            'trampoline.payload_size',
+            get_payload_size(body),
+            tags
+        )
+
+    def write(alias):
+        with metrics.timer('trampoline.write', tags):
+            trampoline_config.get_connection(
+                alias or doc._doc_type.using
+            ).index(
+                index=index_name,
+                doc_type=doc._doc_type.name,
+                body=body,
+                **doc_meta
+            )
+
+    results = write_to_all(get_aliases(using), write)
+    check_write_results(results, tags, STATUS_INDEXED)
+    return STATUS_INDEXED
+
+
+def es_bulk_write(
+        actions,
+        using,
+        tags,
+        status_ok,
+        chunk_size=BULK_CHUNK_SIZE,
+        metric_name='trampoline.write'):
+    """
+    Send bulk actions to every connection of ``using``, a single alias or a
+    list of them, concurrently. Items failing with a 404 are successful for
+    deletions, and with a version conflict for indexations: a newer version
+    of the document is already indexed.
+
+    Yield a tuple (doc_id, status, error) for each action.
+    """
+    def write(alias):
+        results = streaming_bulk(
+            trampoline_config.get_connection(alias),
+            actions,
+            chunk_size=chunk_size,
+            raise_on_error=False,
+            raise_on_exception=False,
+        )
+        items = []
+        start = time.time()
+        for ok, item in results:
+            op_type, info = item.popitem()
+            if op_type == 'delete' and info.get('status') == 404:
+                ok = True
+            elif op_type == 'index' and info.get('status') == 409:
+                ok = True
+            items.append((info.get('_id'), ok, info.get('error')))
+        trampoline_config.metrics.timing(
+            metric_name,
+            (time.time() - start) * 1000,
+            tags
+        )
+        return items
+
+    results = write_to_all(get_aliases(using), write)
+    return merge_bulk_results(results, tags, status_ok)
+
+
+def es_bulk_index_objects(
+        index_name,
+        objects,
+        using=None,
+        chunk_size=BULK_CHUNK_SIZE):
+    """
+    Index objects through the bulk API. ``using`` may be a list of aliases,
+    the actions are then built once and sent to all of them concurrently.
+
+    Yield a tuple (object_id, status, error) for each object.
+    """
+    actions = []
+    object_ids = {}
+    for obj in objects:
+        try:
+            if not obj.is_indexable():
+                yield obj.pk, STATUS_IGNORED, None
+                continue
+            action = get_es_index_action(index_name, obj)
+        except Exception as exc:
+            yield obj.pk, STATUS_FAILED, exc
+            continue
+        actions.append(action)
+        object_ids[str(obj.pk)] = obj.pk
+        model = obj.__class__
+
+    if not actions:
+        return
+
+    results = es_bulk_write(
+        actions,
+        using,
+        get_model_tags(model, index_name),
+        STATUS_INDEXED,
+        chunk_size=chunk_size
+    )
+    for doc_id, status, error in results:
+        yield object_ids.get(str(doc_id), doc_id), status, error
+
+
+def es_bulk_delete_docs(
+        index_name,
+        doc_type_name,
+        doc_ids,
+        using=None,
+        chunk_size=BULK_CHUNK_SIZE):
+    """
+    Delete documents through the bulk API, missing documents are considered
+    deleted. ``using`` may be a list of aliases.
+
+    Yield a tuple (doc_id, status, error) for each document.
+    """
+    actions = [
+        {
+            '_op_type': 'delete',
+            '_index': index_name,
+            '_type': doc_type_name,
+            '_id': doc_id,
+        }
+        for doc_id in doc_ids
+    ]
+    return es_bulk_write(
+        actions,
+        using,
+        {'index': index_name, 'doc_type': doc_type_name},
+        STATUS_DELETED,
+        chunk_size=chunk_size,
+        metric_name='trampoline.delete'
+    )
+
+
+def get_es_inline_version(obj):
+    """
+    External version of a document built from an object, in microseconds:
+    the value of its es_modified_field or the current time.
+    """
+    modified = None
+    if obj.es_modified_field:
+        modified = getattr(obj, obj.es_modified_field, None)
+    if isinstance(modified, datetime.datetime):
+        timestamp = calendar.timegm(modified.utctimetuple())
+        return timestamp * 1000000 + modified.microsecond
+    return int(time.time() * 1000000)
+
+
+def get_es_inline_docs(index_name, objects):
+    """
+    Build the documents of objects in the process which saved them, for the
+    task es_index_docs.
+
+    Return a list of (doc_id, body, version) tuples, bodies are serialized
+    to JSON. Objects which can't be mapped are skipped and logged, or raise
+    unless fail_silently.
+    """
+    serializer = JSONSerializer()
+    docs = []
+    for obj in objects:
+        try:
+            action = get_es_index_action(index_name, obj)
+        except:
+            incr_status(
+                STATUS_FAILED,
+                get_model_tags(obj.__class__, index_name)
+            )
+            if not trampoline_config.should_fail_silently:
+                raise
+            logger.exception(
+                "Exception occured while building document.",
+                extra={
+                    'index_name': index_name,
+                    'object_id': obj.pk,
+                }
+            )
+            continue
+        docs.append((
+            action['_id'],
+            serializer.dumps(action['_source']),
+            get_es_inline_version(obj),
+        ))
+    return docs
+
 
 @shared_task
 def es_index_object(
@@ -30,15 +445,21 @@ def es_index_object(
     """
     if fail_silently is None:
         fail_silently = trampoline_config.should_fail_silently
+    metrics = trampoline_config.metrics
+    tags = {'index': index_name}
     try:
         content_type = ContentType.objects.get_for_id(content_type_id)
-        obj = content_type.model_class()._default_manager.get(pk=object_id)
-        if not obj.is_indexable():
-            return STATUS_IGNORED
-        doc = obj.get_es_doc_mapping()
-        doc.meta.id = obj.pk
-        doc.save(index=index_name)
+        model = content_type.model_class()
+        tags = get_model_tags(model, index_name)
+        with metrics.timer('trampoline.fetch', tags):
+            obj = model._default_manager.get(pk=object_id)
+        status = es_index_instance(
+            index_name,
+            obj,
+            using=trampoline_config.get_write_to(index_name)
+        )
     except:
+        incr_status(STATUS_FAILED, tags)
         if fail_silently:
             logger.exception(
                 "Exception occured while indexing object.",
@@ -51,7 +472,177 @@ def es_index_object(
             return STATUS_FAILED
         else:
             raise
-    return STATUS_INDEXED
+    incr_status(status, tags)
+    if status == STATUS_INDEXED:
+        bump_index_generation(index_name)
+    return status
+
+
+@shared_task
+def es_index_objects(
+        index_name,
+        content_type_id,
+        object_ids,
+        fail_silently=None,
+        debounced=False):
+    """
+    Index several objects of the same model through the bulk API.
+
+    Objects which don't exist anymore are ignored. ``debounced`` is set when
+    the objects were marked as pending by ESIndexableMixin.es_index_many.
+    """
+    if fail_silently is None:
+        fail_silently = trampoline_config.should_fail_silently
+    metrics = trampoline_config.metrics
+    tags = {'index': index_name}
+    results = []
+    errors = []
+    try:
+        if debounced:
+            clear_debounced_ids(index_name, content_type_id, object_ids)
+        content_type = ContentType.objects.get_for_id(content_type_id)
+        model = content_type.model_class()
+        tags = get_model_tags(model, index_name)
+        with metrics.timer('trampoline.fetch', tags):
+            objects = model._default_manager.in_bulk(object_ids)
+        for object_id in object_ids:
+            if object_id not in objects:
+                results.append((object_id, STATUS_IGNORED))
+        using = (
+            trampoline_config.get_write_to(index_name) or
+            model.get_es_doc_type()._doc_type.using
+        )
+        bulk_results = es_bulk_index_objects(
+            index_name,
+            objects.values(),
+            using=using
+        )
+        for object_id, status, error in bulk_results:
+            results.append((object_id, status))
+            if status == STATUS_FAILED:
+                errors.append((object_id, error))
+    except:
+        if fail_silently:
+            logger.exception(
+                "Exception occured while indexing objects.",
+                extra={
+                    'index_name': index_name,
+                    'content_type_id': content_type_id,
+                    'object_ids': object_ids,
+                }
+            )
+            metrics.incr('trampoline.failed', len(object_ids), tags)
+            return [(object_id, STATUS_FAILED) for object_id in object_ids]
+        else:
+            metrics.incr('trampoline.failed', len(object_ids), tags)
+            raise
+
+    for object_id, status in results:
+        incr_status(status, tags)
+    if len(errors) < len(results):
+        bump_index_generation(index_name)
+
+    if errors:
+        if not fail_silently:
+            raise BulkIndexError(
+                u"{0} object(s) failed to index.".format(len(errors)),
+                errors
+            )
+        for object_id, error in errors:
+            logger.error(
+                "Exception occured while indexing object.",
+                extra={
+                    'index_name': index_name,
+                    'content_type_id': content_type_id,
+                    'object_id': object_id,
+                    'error': error,
+                }
+            )
+    return results
+
+
+@shared_task
+def es_index_docs(
+        index_name,
+        doc_type_name,
+        docs,
+        using=None,
+        fail_silently=None):
+    """
+    Index documents built by the process which saved the objects, ``docs``
+    is a list of (doc_id, body, version) tuples. The database isn't queried.
+
+    Versions are external so that a body older than the indexed one is
+    skipped when tasks run out of order.
+    """
+    if fail_silently is None:
+        fail_silently = trampoline_config.should_fail_silently
+    metrics = trampoline_config.metrics
+    tags = {'index': index_name, 'doc_type': doc_type_name}
+    results = []
+    errors = []
+    try:
+        actions = [
+            {
+                '_op_type': 'index',
+                '_index': index_name,
+                '_type': doc_type_name,
+                '_id': doc_id,
+                '_source': body,
+                '_version': version,
+                '_version_type': 'external_gte',
+            }
+            for doc_id, body, version in docs
+        ]
+        bulk_results = es_bulk_write(
+            actions,
+            trampoline_config.get_write_to(index_name) or using,
+            tags,
+            STATUS_INDEXED
+        )
+        for doc_id, status, error in bulk_results:
+            results.append((doc_id, status))
+            if status == STATUS_FAILED:
+                errors.append((doc_id, error))
+    except:
+        metrics.incr('trampoline.failed', len(docs), tags)
+        if fail_silently:
+            logger.exception(
+                "Exception occured while indexing documents.",
+                extra={
+                    'index_name': index_name,
+                    'doc_type_name': doc_type_name,
+                    'doc_ids': [doc_id for doc_id, body, version in docs],
+                }
+            )
+            return [
+                (doc_id, STATUS_FAILED) for doc_id, body, version in docs
+            ]
+        else:
+            raise
+
+    for doc_id, status in results:
+        incr_status(status, tags)
+    if len(errors) < len(results):
+        bump_index_generation(index_name)
+
+    if errors:
+        if not fail_silently:
+            raise BulkIndexError(
+                u"{0} document(s) failed to index.".format(len(errors)),
+                errors
+            )
+        for doc_id, error in errors:
+            logger.error(
+                "Exception occured while indexing document.",
+                extra={
+                    'index_name': index_name,
+                    'doc_type_name': doc_type_name,
+                    'doc_id': doc_id,
+                    'error': error,
+                }
+            )
+    return results
 
 
 @shared_task
@@ -66,14 +657,26 @@ def es_delete_doc(
     """
     if fail_silently is None:
         fail_silently = trampoline_config.should_fail_silently
+    metrics = trampoline_config.metrics
+    tags = {'index': index_name, 'doc_type': doc_type_name}
+
+    def delete(alias):
+        with metrics.timer('trampoline.delete', tags):
+            trampoline_config.get_connection(alias).delete(
+                index=index_name,
+                doc_type=doc_type_name,
+                id=doc_id,
+                ignore=404,
+            )
+
     try:
-        trampoline_config.get_connection(using).delete(
-            index=index_name,
-            doc_type=doc_type_name,
-            id=doc_id,
-            ignore=404,
+        aliases = get_aliases(
+            trampoline_config.get_write_to(index_name) or using
         )
+        results = write_to_all(aliases, delete)
+        check_write_results(results, tags, STATUS_DELETED)
     except:
+        incr_status(STATUS_FAILED, tags)
         if trampoline_config.should_fail_silently:
             logger.exception(
                 "Exception occured while deleting document.",
@@ -86,4 +689,73 @@ def es_delete_doc(
             return STATUS_FAILED
         else:
             raise
+    incr_status(STATUS_DELETED, tags)
+    bump_index_generation(index_name)
     return STATUS_DELETED
+
+
+@shared_task
+def es_delete_docs(
+        index_name,
+        doc_type_name,
+        doc_ids,
+        using=None,
+        fail_silently=None):
+    """
+    Delete several documents from the index through the bulk API.
+    """
+    if fail_silently is None:
+        fail_silently = trampoline_config.should_fail_silently
+    metrics = trampoline_config.metrics
+    tags = {'index': index_name, 'doc_type': doc_type_name}
+    results = []
+    errors = []
+    try:
+        bulk_results = es_bulk_delete_docs(
+            index_name,
+            doc_type_name,
+            doc_ids,
+            using=trampoline_config.get_write_to(index_name) or using
+        )
+        for doc_id, status, error in bulk_results:
+            results.append((doc_id, status))
+            if status == STATUS_FAILED:
+                errors.append((doc_id, error))
+    except:
+        if fail_silently:
+            logger.exception(
+                "Exception occured while deleting documents.",
+                extra={
+                    'index_name': index_name,
+                    'doc_type_name': doc_type_name,
+                    'doc_ids': doc_ids,
+                }
+            )
+            metrics.incr('trampoline.failed', len(doc_ids), tags)
+            return [(doc_id, STATUS_FAILED) for doc_id in doc_ids]
+        else:
+            metrics.incr('trampoline.failed', len(doc_ids), tags)
+            raise
+
+    for doc_id, status in results:
+        incr_status(status, tags)
+    if len(errors) < len(results):
+        bump_index_generation(index_name)
+
+    if errors:
+        if not fail_silently:
+            raise BulkIndexError(
+                u"{0} document(s) failed to delete.".format(len(errors)),
+                errors
+            )
+        for doc_id, error in errors:
+            logger.error(
+                "Exception occured while deleting document.",
+                extra={
+                    'index_name': index_name,
+                    'doc_type_name': doc_type_name,
+                    'doc_id': doc_id,
+                    'error': error,
+                }
+            )
+    return results
@@ -0,0 +1,955 @@
+"""
+In-memory ElasticSearch stand-in for trampoline.
+
+Register the connection class inside the setting CONNECTIONS to run tests or
+benchmarks without a cluster:
+
+    'CONNECTIONS': {
+        'default': {
+            'hosts': 'localhost',
+            'connection_class': 'trampoline.testing.InMemoryConnection',
+        },
+    },
+
+Only the calls made by trampoline and elasticsearch_dsl are implemented and
+queries are limited to exact matches. Documents are shared by every
+connection to the same host inside a process.
+"""
+from collections import OrderedDict
+from functools import cmp_to_key
+import copy
+import hashlib
+import itertools
+import json
+import threading
+
+import six
+from six.moves.urllib.parse import unquote
+
+from elasticsearch.connection import Connection
+
+DEFAULT_SETTINGS = {
+    'number_of_shards': '5',
+    'number_of_replicas': '1',
+}
+DEFAULT_SIZE = 10
+
+# Stores by host.
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class StoreError(Exception):
+
+    def __init__(self, status, error_type, reason):
+        super(StoreError, self).__init__(reason)
+        self.status = status
+        self.error_type = error_type
+        self.reason = reason
+
+    def to_dict(self):
+        return {
+            'error': {
+                'root_cause': [{
+                    'type': self.error_type,
+                    'reason': self.reason,
+                }],
+                'type': self.error_type,
+                'reason': self.reason,
+            },
+            'status': self.status,
+        }
+
+
+def index_not_found(index_name):
+    return StoreError(
+        404,
+        'index_not_found_exception',
+        u"no such index [{0}]".format(index_name)
+    )
+
+
+def get_field_value(hit, field):
+    if field == '_uid':
+        return u"{0}#{1}".format(hit['_type'], hit['_id'])
+    if field in ('_id', '_type', '_index', '_score'):
+        return hit[field]
+    value = hit['_source']
+    for part in field.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def match_value(value, expected):
+    if isinstance(value, list):
+        return any(match_value(item, expected) for item in value)
+    if isinstance(value, six.string_types) or \
+            isinstance(expected, six.string_types):
+        return six.text_type(value) == six.text_type(expected)
+    return value == expected
+
+
+def match_query(query, hit):
+    """
+    Tell whether a hit matches a query, only exact matches are supported.
+    """
+    if not query:
+        return True
+    query_type, params = list(query.items())[0]
+    if query_type == 'match_all':
+        return True
+    if query_type == 'ids':
+        return hit['_id'] in [six.text_type(i) for i in params['values']]
+    if query_type in ('term', 'match'):
+        field, expected = list(params.items())[0]
+        if isinstance(expected, dict):
+            expected = expected.get('value', expected.get('query'))
+        return match_value(get_field_value(hit, field), expected)
+    if query_type == 'terms':
+        field, values = list(params.items())[0]
+        value = get_field_value(hit, field)
+        return any(match_value(value, expected) for expected in values)
+    if query_type == 'exists':
+        return get_field_value(hit, params['field']) is not None
+    if query_type == 'bool':
+        clauses = {}
+        for occur in ('must', 'filter', 'should', 'must_not'):
+            clauses[occur] = params.get(occur, [])
+            if isinstance(clauses[occur], dict):
+                clauses[occur] = [clauses[occur]]
+        if not all(match_query(q, hit) for q in clauses['must']):
+            return False
+        if not all(match_query(q, hit) for q in clauses['filter']):
+            return False
+        if any(match_query(q, hit) for q in clauses['must_not']):
+            return False
+        if clauses['should'] and not clauses['must'] and \
+                not clauses['filter']:
+            return any(match_query(q, hit) for q in clauses['should'])
+        return True
+    if query_type in ('filtered', 'constant_score'):
+        return (
+            match_query(params.get('query'), hit) and
+            match_query(params.get('filter'), hit)
+        )
+    raise StoreError(
+        400,
+        'query_parsing_exception',
+        u"Unsupported query [{0}]".format(query_type)
+    )
+
+
+def parse_sort(sort):
+    """
+    Return a list of (field, order, missing) tuples.
+    """
+    if isinstance(sort, (six.string_types, dict)):
+        sort = [sort]
+    specs = []
+    for field in sort:
+        if isinstance(field, six.string_types):
+            options = {}
+        else:
+            field, options = list(field.items())[0]
+            if isinstance(options, six.string_types):
+                options = {'order': options}
+        default_order = 'desc' if field == '_score' else 'asc'
+        specs.append((
+            field,
+            options.get('order', default_order),
+            options.get('missing', '_last'),
+        ))
+    return specs
+
+
+def compare_sort_values(specs, values, other_values):
+    for (field, order, missing), value, other in zip(
+            specs, values, other_values):
+        if value == other:
+            continue
+        if value is None or other is None:
+            first = (value is None) == (missing == '_first')
+            return -1 if first else 1
+        result = -1 if value < other else 1
+        return result if order == 'asc' else -result
+    return 0
+
+
+class InMemoryStore(object):
+    """
+    Indices, aliases and documents of a stand-in node.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.indices = OrderedDict()
+            self.aliases = {}
+            self.scrolls = {}
+            self.tasks = {}
+            self.counter = itertools.count(1)
+
+    ##################################################
+    #                    Requests                    #
+    ##################################################
+
+    def handle(self, method, path, params=None, body=None):
+        """
+        Handle a request and return a tuple (status, data).
+        """
+        params = params or {}
+        if isinstance(body, six.binary_type):
+            body = body.decode('utf-8')
+        parts = [unquote(part) for part in path.split('/') if part]
+        with self.lock:
+            try:
+                return self.route(method, parts, params, body)
+            except StoreError as exc:
+                return exc.status, exc.to_dict()
+
+    def route(self, method, parts, params, body):
+        if not parts:
+            return 200, {
+                'name': 'trampoline',
+                'version': {'number': '2.4.0'},
+            }
+
+        endpoint = parts[-1]
+        if endpoint == '_bulk':
+            return self.bulk(body, parts[:-1])
+        if endpoint == '_msearch':
+            return self.msearch(body, parts[:-1])
+        if parts[:2] == ['_search', 'scroll']:
+            return self.scroll(method, parts[2:], params, body)
+        if endpoint == '_search':
+            return self.search(parts[:-1], params, self.loads(body))
+        if endpoint == '_count':
+            return self.count(parts[:-1], self.loads(body))
+        if endpoint in ('_refresh', '_flush', '_forcemerge', '_optimize'):
+            return 200, {'_shards': {'total': 1, 'successful': 1}}
+        if endpoint == '_reindex':
+            return self.reindex(params, self.loads(body))
+        if parts[0] == '_tasks':
+            return self.get_task(parts[1])
+        if endpoint == '_aliases':
+            return self.update_aliases(self.loads(body))
+        if '_alias' in parts or '_aliases' in parts:
+            return self.handle_alias(method, parts)
+        if endpoint == '_settings':
+            return self.handle_settings(method, parts[0], self.loads(body))
+        if '_mapping' in parts:
+            return self.handle_mapping(method, parts, self.loads(body))
+        if len(parts) == 1:
+            return self.handle_index(method, parts[0], self.loads(body))
+        if len(parts) == 2:
+            if method == 'POST':
+                doc_id = six.text_type(next(self.counter))
+                return self.index_doc(
+                    parts[0],
+                    parts[1],
+                    doc_id,
+                    self.loads(body),
+                    params
+                )
+            return self.head_type(parts[0], parts[1])
+        if len(parts) == 3:
+            return self.handle_doc(method, parts, params, body)
+        raise StoreError(
+            400,
+            'illegal_argument_exception',
+            u"Unsupported path [{0}]".format('/'.join(parts))
+        )
+
+    @staticmethod
+    def loads(body):
+        if not body:
+            return {}
+        if isinstance(body, dict):
+            return body
+        return json.loads(body)
+
+    @staticmethod
+    def iter_lines(body):
+        if isinstance(body, six.binary_type):
+            body = body.decode('utf-8')
+        for line in body.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+    ##################################################
+    #                     Indices                    #
+    ##################################################
+
+    def resolve(self, names, allow_missing=False):
+        """
+        Return the indices behind a comma separated list of indices,
+        aliases or _all.
+        """
+        if isinstance(names, (list, tuple)):
+            names = ','.join(names)
+        if not names or names in ('_all', '*'):
+            return list(self.indices)
+        resolved = []
+        for name in names.split(','):
+            if name in self.indices:
+                indices = [name]
+            elif name in self.aliases:
+                indices = sorted(self.aliases[name])
+            elif allow_missing:
+                indices = []
+            else:
+                raise index_not_found(name)
+            for index_name in indices:
+                if index_name not in resolved:
+                    resolved.append(index_name)
+        return resolved
+
+    def resolve_write(self, name):
+        indices = self.resolve(name, allow_missing=True)
+        if len(indices) > 1:
+            raise StoreError(
+                400,
+                'illegal_argument_exception',
+                u"Alias [{0}] has more than one indices associated with it"
+                .format(name)
+            )
+        if indices:
+            return self.indices[indices[0]]
+        return self.create_index(name)
+
+    def create_index(self, index_name, body=None):
+        if index_name in self.indices or index_name in self.aliases:
+            raise StoreError(
+                400,
+                'index_already_exists_exception',
+                u"already exists [{0}]".format(index_name)
+            )
+        body = body or {}
+        settings = dict(DEFAULT_SETTINGS)
+        settings.update(self.normalize_settings(body.get('settings', {})))
+        index = {
+            'settings': settings,
+            'mappings': copy.deepcopy(body.get('mappings', {})),
+            'docs': OrderedDict(),
+        }
+        self.indices[index_name] = index
+        for alias in body.get('aliases', {}):
+            self.aliases.setdefault(alias, set()).add(index_name)
+        return index
+
+    @staticmethod
+    def normalize_settings(settings):
+        settings = settings.get('index', settings)
+        return dict(
+            (key, six.text_type(value).lower()
+             if isinstance(value, bool) else six.text_type(value))
+            for key, value in settings.items()
+        )
+
+    def handle_index(self, method, index_name, body):
+        if method == 'PUT':
+            self.create_index(index_name, body)
+            return 200, {'acknowledged': True}
+        indices = self.resolve(index_name)
+        if method == 'HEAD':
+            return 200, {}
+        if method == 'GET':
+            return 200, dict(
+                (name, {
+                    'settings': {'index': self.indices[name]['settings']},
+                    'mappings': self.indices[name]['mappings'],
+                    'aliases': self.get_index_aliases(name),
+                })
+                for name in indices
+            )
+        if method == 'DELETE':
+            for name in indices:
+                del self.indices[name]
+                for alias in list(self.aliases):
+                    self.aliases[alias].discard(name)
+                    if not self.aliases[alias]:
+                        del self.aliases[alias]
+            return 200, {'acknowledged': True}
+        raise StoreError(405, 'method_not_allowed', method)
+
+    def handle_settings(self, method, index_name, body):
+        indices = self.resolve(index_name)
+        if method == 'PUT':
+            for name in indices:
+                self.indices[name]['settings'].update(
+                    self.normalize_settings(body)
+                )
+            return 200, {'acknowledged': True}
+        return 200, dict(
+            (name, {'settings': {'index': self.indices[name]['settings']}})
+            for name in indices
+        )
+
+    def handle_mapping(self, method, parts, body):
+        position = parts.index('_mapping')
+        indices = self.resolve(parts[0] if position else None)
+        doc_type = parts[position + 1] if len(parts) > position + 1 else None
+        if method in ('PUT', 'POST'):
+            for name in indices:
+                mappings = self.indices[name]['mappings']
+                mapping = mappings.setdefault(doc_type, {})
+                mapping.update(copy.deepcopy(body.get(doc_type, body)))
+            return 200, {'acknowledged': True}
+        return 200, dict(
+            (name, {'mappings': self.indices[name]['mappings']})
+            for name in indices
+        )
+
+    def head_type(self, index_name, doc_type):
+        for name in self.resolve(index_name):
+            if doc_type in self.indices[name]['mappings']:
+                return 200, {}
+        return 404, {}
+
+    ##################################################
+    #                     Aliases                    #
+    ##################################################
+
+    def get_index_aliases(self, index_name):
+        return dict(
+            (alias, {})
+            for alias, indices in self.aliases.items()
+            if index_name in indices
+        )
+
+    def handle_alias(self, method, parts):
+        if parts[0] in ('_alias', '_aliases'):
+            index_names, names = None, parts[1:2]
+        else:
+            index_names, names = parts[0], parts[2:3]
+        names = names[0].split(',') if names else None
+
+        if method in ('PUT', 'POST'):
+            for index_name in self.resolve(index_names):
+                for name in names:
+                    self.add_alias(index_name, name)
+            return 200, {'acknowledged': True}
+        if method == 'DELETE':
+            for index_name in self.resolve(index_names):
+                for name in names:
+                    self.remove_alias(index_name, name)
+            return 200, {'acknowledged': True}
+
+        indices = self.resolve(index_names, allow_missing=True)
+        result = {}
+        for index_name in indices:
+            aliases = self.get_index_aliases(index_name)
+            if names is not None:
+                aliases = dict(
+                    (alias, value) for alias, value in aliases.items()
+                    if alias in names
+                )
+                if not aliases:
+                    continue
+            result[index_name] = {'aliases': aliases}
+        if names is not None and not result:
+            return 404, {
+                'error': u"alias [{0}] missing".format(','.join(names)),
+                'status': 404,
+            }
+        return 200, result
+
+    def add_alias(self, index_name, name):
+        if index_name not in self.indices:
+            raise index_not_found(index_name)
+        if name in self.indices:
+            raise StoreError(
+                400,
+                'invalid_alias_name_exception',
+                u"an index exists with the same name as the alias"
+            )
+        self.aliases.setdefault(name, set()).add(index_name)
+
+    def remove_alias(self, index_name, name):
+        if index_name not in self.aliases.get(name, ()):
+            raise StoreError(
+                404,
+                'aliases_not_found_exception',
+                u"aliases [{0}] missing".format(name)
+            )
+        self.aliases[name].discard(index_name)
+        if not self.aliases[name]:
+            del self.aliases[name]
+
+    def update_aliases(self, body):
+        # Check every action before applying them, like an atomic update.
+        aliases = copy.deepcopy(self.aliases)
+        try:
+            for action in body.get('actions', []):
+                action_type, params = list(action.items())[0]
+                index_names = params.get('index', params.get('indices'))
+                names = params.get('alias', params.get('aliases'))
+                if isinstance(names, six.string_types):
+                    names = [names]
+                for index_name in self.resolve(index_names):
+                    for name in names:
+                        if action_type == 'add':
+                            self.add_alias(index_name, name)
+                        else:
+                            self.remove_alias(index_name, name)
+        except StoreError:
+            self.aliases = aliases
+            raise
+        return 200, {'acknowledged': True}
+
+    ##################################################
+    #                    Documents                   #
+    ##################################################
+
+    def index_doc(self, index_name, doc_type, doc_id, source, params=None):
+        params = params or {}
+        index = self.resolve_write(index_name)
+        docs = index['docs']
+        key = (doc_type, six.text_type(doc_id))
+        created = key not in docs
+        if not created and params.get('op_type') == 'create':
+            raise StoreError(
+                409,
+                'document_already_exists_exception',
+                u"[{0}][{1}]: document already exists".format(*key)
+            )
+        version = 1 if created else docs[key]['_version'] + 1
+        if params.get('version_type') in ('external', 'external_gte'):
+            external = int(params['version'])
+            current = 0 if created else docs[key]['_version']
+            if (external < current or external == current and
+                    params['version_type'] == 'external'):
+                raise StoreError(
+                    409,
+                    'version_conflict_engine_exception',
+                    u"[{0}][{1}]: version conflict, current [{2}], "
+                    u"provided [{3}]".format(key[0], key[1], current, external)
+                )
+            version = external
+        docs[key] = {'_source': source, '_version': version}
+        index['mappings'].setdefault(doc_type, {})
+        return (201 if created else 200), {
+            '_index': self.get_index_name(index),
+            '_type': doc_type,
+            '_id': key[1],
+            '_version': version,
+            'created': created,
+        }
+
+    def get_index_name(self, index):
+        for name, other in self.indices.items():
+            if other is index:
+                return name
+
+    def delete_doc(self, index_name, doc_type, doc_id):
+        found = False
+        for name in self.resolve(index_name):
+            docs = self.indices[name]['docs']
+            if docs.pop((doc_type, six.text_type(doc_id)), None) is not None:
+                found = True
+        return (200 if found else 404), {
+            '_index': index_name,
+            '_type': doc_type,
+            '_id': six.text_type(doc_id),
+            'found': found,
+        }
+
+    def get_doc(self, index_name, doc_type, doc_id):
+        for name in self.resolve(index_name):
+            for (hit_type, hit_id), doc in self.indices[name]['docs'].items():
+                if hit_id == doc_id and doc_type in ('_all', hit_type):
+                    return 200, {
+                        '_index': name,
+                        '_type': hit_type,
+                        '_id': hit_id,
+                        '_version': doc['_version'],
+                        'found': True,
+                        '_source': copy.deepcopy(doc['_source']),
+                    }
+        return 404, {
+            '_index': index_name,
+            '_type': doc_type,
+            '_id': doc_id,
+            'found': False,
+        }
+
+    def handle_doc(self, method, parts, params, body):
+        index_name, doc_type, doc_id = parts
+        if method in ('PUT', 'POST'):
+            return self.index_doc(
+                index_name,
+                doc_type,
+                doc_id,
+                self.loads(body),
+                params
+            )
+        if method in ('GET', 'HEAD'):
+            return self.get_doc(index_name, doc_type, doc_id)
+        if method == 'DELETE':
+            return self.delete_doc(index_name, doc_type, doc_id)
+        raise StoreError(405, 'method_not_allowed', method)
+
+    def bulk(self, body, default_parts):
+        default_index = default_parts[0] if default_parts else None
+        default_type = default_parts[1] if len(default_parts) > 1 else None
+        lines = self.iter_lines(body)
+        items = []
+        errors = False
+        for action in lines:
+            op_type, meta = list(action.items())[0]
+            index_name = meta.get('_index', default_index)
+            doc_type = meta.get('_type', default_type)
+            doc_id = meta.get('_id')
+            source = None
+            if op_type in ('index', 'create', 'update'):
+                source = next(lines)
+            if doc_id is None:
+                doc_id = next(self.counter)
+            try:
+                if op_type == 'delete':
+                    status, data = self.delete_doc(
+                        index_name,
+                        doc_type,
+                        doc_id
+                    )
+                elif op_type == 'update':
+                    status, data = self.update_doc(
+                        index_name,
+                        doc_type,
+                        doc_id,
+                        source
+                    )
+                else:
+                    status, data = self.index_doc(
+                        index_name,
+                        doc_type,
+                        doc_id,
+                        source,
+                        {
+                            'op_type': op_type,
+                            'version': meta.get('_version'),
+                            'version_type': meta.get('_version_type'),
+                        }
+                    )
+            except StoreError as exc:
+                status, data = exc.status, exc.to_dict()
+            item = {
+                '_index': index_name,
+                '_type': doc_type,
+                '_id': six.text_type(doc_id),
+                'status': status,
+            }
+            if status >= 300 and not (op_type == 'delete' and status == 404):
+                errors = True
+                item['error'] = data.get('error', data)
+            else:
+                item['_version'] = data.get('_version', 1)
+            items.append({op_type: item})
+        return 200, {'took': 1, 'errors': errors, 'items': items}
+
+    def update_doc(self, index_name, doc_type, doc_id, body):
+        status, current = self.get_doc(index_name, doc_type, doc_id)
+        if status == 404:
+            if 'upsert' not in body and not body.get('doc_as_upsert'):
+                raise StoreError(
+                    404,
+                    'document_missing_exception',
+                    u"[{0}][{1}]: document missing".format(doc_type, doc_id)
+                )
+            source = body.get('upsert', body.get('doc', {}))
+        else:
+            source = current['_source']
+            source.update(body.get('doc', {}))
+        return self.index_doc(index_name, doc_type, doc_id, source)
+
+    ##################################################
+    #                     Search                     #
+    ##################################################
+
+    def iter_docs(self, parts):
+        index_names = parts[0] if parts else None
+        doc_types = parts[1].split(',') if len(parts) > 1 else None
+        for name in self.resolve(index_names):
+            for (doc_type, doc_id), doc in self.indices[name]['docs'].items():
+                if doc_types is None or doc_type in doc_types:
+                    yield {
+                        '_index': name,
+                        '_type': doc_type,
+                        '_id': doc_id,
+                        '_score': 1.0,
+                        '_source': doc['_source'],
+                    }
+
+    def find(self, parts, body):
+        """
+        Return the sorted hits matching a search body.
+        """
+        query = body.get('query')
+        post_filter = body.get('post_filter', body.get('filter'))
+        hits = [
+            hit for hit in self.iter_docs(parts)
+            if match_query(query, hit) and match_query(post_filter, hit)
+        ]
+
+        slice_ = body.get('slice')
+        if slice_ is not None:
+            hits = [
+                hit for hit in hits
+                if int(hashlib.md5(hit['_id'].encode('utf-8')).hexdigest(),
+                       16) % slice_['max'] == slice_['id']
+            ]
+
+        sort = body.get('sort')
+        if sort:
+            specs = parse_sort(sort)
+            for hit in hits:
+                hit['sort'] = [
+                    get_field_value(hit, field) for field, _, _ in specs
+                ]
+            hits.sort(key=cmp_to_key(
+                lambda a, b: compare_sort_values(specs, a['sort'], b['sort'])
+            ))
+            search_after = body.get('search_after')
+            if search_after is not None:
+                hits = [
+                    hit for hit in hits
+                    if compare_sort_values(
+                        specs,
+                        hit['sort'],
+                        search_after
+                    ) > 0
+                ]
+        return hits
+
+    def format_hit(self, hit, body):
+        hit = dict(hit)
+        if body.get('fields') == [] or body.get('_source') is False:
+            del hit['_source']
+        else:
+            hit['_source'] = copy.deepcopy(hit['_source'])
+        return hit
+
+    def format_response(self, hits, total, body):
+        return {
+            'took': 1,
+            'timed_out': False,
+            '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+            'hits': {
+                'total': total,
+                'max_score': 1.0 if hits else None,
+                'hits': [self.format_hit(hit, body) for hit in hits],
+            },
+        }
+
+    def search(self, parts, params, body):
+        start = int(params.get('from', body.get('from', 0)))
+        size = int(params.get('size', body.get('size', DEFAULT_SIZE)))
+        hits = self.find(parts, body)
+        total = len(hits)
+        hits = hits[start:]
+
+        if 'scroll' not in params:
+            return 200, self.format_response(hits[:size], total, body)
+
+        scroll_id = u"scroll-{0}".format(next(self.counter))
+        if params.get('search_type') == 'scan':
+            page = []
+        else:
+            page, hits = hits[:size], hits[size:]
+        self.scrolls[scroll_id] = (hits, size, body)
+        response = self.format_response(page, total, body)
+        response['_scroll_id'] = scroll_id
+        return 200, response
+
+    def scroll(self, method, parts, params, body):
+        body = self.loads(body) if body and body.strip()[:1] == '{' else body
+        if isinstance(body, dict):
+            scroll_ids = body.get('scroll_id')
+        else:
+            scroll_ids = body or params.get('scroll_id') or (
+                parts[0] if parts else None
+            )
+        if isinstance(scroll_ids, six.string_types):
+            scroll_ids = scroll_ids.split(',')
+
+        if method == 'DELETE':
+            for scroll_id in scroll_ids or list(self.scrolls):
+                self.scrolls.pop(scroll_id, None)
+            return 200, {'succeeded': True}
+
+        scroll_id = scroll_ids[0]
+        if scroll_id not in self.scrolls:
+            raise StoreError(
+                404,
+                'search_context_missing_exception',
+                u"No search context found for id [{0}]".format(scroll_id)
+            )
+        hits, size, search_body = self.scrolls[scroll_id]
+        page, hits = hits[:size], hits[size:]
+        self.scrolls[scroll_id] = (hits, size, search_body)
+        response = self.format_response(page, len(page), search_body)
+        response['_scroll_id'] = scroll_id
+        return 200, response
+
+    def msearch(self, body, default_parts):
+        lines = self.iter_lines(body)
+        responses = []
+        for header in lines:
+            search_body = next(lines)
+            index_name = header.get('index', (default_parts or [None])[0])
+            doc_type = header.get('type')
+            if isinstance(index_name, list):
+                index_name = ','.join(index_name)
+            if isinstance(doc_type, list):
+                doc_type = ','.join(doc_type)
+            parts = [index_name or '_all']
+            if doc_type:
+                parts.append(doc_type)
+            params = dict(
+                (key, value) for key, value in header.items()
+                if key in ('from', 'size')
+            )
+            try:
+                status, response = self.search(parts, params, search_body)
+            except StoreError as exc:
+                response = exc.to_dict()
+            responses.append(response)
+        return 200, {'responses': responses}
+
+    def count(self, parts, body):
+        return 200, {
+            'count': len(self.find(parts, body)),
+            '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+        }
+
+    ##################################################
+    #                     Reindex                    #
+    ##################################################
+
+    def reindex(self, params, body):
+        source = body['source']
+        parts = [source['index']]
+        if isinstance(parts[0], list):
+            parts[0] = ','.join(parts[0])
+        doc_types = source.get('type')
+        if doc_types:
+            if isinstance(doc_types, list):
+                doc_types = ','.join(doc_types)
+            parts.append(doc_types)
+        dest_name = body['dest']['index']
+        wait = params.get('wait_for_completion') not in ('false', False)
+
+        created = updated = 0
+        error = None
+        try:
+            for hit in self.find(parts, {'query': source.get('query')}):
+                status, data = self.index_doc(
+                    dest_name,
+                    body['dest'].get('type', hit['_type']),
+                    hit['_id'],
+                    copy.deepcopy(hit['_source'])
+                )
+                if data['created']:
+                    created += 1
+                else:
+                    updated += 1
+        except StoreError as exc:
+            if wait:
+                raise
+            # Tasks which failed as a whole are stored with their error.
+            error = exc.to_dict()['error']
+        response = {
+            'took': 1,
+            'timed_out': False,
+            'total': created + updated,
+            'created': created,
+            'updated': updated,
+            'deleted': 0,
+            'batches': 1,
+            'version_conflicts': 0,
+            'noops': 0,
+            'failures': [],
+        }
+        if not wait:
+            task_id = u"memory:{0}".format(next(self.counter))
+            task = {
+                'completed': True,
+                'task': {'id': task_id, 'status': response},
+            }
+            if error is None:
+                task['response'] = response
+            else:
+                task['error'] = error
+            self.tasks[task_id] = task
+            return 200, {'task': task_id}
+        return 200, response
+
+    def get_task(self, task_id):
+        if task_id not in self.tasks:
+            raise StoreError(
+                404,
+                'resource_not_found_exception',
+                u"task [{0}] isn't running or stored".format(task_id)
+            )
+        return 200, self.tasks[task_id]
+
+
+def get_store(host='localhost', port=9200):
+    """
+    Return the store shared by the connections to a host.
+    """
+    key = u"{0}:{1}".format(host, port)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = InMemoryStore()
+        return _stores[key]
+
+
+def clear_stores():
+    """
+    Drop every index of every in-memory host.
+    """
+    with _stores_lock:
+        for store in _stores.values():
+            store.clear()
+
+
+class InMemoryConnection(Connection):
+    """
+    Connection class answering requests from an in-memory store instead of
+    an ElasticSearch node.
+    """
+
+    def __init__(self, host='localhost', port=9200, **kwargs):
+        super(InMemoryConnection, self).__init__(
+            host=host,
+            port=port,
+            **kwargs
+        )
+        self.store = get_store(host, port)
+
+    def perform_request(
+            self,
+            method,
+            url,
+            params=None,
+            body=None,
+            timeout=None,
+            ignore=()):
+        path = url[len(self.url_prefix):] if self.url_prefix else url
+        params = dict(params or {})
+        for key, value in params.items():
+            if isinstance(value, six.binary_type):
+                params[key] = value.decode('utf-8')
+        status, data = self.store.handle(method, path, params, body)
+        raw_data = json.dumps(data)
+        if not (200 <= status < 300) and status not in ignore:
+            self.log_request_fail(method, url, body, 0, status, raw_data)
+            self._raise_error(status, raw_data)
+        self.log_request_success(method, url, url, body, status, raw_data, 0)
+        return status, {}, raw_data
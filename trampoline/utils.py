@@ -0,0 +1,21 @@
+"""
+Utils for trampoline.
+"""
+from importlib import import_module
+
+
+def import_path(path):
+    """
+    Return the object designated by a dotted path, such as a class of a
+    module. Django 1.4 has neither import_string nor import_by_path.
+    """
+    module_path, name = path.rsplit('.', 1)
+    return getattr(import_module(module_path), name)
+
+
+def get_model_name(model):
+    """
+    Lowercase name of a model, called module_name before Django 1.6.
+    """
+    options = model._meta
+    return getattr(options, 'model_name', None) or options.module_name
@@ -3,11 +3,15 @@ Views for trampoline.
 """
 from django.utils.functional import cached_property
 
+from trampoline.paginator import ESSearchBatch
 from trampoline.paginator import ESSearchPaginator
 
 
 class ESPaginationMixin(object):
+    paginator_class = ESSearchPaginator
     page_size = 10
+    cursor_pagination = False
+    cursor_handoff = False
 
     def get_search(self):
         raise NotImplementedError
@@ -22,9 +26,28 @@ class ESPaginationMixin(object):
             number = 1
         return number
 
+    def get_cursor(self):
+        return self.request.GET.get('cursor') or None
+
+    @cached_property
+    def search_batch(self):
+        """
+        Batch shared by the searches of the request, they are all sent in a
+        single msearch request once one of them is evaluated.
+        """
+        return ESSearchBatch()
+
     def paginate_search(self):
         search = self.get_search()
-        paginator = ESSearchPaginator(search, self.page_size)
+        paginator = self.paginator_class(
+            search,
+            self.page_size,
+            batch=self.search_batch,
+            cursor_handoff=self.cursor_handoff
+        )
+        cursor = self.get_cursor()
+        if self.cursor_pagination or cursor is not None:
+            return paginator.cursor_page(cursor)
         page_number = self.get_page_number()
         return paginator.page(page_number)
 